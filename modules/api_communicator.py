@@ -2,21 +2,48 @@
 
 """ Communicates with google sheets using Google Sheet API both reading and writing data to
 the sheets. """
-import math
+import csv
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 from PyQt5.QtCore import pyqtSignal, QObject
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
 from helper_modules import helper_functions
 
 # Self defined modules
 import settings
+from api_usage import ApiUsage
 from box_distributor import Distributor
 from db_communicator import DatabaseCommunicator
-
-API_INFO_JSON_CONTENTS = helper_functions.json_file_loader(
-    file_name=settings.INFORMATION_JSON
-)
+from fixed_point import boxes_to_fixed, ceil_boxes, round_div, round_to_boxes
+from order_aggregates import LogisticAggregates
+from order_schema import (columns_to_orders, get_column_runs, row_to_order,
+                          ALPHA_POSITION, CHANNEL, CLIENT_ORDER, DETAIL, LOGISTIC, PALLET_RATIO,
+                          PRIORITY, PRODUCT_CODE, QUANTITY, SHIPPING_DATE)
+from order_snapshot import get_orders_hash, load_snapshot, save_snapshot
+from output_partitions import PartitionPublisher, PARTITION_HEADER
+from pallet_optimizer import PalletMixOptimizer
+from placement_strategies import resolve_strategies, StrategyStats
+from placement_trace import PlacementTrace
+from plan_exporter import PlanExporter
+from plan_history import PlanHistory
+from run_checkpoint import get_checkpoint_orders_hash, get_input_hash, has_checkpoint, RunCheckpoint
+from planning_context import get_default_context
+from sheet_ranges import (build_a1_range, column_to_index, index_to_column, split_a1_range,
+                          to_cell_data, to_grid_range)
+
+_PREFETCH_EXECUTOR = None
+
+
+def get_prefetch_executor() -> ThreadPoolExecutor:
+    """ Returns the executor used to fetch the inputs of planning runs concurrently. """
+    global _PREFETCH_EXECUTOR
+    if _PREFETCH_EXECUTOR is None:
+        _PREFETCH_EXECUTOR = ThreadPoolExecutor(max_workers=settings.PREFETCH_WORKERS,
+                                                thread_name_prefix='ped_prefetch')
+    return _PREFETCH_EXECUTOR
 
 
 class PedApi(QObject):
@@ -27,13 +54,56 @@ class PedApi(QObject):
     unfinished = pyqtSignal(str)
     empty_orders = pyqtSignal(str)
     empty_order_table = pyqtSignal(str)
-
-    processed_orders = []
+    api_budget_warning = pyqtSignal(str)
+    history_error = pyqtSignal(str)
+    export_error = pyqtSignal(str)
+    plan_ready = pyqtSignal()
 
     def __init__(self, order_spreadsheet: str = None, overwrite_data: bool = True,
-                 for_pallets: bool = False, user_max_boxes: int = 0):
+                 for_pallets: bool = False, user_max_boxes: int = 0,
+                 order_file: str = None, context=None, output_targets: list = None,
+                 dry_run: bool = False, preview_before_write: bool = False, resume_saved_orders: bool = False):
         super(PedApi, self).__init__()
 
+        # Credentials, Sheets service and pallet range tables, possibly shared
+        # with other PedApi classes. Nothing is loaded until it's needed
+        self.context = context if context is not None else get_default_context()
+
+        # Path of a local file (csv) to read orders from instead of a Google Sheet
+        self.order_file = order_file
+
+        # A dry run reads its inputs and constructs pallets but writes nothing: no output,
+        # checkpoint, history or API usage log, and the writing range isn't cleared
+        self.dry_run = dry_run
+
+        # Whether the run may resume an interrupted one on the orders it saved (see _load_order_snapshot),
+        # and whether it did
+        self.resume_saved_orders = resume_saved_orders
+        self.used_saved_orders = False
+
+        # Where the plan is written: 'sheet' (where orders were read from) and/or 'local' (see PlanExporter)
+        self.output_targets = output_targets if output_targets is not None else settings.PLAN_OUTPUT_TARGETS
+        if dry_run:
+            self.output_targets = []
+
+        # If set, construct_pallets stops once the plan is ready (emitting plan_ready) and
+        # nothing is cleared or written until write_previewed_plan is called
+        self.preview_before_write = preview_before_write
+
+        # How the plan replaces the existing output in the sheet: 'full' (clear and append) or 'diff'
+        self.sheet_write_mode = settings.SHEET_WRITE_MODE
+        # Rows in the output block before writing (diff mode), sheetIds of the order
+        # spreadsheet (diff and atomic modes) and what the write did
+        self.current_output = None
+        self.sheet_ids = None
+        # Rows and columns of each sheet, by sheetId (see _get_grid_expansion)
+        self.sheet_grids = {}
+        self.write_stats = {}
+        # Partition tabs may be added by several threads (see write_partition)
+        self._sheet_ids_lock = threading.Lock()
+        # Publishes the partitions of the plan as it's constructed ('partitions' output)
+        self._partition_publisher = None
+
         self.overwrite_data = overwrite_data
         # This is use to minimize the number of time google sheet
         # API is called to read data
@@ -41,44 +111,51 @@ class PedApi(QObject):
 
         self.user_max_boxes = user_max_boxes
 
-        self.scopes = ['https://www.googleapis.com/auth/spreadsheets']
-        self.api_key_file = API_INFO_JSON_CONTENTS.get('api_key_file_name')
-        self.api_creds = service_account.Credentials.from_service_account_file(
-            self.api_key_file, scopes=self.scopes
-        )
+        # The app's information json is loaded (once per process) by the context
+        app_info = self.context.app_info
 
         # Google SpreadSheets Info
         self.order_spreadsheet_id = helper_functions.get_sheet_id(
             google_sheet_link=order_spreadsheet
         )
-        self.order_sheet_range_to_read = API_INFO_JSON_CONTENTS.get('order_range_sheet_read')
-        self.order_sheet_range_to_clear = API_INFO_JSON_CONTENTS.get('order_range_sheet_to_be_cleared')
+        self.order_sheet_range_to_read = app_info.get('order_range_sheet_read')
+        self.order_sheet_range_to_clear = app_info.get('order_range_sheet_to_be_cleared')
 
         # Some information related to Google Sheet where pallet ranges are stored
-        self.pallet_info_sheet_link = API_INFO_JSON_CONTENTS.get('pallet_range_sheet_link')
+        self.pallet_info_sheet_link = app_info.get('pallet_range_sheet_link')
         self.pallet_info_sheet_id = helper_functions.get_sheet_id(
             google_sheet_link=self.pallet_info_sheet_link
         )
-        self.pallet_info_read_range = API_INFO_JSON_CONTENTS.get('pallet_range_sheet_name')
+        self.pallet_info_read_range = app_info.get('pallet_range_sheet_name')
 
         # Some information related to Google Sheet where pallet ranges related to Kievit are stored
-        self.kievit_sheet_link = API_INFO_JSON_CONTENTS.get('kievit_sheet_link')
+        self.kievit_sheet_link = app_info.get('kievit_sheet_link')
         self.kievit_sheet_id = helper_functions.get_sheet_id(
             google_sheet_link=self.kievit_sheet_link
         )
-        self.kievit_range_to_read = API_INFO_JSON_CONTENTS.get('kievit_sheet_range')
+        self.kievit_range_to_read = app_info.get('kievit_sheet_range')
 
-        self.pallet_dict_range = API_INFO_JSON_CONTENTS.get('pallet_dict_range')
+        self.pallet_dict_range = app_info.get('pallet_dict_range')
 
-        self.api_service = None
-        self.sheet_api = None
+        self.all_orders = []
 
-        self._create_pallet_api_service()
+        # Product codes (ADP orders for Albero del Paradiso) already placed on pallets
+        self.processed_orders = []
 
-        self.all_orders = []
+        # Variety and client totals of the logistic being placed (see _get_aggregates)
+        self._aggregates = None
 
-        # Saves the final data that will be written to google sheet
+        # Saves the final data that will be written to google sheet and,
+        # for each of its rows, the logistic and client order it comes from
         self.final_data = []
+        self.placement_details = []
+
+        # Decisions taken while placing boxes, if they are traced (see placement_trace.py)
+        self.trace = PlacementTrace() if settings.PLACEMENT_TRACE else None
+
+        # Capacity and space occupied (fixed point) of each pallet filled by the
+        # range tables' suggestions, by pallet full name (see get_plan_stats)
+        self.pallet_loads = {}
 
         # This dict stores information like last pallet number, last pallet letter
         # and the range for writing
@@ -86,23 +163,126 @@ class PedApi(QObject):
                             'last_pallet_letter': "",
                             'order_range_sheet_for_writing': "Feed Algoritmo per PED!Q2"}
 
-        if self.for_pallet:
-            self.update_sheet_writing_range()
-            self.get_all_orders()
-            self.populate_pallet_dict()
+        self.order_sheet_range_to_write = self.pallet_dict.get(
+            'order_range_sheet_for_writing'
+        )
+
+        # Pallet range tables loaded in memory by the prefetch
+        self.range_tables = None
+
+        # Futures of the inputs fetched concurrently by start_prefetch
+        self._prefetch = {}
+
+        # Set once prepare_run has fetched the data needed for constructing pallets
+        self.run_prepared = False
+
+        # Outcome of construct_pallets: 'done', 'failed', 'empty_orders' or 'empty_order_table'
+        self.run_status = None
+        self.run_message = ''
+
+        # Set when construct_pallets starts
+        self.run_id = None
+        self.run_started_at = None
+
+        # Checkpoint of the run, kept until the plan is written
+        self._checkpoint = None
+        # Position of each order in the orders the run started from (by id), what the current
+        # logistic changed of them (position -> None if removed, else [quantity, ratio]) and the
+        # sizes of final_data and processed_orders when it started (see _save_checkpoint)
+        self._order_positions = None
+        self._changed_orders = {}
+        self._checkpoint_marks = (0, 0)
+
+        # Logistics, pallets and time spent by each placement strategy during the run
+        self.strategy_stats = StrategyStats()
+
+        # Sheets API calls made by this class and their totals (see api_usage.py)
+        self.api_usage = ApiUsage(on_warning=self.api_budget_warning.emit)
+
+        # Compares the pallet range tables' suggestions with the mixes it finds (see pallet_optimizer.py)
+        self.pallet_optimizer = None if settings.PALLET_OPTIMIZER_MODE == 'off' else PalletMixOptimizer()
+
+    @property
+    def api_service(self):
+        """ The Google Sheets service, built the first time it's needed. """
+        return self.context.get_api_service()
+
+    @property
+    def sheet_api(self):
+        """ The spreadsheets resource of the Google Sheets service. """
+        return self.api_service.spreadsheets()
+
+    def start_prefetch(self):
+        """ Starts fetching all the inputs of a planning run concurrently:
+        credential refresh, pallet range tables (local), writing range clear,
+        orders and pallet dict. The Sheets calls wait only for the credentials. """
+        if self._prefetch:
+            return
+        executor = get_prefetch_executor()
+        if self.order_file:
+            self._prefetch = {
+                'range_tables': executor.submit(self.load_range_tables),
+                'orders': executor.submit(self.get_all_orders),
+                'pallet_dict': executor.submit(self.populate_pallet_dict),
+            }
+            return
+
+        creds_future = executor.submit(self._prepare_api_access)
+
+        def after_creds(job):
+            creds_future.result()
+            return job()
+
+        self._prefetch = {
+            'credentials': creds_future,
+            'range_tables': executor.submit(self.load_range_tables),
+            'orders': executor.submit(after_creds, self.get_all_orders),
+            'pallet_dict': executor.submit(after_creds, self.populate_pallet_dict),
+        }
+        if self.dry_run:
+            return
+        if not self.preview_before_write:
+            self._prefetch['clear'] = executor.submit(after_creds, self.update_sheet_writing_range)
+        if self._writes_diff():
+            self._prefetch['current_output'] = executor.submit(after_creds, self.read_current_output)
+        if self._defers_clear() or self._writes_partitions():
+            self._prefetch['sheet_ids'] = executor.submit(after_creds, self.read_sheet_ids)
+
+    def wait_prefetch(self, *names):
+        """ Waits for the prefetched inputs in names, raising any error they ran into. """
+        for name in names:
+            self._prefetch[name].result()
+
+    def prepare_run(self):
+        """ Does all the network I/O needed before pallets can be constructed:
+        clears the writing range (if overwriting), reads the orders, the pallet dict
+        and the pallet range tables. All of them are fetched concurrently. """
+        if self.run_prepared:
+            return
+        self.start_prefetch()
+        self.wait_prefetch(*self._prefetch)
 
         self.order_sheet_range_to_write = self.pallet_dict.get(
             'order_range_sheet_for_writing'
         )
+        self.run_prepared = True
+
+    def load_range_tables(self) -> dict:
+        """ Loads the pallet range tables in memory (they are cached by the context). """
+        self.range_tables = self.context.get_range_tables()
+        return self.range_tables
 
     def populate_pallet_dict(self):
         """ Reads from Google sheet and updates this class attribute called pallet_dict."""
         # If user chose not to overwrite existing data
         if not self.overwrite_data:
+            if self.order_file:
+                self._populate_pallet_dict_from_file()
+                return
 
-            pallet_dict_data = self.sheet_api.values().get(
+            pallet_dict_data = self._execute(self.sheet_api.values().get(
                 spreadsheetId=self.order_spreadsheet_id,
-                range=self.pallet_dict_range).execute()
+                range=self.pallet_dict_range))
             values_read = pallet_dict_data.get('values', [])
             for value in values_read:
                 if len(value) > 1:
@@ -110,6 +290,100 @@ class PedApi(QObject):
                 else:
                     self.pallet_dict.update({value[0]: ""})
 
+    def _populate_pallet_dict_from_file(self):
+        """ Gets the last pallet number from the plan already written for the local order file. """
+        plan_file = self.get_plan_file_name()
+        if not os.path.exists(plan_file):
+            return
+        with open(plan_file, newline='', encoding='utf-8') as plan:
+            pallet_numbers = [int(row[5]) for row in csv.reader(plan, delimiter=settings.LOCAL_FILE_DELIMITER)
+                              if len(row) > 5 and row[5].isdigit()]
+        if pallet_numbers:
+            self.pallet_dict.update({'last_pallet_num': max(pallet_numbers)})
+
+    def get_plan_file_name(self) -> str:
+        """ Returns the name of the file where the plan of a local order file is written. """
+        return f'{os.path.splitext(self.order_file)[0]}{settings.LOCAL_PLAN_FILE_SUFFIX}'
+
+    def write_plan(self) -> bool:
+        """ Writes final_data to the output targets: where the orders were read from
+        ('sheet'), a tab per partition ('partitions') and/or to local files ('local').
+        The local export comes last and, if the plan was written elsewhere, failing it only
+        emits export_error: the sheet may have been cleared at the start of the run.
+        Returns True if the data was written successfully, False otherwise. """
+        written = self._write_plan_to_sheet()
+        if 'local' in self.output_targets:
+            try:
+                self.export_plan()
+            except (ImportError, OSError, ValueError) as error:
+                self.export_error.emit(f'Non sono riuscito a esportare il piano in locale: {error}')
+                if 'sheet' not in self.output_targets and 'partitions' not in self.output_targets:
+                    return False
+        return written
+
+    def _write_plan_to_sheet(self) -> bool:
+        """ Writes final_data where the orders were read from and to the partition tabs, if they
+        are output targets. Returns True if it was written (or there was nothing to write). """
+        partitions_written = True
+        if self._partition_publisher is not None:
+            partitions_written = self._partition_publisher.finish()
+            self._partition_publisher = None
+
+        if 'sheet' not in self.output_targets:
+            return partitions_written
+        if not partitions_written:
+            return False
+
+        if self.order_file:
+            return self.write_data_to_file()
+
+        if self._writes_diff():
+            return self.write_diff_to_google_sheet()
+
+        if self._defers_clear():
+            return self.commit_plan_atomically()
+
+        write_request_response = self.write_data_to_google_sheet()
+        return bool(write_request_response.get('updates', {}).get('updatedRange'))
+
+    def export_plan(self) -> str:
+        """ Writes final_data and the run metadata to local files.
+        Returns the directory they were written in. """
+        return PlanExporter().export(run_id=self.run_id, final_data=self.final_data,
+                                     metadata=self.get_run_metadata())
+
+    def get_run_metadata(self) -> dict:
+        metadata = {
+            'source': self.order_file or self.order_spreadsheet_id,
+            'started_at': self.run_started_at,
+            'exported_at': time.time(),
+            'overwrite_data': self.overwrite_data,
+            'user_max_boxes': self.user_max_boxes,
+            'last_pallet_num': self.pallet_dict.get('last_pallet_num'),
+            'strategy_stats': self.strategy_stats.as_dict(),
+            'api_usage': self.api_usage.summary(),
+        }
+        if self.pallet_optimizer is not None:
+            metadata['pallet_optimizer'] = self.pallet_optimizer.summary()
+        return metadata
+
+    def save_to_history(self) -> bool:
+        """ Stores the plan of this run in the local plan history. """
+        plan_history = PlanHistory()
+        try:
+            return plan_history.save_run(run_id=self.run_id, final_data=self.final_data,
+                                         placement_details=self.placement_details,
+                                         metadata=self.get_run_metadata())
+        finally:
+            plan_history.close_connection()
+
+    def write_data_to_file(self) -> bool:
+        """ Writes final_data to the plan file of the local order file. """
+        file_mode = 'w' if self.overwrite_data else 'a'
+        with open(self.get_plan_file_name(), file_mode, newline='', encoding='utf-8') as plan:
+            csv.writer(plan, delimiter=settings.LOCAL_FILE_DELIMITER).writerows(self.final_data)
+        return True
+
     def write_data_to_google_sheet(self):
         write_request = self.api_service.spreadsheets().values().append(
             spreadsheetId=self.order_spreadsheet_id,
@@ -118,18 +392,244 @@ class PedApi(QObject):
             insertDataOption='OVERWRITE',
             body={'values': self.final_data}
         )
-        res = write_request.execute()
+        res = self._execute(write_request)
         return res
 
+    def _defers_clear(self) -> bool:
+        """ Returns True if the existing output isn't cleared at the start of the run
+        but replaced when the plan is written ('diff' and 'atomic' write modes). """
+        return self.overwrite_data and not self.order_file and self.sheet_write_mode in ('diff', 'atomic')
+
+    def read_sheet_ids(self) -> dict:
+        """ Reads the sheetId and the size of each sheet of the order spreadsheet. """
+        spreadsheet = self._execute(self.sheet_api.get(
+            spreadsheetId=self.order_spreadsheet_id,
+            fields='sheets.properties(sheetId,title,gridProperties(rowCount,columnCount))'
+        ))
+        self.sheet_ids = {sheet['properties']['title']: sheet['properties']['sheetId']
+                          for sheet in spreadsheet.get('sheets', [])}
+        for sheet in spreadsheet.get('sheets', []):
+            self._record_grid(sheet['properties'])
+        return self.sheet_ids
+
+    def _record_grid(self, sheet_properties: dict):
+        grid_properties = sheet_properties.get('gridProperties', {})
+        self.sheet_grids[sheet_properties['sheetId']] = [grid_properties.get('rowCount', 0),
+                                                         grid_properties.get('columnCount', 0)]
+
+    def _get_grid_expansion(self, sheet_id: int, row_count: int, column_count: int) -> list:
+        """ Returns the appendDimension requests sheet_id needs to have at least row_count rows
+        and column_count columns: unlike values.append, updateCells doesn't add rows and fails
+        beyond the grid. The grid is recorded as expanded, call it only right before sending them. """
+        grid = self.sheet_grids.get(sheet_id)
+        if grid is None:
+            return []
+        requests = []
+        for position, (dimension, needed) in enumerate((('ROWS', row_count), ('COLUMNS', column_count))):
+            if needed > grid[position]:
+                requests.append({'appendDimension': {'sheetId': sheet_id, 'dimension': dimension,
+                                                     'length': needed - grid[position]}})
+        return requests
+
+    def _grid_expanded(self, sheet_id: int, row_count: int, column_count: int):
+        """ Records that sheet_id has at least row_count rows and column_count columns. """
+        grid = self.sheet_grids.get(sheet_id)
+        if grid is not None:
+            grid[0], grid[1] = max(grid[0], row_count), max(grid[1], column_count)
+
+    def commit_plan_atomically(self) -> bool:
+        """ Clears the ranges to be cleared and writes final_data in a single
+        spreadsheets.batchUpdate: the sheet goes from the old plan to the new one
+        without ever being empty, and is left untouched if the request fails. """
+        if self.sheet_ids is None:
+            self.read_sheet_ids()
+
+        clear_ranges = self.order_sheet_range_to_clear
+        if isinstance(clear_ranges, str):
+            clear_ranges = [clear_ranges]
+        requests = [{'updateCells': {'range': to_grid_range(clear_range, self.sheet_ids),
+                                     'fields': 'userEnteredValue'}}
+                    for clear_range in clear_ranges]
+
+        write_range = to_grid_range(self.order_sheet_range_to_write, self.sheet_ids)
+        grid_size = (write_range.get('startRowIndex', 0) + len(self.final_data),
+                     write_range.get('startColumnIndex', 0) + max(map(len, self.final_data), default=0))
+        if self.final_data:
+            # The sheet grows first if the plan is longer (or wider) than it
+            requests = self._get_grid_expansion(write_range['sheetId'], *grid_size) + requests
+            requests.append({'updateCells': {
+                'start': {'sheetId': write_range['sheetId'],
+                          'rowIndex': write_range.get('startRowIndex', 0),
+                          'columnIndex': write_range.get('startColumnIndex', 0)},
+                'rows': [{'values': [to_cell_data(value) for value in row]} for row in self.final_data],
+                'fields': 'userEnteredValue'
+            }})
+
+        commit_response = self._execute(self.sheet_api.batchUpdate(
+            spreadsheetId=self.order_spreadsheet_id,
+            body={'requests': requests}
+        ))
+        self.write_stats = dict(self.write_stats, mode='atomic', rows=len(self.final_data))
+        committed = len(commit_response.get('replies', [])) == len(requests)
+        if committed:
+            self._grid_expanded(write_range['sheetId'], *grid_size)
+        return committed
+
+    def _writes_partitions(self) -> bool:
+        """ Returns True if the plan is also written to a tab per partition (see output_partitions.py). """
+        return 'partitions' in self.output_targets and not self.order_file
+
+    def write_partition(self, title: str, rows: list) -> bool:
+        """ Writes rows (a partition of final_data) to the tab named title, adding it if it doesn't exist.
+        When overwriting, the tab is cleared and written in a single request. """
+        sheet_id, tab_added = self._get_or_add_sheet(title)
+        if not self.overwrite_data:
+            values = [PARTITION_HEADER] + rows if tab_added else rows
+            if not values:
+                return True
+            append_response = self._execute(self.sheet_api.values().append(
+                spreadsheetId=self.order_spreadsheet_id,
+                range=build_a1_range(sheet_name=title, start_column='A', start_row=1),
+                valueInputOption='USER_ENTERED',
+                insertDataOption='INSERT_ROWS',
+                body={'values': values}
+            ))
+            return bool(append_response.get('updates', {}).get('updatedRange'))
+
+        grid_size = (len(rows) + 1, max(map(len, [PARTITION_HEADER] + rows)))
+        requests = self._get_grid_expansion(sheet_id, *grid_size) + [
+            {'updateCells': {'range': {'sheetId': sheet_id}, 'fields': 'userEnteredValue'}},
+            {'updateCells': {
+                'start': {'sheetId': sheet_id, 'rowIndex': 0, 'columnIndex': 0},
+                'rows': [{'values': [to_cell_data(value) for value in row]} for row in [PARTITION_HEADER] + rows],
+                'fields': 'userEnteredValue'
+            }}]
+        commit_response = self._execute(self.sheet_api.batchUpdate(
+            spreadsheetId=self.order_spreadsheet_id,
+            body={'requests': requests}
+        ))
+        committed = len(commit_response.get('replies', [])) == len(requests)
+        if committed:
+            self._grid_expanded(sheet_id, *grid_size)
+        return committed
+
+    def delete_partition_tabs(self, keep_titles: set) -> bool:
+        """ Deletes the partition tabs (titles starting with PARTITION_SHEET_PREFIX) not in keep_titles,
+        left by earlier runs whose dates (or channels) aren't in this plan.
+        The sheets orders are read from and written to are never deleted. """
+        keep_titles = set(keep_titles) | {split_a1_range(a1_range)['sheet_name'] for a1_range
+                                          in (self.order_sheet_range_to_read, self.order_sheet_range_to_write)
+                                          if a1_range}
+        with self._sheet_ids_lock:
+            if self.sheet_ids is None:
+                self.read_sheet_ids()
+            stale_titles = [title for title in self.sheet_ids
+                            if title.startswith(settings.PARTITION_SHEET_PREFIX) and title not in keep_titles]
+            if not stale_titles:
+                return True
+            self._execute(self.sheet_api.batchUpdate(
+                spreadsheetId=self.order_spreadsheet_id,
+                body={'requests': [{'deleteSheet': {'sheetId': self.sheet_ids[title]}} for title in stale_titles]}
+            ))
+            for title in stale_titles:
+                self.sheet_grids.pop(self.sheet_ids.pop(title), None)
+            return True
+
+    def _get_or_add_sheet(self, title: str) -> tuple:
+        """ Returns the sheetId of the tab named title and whether it had to be added. """
+        with self._sheet_ids_lock:
+            if self.sheet_ids is None:
+                self.read_sheet_ids()
+            if title in self.sheet_ids:
+                return self.sheet_ids[title], False
+            add_response = self._execute(self.sheet_api.batchUpdate(
+                spreadsheetId=self.order_spreadsheet_id,
+                body={'requests': [{'addSheet': {'properties': {'title': title}}}]}
+            ))
+            sheet_properties = add_response['replies'][0]['addSheet']['properties']
+            self.sheet_ids[title] = sheet_properties['sheetId']
+            self._record_grid(sheet_properties)
+            return self.sheet_ids[title], True
+
+    def _writes_diff(self) -> bool:
+        """ Returns True if the plan replaces the sheet's output by writing only the rows that changed. """
+        return self.overwrite_data and not self.order_file and self.sheet_write_mode == 'diff'
+
+    def _get_output_block_range(self, first_row: int = None, last_row: int = None) -> str:
+        """ Returns the range of the output block (the columns final_data is written in),
+        from first_row to last_row (from the first row of the writing range to the end by default). """
+        range_parts = split_a1_range(self.order_sheet_range_to_write)
+        start_column = range_parts['start_column']
+        end_column = index_to_column(column_to_index(start_column) + settings.OUTPUT_COLUMNS - 1)
+        return build_a1_range(sheet_name=range_parts['sheet_name'],
+                              start_column=start_column, start_row=first_row or range_parts['start_row'],
+                              end_column=end_column, end_row=last_row)
+
+    def read_current_output(self) -> list:
+        """ Reads the rows currently in the output block of the order sheet. """
+        current_output = self._execute(self.sheet_api.values().get(
+            spreadsheetId=self.order_spreadsheet_id,
+            range=self._get_output_block_range()
+        ))
+        self.current_output = current_output.get('values', [])
+        return self.current_output
+
+    def write_diff_to_google_sheet(self) -> bool:
+        """ Replaces the output in the sheet with final_data writing only the rows that differ
+        from those already there (blanking the ones left over), in a single batchUpdate.
+        If too many rows changed, the whole output is rewritten as usual. """
+        if self.current_output is None:
+            self.read_current_output()
+
+        first_row = split_a1_range(self.order_sheet_range_to_write)['start_row'] or 1
+        new_rows = [[str(value) for value in row] for row in self.final_data]
+        old_rows = [row + [''] * (settings.OUTPUT_COLUMNS - len(row)) for row in self.current_output]
+        empty_row = [''] * settings.OUTPUT_COLUMNS
+
+        changed_rows = [row_index for row_index in range(max(len(new_rows), len(old_rows)))
+                        if (new_rows[row_index] if row_index < len(new_rows) else empty_row) !=
+                        (old_rows[row_index] if row_index < len(old_rows) else empty_row)]
+
+        total_rows = max(len(new_rows), len(old_rows), 1)
+        self.write_stats = {'mode': 'diff', 'rows': len(new_rows), 'changed_rows': len(changed_rows)}
+        if len(changed_rows) / total_rows > settings.DIFF_WRITE_MAX_CHANGED_SHARE:
+            return self.commit_plan_atomically()
+
+        if not changed_rows:
+            return True
+
+        # Contiguous changed rows are sent as a single range
+        value_ranges = []
+        block = [changed_rows[0]]
+        for row_index in changed_rows[1:] + [None]:
+            if row_index is not None and row_index == block[-1] + 1:
+                block.append(row_index)
+                continue
+            value_ranges.append({
+                'range': self._get_output_block_range(first_row=first_row + block[0],
+                                                      last_row=first_row + block[-1]),
+                'values': [self.final_data[index] if index < len(self.final_data) else empty_row
+                           for index in block]
+            })
+            block = [row_index]
+
+        self._execute(self.api_service.spreadsheets().values().batchUpdate(
+            spreadsheetId=self.order_spreadsheet_id,
+            body={'valueInputOption': 'USER_ENTERED', 'data': value_ranges}
+        ))
+        return True
+
     def update_sheet_writing_range(self):
         """ Clears the existing data in google sheet.
-        Updates the range for data writing, last pallet_num and last pallet alpha. """
-        if self.overwrite_data:
+        Updates the range for data writing, last pallet_num and last pallet alpha.
+        Nothing is cleared here when the output is replaced at the end of the run
+        ('diff' and 'atomic' write modes). """
+        if self.overwrite_data and not self._defers_clear():
             # Clear existing data in google sheet
-            self.api_service.spreadsheets().values().batchClear(
+            self._execute(self.api_service.spreadsheets().values().batchClear(
                 spreadsheetId=self.order_spreadsheet_id,
                 body={'ranges': self.order_sheet_range_to_clear}
-            ).execute()
+            ))
         else:
             pass
 
@@ -139,81 +639,76 @@ class PedApi(QObject):
         pallet_code_name = settings.PALLETS_BASE_INFO.get(pallet_type)[0]
 
         boxes_info = boxes_per_pallets_info['result'].get(pallet_code_name)
+        trace = self.trace
 
         for pallet_full_name, pallet_details in boxes_info.items():
-            pallet_cap = pallet_details[0]
+            # Capacity and ratios are in fixed point (see fixed_point.py)
+            pallet_cap = boxes_to_fixed(pallet_details[0])
 
             corb_orders = self.get_corbari_orders(corbari_logistic=corbari_logistic)
             if corb_orders:
                 for current_corb_order in corb_orders:
 
                     if pallet_cap <= 0:
+                        if trace is not None:
+                            trace.record(pallet_full_name, current_corb_order, pallet_cap, 'pallet_full')
                         break
 
-                    product_ordered_code = current_corb_order[0]
+                    product_ordered_code = current_corb_order[PRODUCT_CODE]
 
-                    if product_ordered_code in PedApi.processed_orders:
+                    if product_ordered_code in self.processed_orders:
+                        if trace is not None:
+                            trace.record(pallet_full_name, current_corb_order, pallet_cap, 'already_processed')
                         continue
-                    qta_ordered = int(current_corb_order[2])
-                    product_pallet_ratio = float(helper_functions.name_controller(
-                        name=str(current_corb_order[6]), char_to_remove=',',
-                        new_char='.'
-                    ))
+                    qta_ordered = int(current_corb_order[QUANTITY])
+                    product_pallet_ratio = current_corb_order[PALLET_RATIO]
 
                     qta_on_pallet = 0
                     qta_remaining = int(qta_ordered - qta_on_pallet)
 
                     if qta_remaining == 0:
                         continue
-                    elif product_pallet_ratio <= round(pallet_cap):
-                        self.final_data.append([product_ordered_code, qta_remaining, pallet_full_name,
-                                                pallet_code_name, pallet_details[1], pallet_details[2]])
+                    elif product_pallet_ratio <= round_to_boxes(pallet_cap):
+                        if trace is not None:
+                            trace.record(pallet_full_name, current_corb_order, pallet_cap, 'placed', qta_remaining)
+                        self._add_placement(current_corb_order, [product_ordered_code, qta_remaining,
+                                                                 pallet_full_name, pallet_code_name,
+                                                                 pallet_details[1], pallet_details[2]])
 
                         # Update some values
                         qta_on_pallet += qta_remaining
                         qta_remaining = int(qta_ordered - qta_on_pallet)
                         pallet_cap -= product_pallet_ratio
 
-                        PedApi.processed_orders.append(product_ordered_code)
-                        self.all_orders.remove(current_corb_order)
-                    elif product_pallet_ratio > round(pallet_cap):
+                        self._remove_order(current_corb_order, processed=True)
+                    elif product_pallet_ratio > round_to_boxes(pallet_cap):
 
-                        possible_product_qta = round((pallet_cap / product_pallet_ratio) * qta_remaining)
+                        possible_product_qta = round_div(pallet_cap * qta_remaining, product_pallet_ratio)
 
                         if possible_product_qta <= 0:
+                            if trace is not None:
+                                trace.record(pallet_full_name, current_corb_order, pallet_cap, 'no_room')
                             continue
                         else:
+                            if trace is not None:
+                                trace.record(pallet_full_name, current_corb_order, pallet_cap, 'split',
+                                             possible_product_qta)
                             qta_on_pallet += possible_product_qta
                             qta_remaining = int(qta_ordered - qta_on_pallet)
 
-                            ratio_occupied = (product_pallet_ratio / qta_ordered) * possible_product_qta
+                            ratio_occupied = round_div(product_pallet_ratio * possible_product_qta, qta_ordered)
                             pallet_cap -= ratio_occupied
-                            self.final_data.append([product_ordered_code, possible_product_qta, pallet_full_name,
-                                                    pallet_code_name, pallet_details[1], pallet_details[2]])
+                            self._add_placement(current_corb_order, [product_ordered_code, possible_product_qta,
+                                                                     pallet_full_name, pallet_code_name,
+                                                                     pallet_details[1], pallet_details[2]])
 
                             if qta_remaining == 0:
-                                PedApi.processed_orders.append(product_ordered_code)
-                                self.all_orders.remove(current_corb_order)
+                                self._remove_order(current_corb_order, processed=True)
                             else:
-                                product_qta_in_all_orders = float(
-                                    helper_functions.name_controller(
-                                        name=self.all_orders[self.all_orders.index(current_corb_order)][2],
-                                        char_to_remove=',', new_char='.'
-                                    )
-                                )
-
-                                # Modify the quantity of the current product
-                                self.all_orders[self.all_orders.index(current_corb_order)][2] = \
-                                    str(int(product_qta_in_all_orders - possible_product_qta))
-
-                                product_ratio_in_all_orders = float(helper_functions.name_controller(
-                                    name=self.all_orders[self.all_orders.index(current_corb_order)][6],
-                                    char_to_remove=',', new_char='.'
-                                ))
-
-                                # Modify the ratio of the current product
-                                self.all_orders[self.all_orders.index(current_corb_order)][6] = \
-                                    str(int(product_ratio_in_all_orders - ratio_occupied))
+                                self._update_order_remaining(order=current_corb_order,
+                                                             qta_placed=possible_product_qta,
+                                                             ratio_occupied=ratio_occupied)
+            self._record_pallet_load(pallet_full_name, pallet_details[0], pallet_cap)
 
     def place_boxes_on_pallets_alv(self, current_logistic: str,
                                    boxes_per_pallets_info: dict, pallet_type: str) -> None:
@@ -222,10 +717,11 @@ class PedApi(QObject):
         pallet_code_name = settings.PALLETS_BASE_INFO.get(pallet_type)[0]
 
         boxes_info = boxes_per_pallets_info['result'].get(pallet_code_name)
+        trace = self.trace
 
         # Start looping over pallets
         for pallet_full_name, pallet_details in boxes_info.items():
-            pallet_current_capacity = pallet_details[0]
+            pallet_current_capacity = boxes_to_fixed(pallet_details[0])
 
             logistic_clients = self.get_logistic_clients(logistic=current_logistic)
 
@@ -234,6 +730,9 @@ class PedApi(QObject):
 
                 # If the total ratio of current client is > pallet_current_capacity
                 if logistic_clients[client] > pallet_current_capacity:
+                    if trace is not None:
+                        for order in self.get_client_order(client_order_num=client):
+                            trace.record(pallet_full_name, order, pallet_current_capacity, 'client_too_big')
                     # Go on to the next client
                     continue
 
@@ -242,17 +741,17 @@ class PedApi(QObject):
                     client_order = self.get_client_order(client_order_num=client)
 
                     for order in client_order:
-                        product_ordered_code = order[0]
-                        qta_ordered = int(order[2])
-                        product_pallet_ratio = float(helper_functions.name_controller(
-                            name=str(order[6]), char_to_remove=',',
-                            new_char='.'
-                        ))
-                        self.final_data.append([product_ordered_code, qta_ordered, pallet_full_name,
-                                                pallet_code_name, pallet_details[1], pallet_details[2]])
+                        product_ordered_code = order[PRODUCT_CODE]
+                        qta_ordered = int(order[QUANTITY])
+                        product_pallet_ratio = order[PALLET_RATIO]
+                        if trace is not None:
+                            trace.record(pallet_full_name, order, pallet_current_capacity, 'placed', qta_ordered)
+                        self._add_placement(order, [product_ordered_code, qta_ordered, pallet_full_name,
+                                                    pallet_code_name, pallet_details[1], pallet_details[2]])
 
                         pallet_current_capacity -= product_pallet_ratio
-                        self.all_orders.remove(order)
+                        self._remove_order(order)
+            self._record_pallet_load(pallet_full_name, pallet_details[0], pallet_current_capacity)
 
     def place_boxes_on_pallets(self, current_logistic: str, boxes_per_pallets_info: dict,
                                pallet_type: str) -> None:
@@ -263,10 +762,12 @@ class PedApi(QObject):
         # Start looping over the boxes_per_pallets_info parameter
         # it is a named tuple containing dicts
         boxes_info = boxes_per_pallets_info['result'].get(pallet_code_name)
+        trace = self.trace
 
         for pallet_full_name, pallet_details in boxes_info.items():
 
-            pallet_cap = pallet_details[0]
+            # Capacity and ratios are in fixed point (see fixed_point.py)
+            pallet_cap = boxes_to_fixed(pallet_details[0])
             log_varieties = self.get_log_varieties(logistic=current_logistic)
             for variety in log_varieties:
                 if pallet_cap <= 0:
@@ -276,17 +777,18 @@ class PedApi(QObject):
                     for current_order in log_variety_order:
 
                         if pallet_cap <= 0:
+                            if trace is not None:
+                                trace.record(pallet_full_name, current_order, pallet_cap, 'pallet_full')
                             break
-                        product_ordered_code = current_order[0]
+                        product_ordered_code = current_order[PRODUCT_CODE]
 
-                        if product_ordered_code in PedApi.processed_orders:
+                        if product_ordered_code in self.processed_orders:
+                            if trace is not None:
+                                trace.record(pallet_full_name, current_order, pallet_cap, 'already_processed')
                             continue
 
-                        qta_ordered = int(current_order[2])
-                        product_pallet_ratio = float(helper_functions.name_controller(
-                            name=str(current_order[6]), char_to_remove=',',
-                            new_char='.'
-                        ))
+                        qta_ordered = int(current_order[QUANTITY])
+                        product_pallet_ratio = current_order[PALLET_RATIO]
 
                         # Keep track of the qtà of the current product that is on pallet
                         product_qta_on_pallet = 0
@@ -297,58 +799,52 @@ class PedApi(QObject):
                             # continue to the next product
                             continue
                         # If the current product_pallet_ratio is <= current pallet_details
-                        if product_pallet_ratio <= round(pallet_cap):
+                        if product_pallet_ratio <= round_to_boxes(pallet_cap):
+                            if trace is not None:
+                                trace.record(pallet_full_name, current_order, pallet_cap, 'placed', qta_remaining)
                             data_to_append = [product_ordered_code, qta_remaining, pallet_full_name,
                                               pallet_code_name, pallet_details[1], pallet_details[2]]
-                            self.final_data.append(data_to_append)
+                            self._add_placement(current_order, data_to_append)
 
                             # Update some values
                             product_qta_on_pallet += qta_remaining
                             qta_remaining = int(qta_ordered - product_qta_on_pallet)
                             pallet_cap -= product_pallet_ratio
 
-                            PedApi.processed_orders.append(product_ordered_code)
                             # Remove the current order from the list of orders
-                            self.all_orders.remove(current_order)
+                            self._remove_order(current_order, processed=True)
 
                         # Elif product_pallet_ratio > pallet_details
-                        elif product_pallet_ratio > round(pallet_cap):
+                        elif product_pallet_ratio > round_to_boxes(pallet_cap):
 
-                            possible_product_qta = round((pallet_cap / product_pallet_ratio) * qta_remaining)
+                            possible_product_qta = round_div(pallet_cap * qta_remaining, product_pallet_ratio)
 
                             # Do not put the current box on the pallet if it's possible quantity is <= 0
                             if possible_product_qta <= 0:
+                                if trace is not None:
+                                    trace.record(pallet_full_name, current_order, pallet_cap, 'no_room')
                                 # Continue to the next product
                                 continue
                             else:
+                                if trace is not None:
+                                    trace.record(pallet_full_name, current_order, pallet_cap, 'split',
+                                                 possible_product_qta)
                                 product_qta_on_pallet += possible_product_qta
                                 qta_remaining = qta_ordered - product_qta_on_pallet
 
-                                occupied_ratio = (product_pallet_ratio / qta_ordered) * possible_product_qta
+                                occupied_ratio = round_div(product_pallet_ratio * possible_product_qta, qta_ordered)
                                 pallet_cap -= occupied_ratio
-                                self.final_data.append([product_ordered_code, possible_product_qta, pallet_full_name,
-                                                        pallet_code_name, pallet_details[1], pallet_details[2]])
+                                self._add_placement(current_order, [product_ordered_code, possible_product_qta,
+                                                                    pallet_full_name, pallet_code_name,
+                                                                    pallet_details[1], pallet_details[2]])
 
                                 if qta_remaining == 0:
-                                    PedApi.processed_orders.append(product_ordered_code)
-                                    self.all_orders.remove(current_order)
+                                    self._remove_order(current_order, processed=True)
                                 else:
-                                    product_qta_in_all_orders = float(helper_functions.name_controller(
-                                        name=self.all_orders[self.all_orders.index(current_order)][2],
-                                        char_to_remove=',', new_char='.'
-                                    ))
-                                    # Modify the quantity of the current product
-                                    self.all_orders[self.all_orders.index(current_order)][2] = \
-                                        str(int(product_qta_in_all_orders - possible_product_qta))
-
-                                    product_ratio_in_all_orders = float(helper_functions.name_controller(
-                                        name=self.all_orders[self.all_orders.index(current_order)][6],
-                                        char_to_remove=',', new_char='.'
-                                    ))
-
-                                    # Modify the ratio of the current product
-                                    self.all_orders[self.all_orders.index(current_order)][6] = \
-                                        str(int(product_ratio_in_all_orders - occupied_ratio))
+                                    self._update_order_remaining(order=current_order,
+                                                                 qta_placed=possible_product_qta,
+                                                                 ratio_occupied=occupied_ratio)
+            self._record_pallet_load(pallet_full_name, pallet_details[0], pallet_cap)
 
     def place_boxes_on_pallets_adp(self, adp_logistic: str, pallet_type: str,
                                    pallet_number: str, pallet_alpha: str,
@@ -360,176 +856,302 @@ class PedApi(QObject):
         # the list of final data to be written
         current_adp_orders = self.get_adp_log_orders(adp_logistic=adp_logistic)
         for order in current_adp_orders:
-            data_to_append = [order[0], int(order[2]), pallet_full_name, pallet_type,
+            if self.trace is not None:
+                self.trace.record(pallet_full_name, order, 0, 'adp_pallet', int(order[QUANTITY]))
+            data_to_append = [order[PRODUCT_CODE], int(order[QUANTITY]), pallet_full_name, pallet_type,
                               pallet_alpha, pallet_number]
-            self.final_data.append(data_to_append)
-            self.all_orders.remove(order)
-            PedApi.processed_orders.append(order)
+            self._add_placement(order, data_to_append)
+            self._remove_order(order)
+            self.processed_orders.append(order)
 
     def construct_pallets(self):
-        """ Constructs pallets by putting boxes on them. """
+        """ Constructs pallets by putting boxes on them.
+        The run is recorded (see _close_run) however it ends, unless its plan is being previewed. """
+        try:
+            self._construct_pallets()
+        finally:
+            # A previewed run ends when its plan is written or discarded
+            if self.run_status != 'preview':
+                self._close_run()
+
+    def _construct_pallets(self):
+        self.run_started_at = time.time()
+        self.run_id = self._make_run_id()
         self.started.emit('Started constructing pallet')
-        db_reader_cls = DatabaseCommunicator()
+        if self.for_pallet and not self.run_prepared:
+            # Planning only needs the orders and the range tables to start,
+            # the other inputs keep on being fetched in the meantime
+            self.start_prefetch()
+            self.wait_prefetch('orders', 'range_tables')
+
+        db_reader_cls = DatabaseCommunicator(range_tables=self.range_tables)
         check_table = db_reader_cls.check_table(
             table_name=settings.PALLET_INFO_TABLE)
 
         # If the Pallet table is empty
         if not check_table:
-            self.empty_order_table.emit('Bisogna che aggiorni il database!\n'
-                                        'Lo puoi fare cliccando su "Aggiornare DB"')
+            self._end_run(self.empty_order_table, 'empty_order_table',
+                          'Bisogna che aggiorni il database!\n'
+                          'Lo puoi fare cliccando su "Aggiornare DB"')
 
         # If there is no order
         elif not self.all_orders:
-            self.empty_orders.emit('Nessun ordine in manuale!')
+            self._end_run(self.empty_orders, 'empty_orders', 'Nessun ordine in manuale!')
 
         else:
-            db_reader = DatabaseCommunicator(read_from_db=True)
+            db_reader = DatabaseCommunicator(read_from_db=True, range_tables=self.range_tables,
+                                             pallet_optimizer=self.pallet_optimizer)
             # Get all logistics and the total number of boxes each of them has
             all_logs = self.get_all_logistics()
 
+            # Pallet numbering and the writing range depend on the pallet dict
+            if self.for_pallet and not self.run_prepared:
+                self.prepare_run()
+
+            # Decide once how the pallets of each logistic are constructed
+            strategies = resolve_strategies(all_logs=all_logs, user_max_boxes=self.user_max_boxes)
+
+            # If an earlier run on the same input was interrupted, carry on from its last completed logistic
+            checkpoint = self._open_checkpoint()
+            self._checkpoint = checkpoint
+            completed_logistics = self._resume_from_checkpoint(checkpoint)
+
+            if self._writes_partitions():
+                # A previewed plan isn't published until it's confirmed
+                self._partition_publisher = PartitionPublisher(pallet_api=self, all_logs=all_logs,
+                                                               publish_early=not self.preview_before_write)
+
             # Start looping over the dict returned by get_all_logistics method
             for logistic, logistic_items in all_logs.items():
+                if logistic in completed_logistics:
+                    continue
+                strategy = strategies[logistic]
+                strategy_start = time.perf_counter()
+                first_pallet_num = int(self.pallet_dict.get('last_pallet_num') or 0)
 
-                # logistic_items is a list of this kind
-                # [a string concatenation of logistic -- date of shipping -- client name,
-                # the corresponding channel of the logistic in question,
-                # the total num of boxes the logistic has]
-                boxes = math.ceil(logistic_items[0])
+                # If the current logistic is for ADP
+                if strategy.sizing.get_pallets is None:
+                    self.construct_adp_pallet(logistic=logistic, logistic_items=logistic_items)
+                else:
+                    self.construct_logistic_pallets(logistic=logistic, logistic_items=logistic_items,
+                                                    strategy=strategy, db_reader=db_reader)
+
+                self.strategy_stats.record(
+                    strategy_name=strategy.name,
+                    pallets=int(self.pallet_dict.get('last_pallet_num') or 0) - first_pallet_num,
+                    seconds=time.perf_counter() - strategy_start
+                )
+                completed_logistics.append(logistic)
+                self._save_checkpoint(checkpoint, logistic)
+                if self._partition_publisher is not None:
+                    self._partition_publisher.logistic_done(logistic)
+
+            if self.preview_before_write:
+                self.run_status = 'preview'
+                self.plan_ready.emit()
+                return
+            self.finish_run()
+
+    def write_previewed_plan(self):
+        """ Writes the plan constructed by construct_pallets with preview_before_write,
+        once it has been confirmed, and ends the run. """
+        try:
+            # The existing output wasn't cleared while the plan was being previewed,
+            # and it may have been changed in the meantime
+            if not self.order_file and 'sheet' in self.output_targets:
+                self.update_sheet_writing_range()
+                if self._writes_diff():
+                    self.read_current_output()
+                if self._defers_clear():
+                    self.read_sheet_ids()
+            self.finish_run()
+        finally:
+            self._close_run()
+
+    def discard_plan(self):
+        """ Ends a run whose previewed plan won't be written. """
+        self.processed_orders.clear()
+        if self._checkpoint is not None:
+            self._checkpoint.close()
+        self.run_status = 'cancelled'
+        self.run_message = 'Piano non scritto'
+        self._close_run()
+
+    def finish_run(self):
+        """ Writes the plan constructed and ends the run. """
+        # write the final data
+        write_succeeded = self.write_plan()
+
+        # Clear the list that stores already processed orders
+        self.processed_orders.clear()
+
+        # If the data writing request was successful
+        if write_succeeded:
+            if self._checkpoint is not None:
+                self._checkpoint.discard()
+            # The plan is in the sheet, a failure here only loses its history
+            if settings.USE_PLAN_HISTORY and not self.dry_run and not self.save_to_history():
+                self.history_error.emit('Non sono riuscito a salvare il piano nello storico')
+            if self.used_saved_orders:
+                self._end_run(self.finished, 'done', 'Ho finito di comporre le pedane!\n'
+                                                     'Ho ripreso il piano interrotto con gli ordini salvati allora: '
+                                                     'le modifiche fatte dopo nel foglio non sono incluse')
+            else:
+                self._end_run(self.finished, 'done', 'Ho finito di comporre le pedane!')
 
-                # Check to see if the current logistic is for Poland
-                log_details = logistic.split('--')[0].strip()
+        else:
+            self._end_run(self.unfinished, 'failed', "C'è stato un errore durante la composizione delle pedane")
+            # Clear any data written in google sheet. When the output is replaced at the end
+            # of the run, a failed write leaves the previous plan in place
+            if self.order_file or self._defers_clear():
+                return
+            self._execute(self.api_service.spreadsheets().values().batchClear(
+                spreadsheetId=self.order_spreadsheet_id,
+                body={'ranges': self.order_sheet_range_to_clear}
+            ))
+
+    def _open_checkpoint(self):
+        """ Returns the checkpoint of this run's source, None if checkpoints are disabled.
+        To be called before any order is placed: the checkpoint is tied to the input of the run. """
+        if not settings.USE_RUN_CHECKPOINTS or self.dry_run:
+            return None
+        source = os.path.abspath(self.order_file) if self.order_file else self.order_spreadsheet_id
+        input_hash = get_input_hash(all_orders=self.all_orders, pallet_dict=self.pallet_dict,
+                                    overwrite_data=self.overwrite_data, user_max_boxes=self.user_max_boxes)
+        orders_hash = get_orders_hash(self.all_orders) if settings.USE_ORDER_SNAPSHOTS and not self.order_file \
+            else None
+        return RunCheckpoint(source=source, input_hash=input_hash, orders_hash=orders_hash)
+
+    def _resume_from_checkpoint(self, checkpoint) -> list:
+        """ Replays the journal of checkpoint, if any, on the orders of the run (the same input
+        the journal was written on) and starts the journal of this run.
+        Returns the logistics whose pallets were already constructed. """
+        if checkpoint is None:
+            return []
+        self._order_positions = {id(order): position for position, order in enumerate(self.all_orders)}
+        entries = checkpoint.load()
+        if entries is None:
+            entries = []
+            # The journal of an interrupted run is replaced: the snapshot must have the orders of this one
+            if checkpoint.orders_hash is not None:
+                self._save_order_snapshot(self.all_orders, content_hash=checkpoint.orders_hash, for_checkpoint=True)
+        removed_positions = set()
+        for entry in entries:
+            self.final_data.extend(entry['placements'])
+            self.placement_details.extend(entry['placement_details'])
+            self.processed_orders.extend(entry['processed_orders'])
+            for position, quantity, ratio in entry['updated_orders']:
+                self.all_orders[position][QUANTITY] = quantity
+                self.all_orders[position][PALLET_RATIO] = ratio
+            removed_positions.update(entry['removed_orders'])
+            self.pallet_dict.update(entry['pallet_numbering'])
+        if removed_positions:
+            self.all_orders = [order for position, order in enumerate(self.all_orders)
+                               if position not in removed_positions]
+            self._aggregates = None
+        checkpoint.begin(entries)
+        self._checkpoint_marks = (len(self.final_data), len(self.processed_orders))
+        return [entry['logistic'] for entry in entries]
+
+    def _track_order_change(self, order: list, removed: bool = False):
+        """ Records, for the checkpoint, that the current logistic removed or updated order. """
+        if self._order_positions is None:
+            return
+        position = self._order_positions[id(order)]
+        self._changed_orders[position] = None if removed else [order[QUANTITY], order[PALLET_RATIO]]
+
+    def _save_checkpoint(self, checkpoint, logistic: str):
+        """ Appends what logistic changed to the journal of checkpoint. """
+        if checkpoint is None:
+            return
+        placements_start, processed_start = self._checkpoint_marks
+        checkpoint.append({
+            'logistic': logistic,
+            'placements': self.final_data[placements_start:],
+            'placement_details': self.placement_details[placements_start:],
+            'processed_orders': self.processed_orders[processed_start:],
+            'removed_orders': [position for position, change in self._changed_orders.items() if change is None],
+            'updated_orders': [[position] + change for position, change in self._changed_orders.items()
+                               if change is not None],
+            'pallet_numbering': {key: self.pallet_dict.get(key) for key in ('last_pallet_num', 'last_pallet_letter')}
+        })
+        self._changed_orders = {}
+        self._checkpoint_marks = (len(self.final_data), len(self.processed_orders))
+
+    def construct_adp_pallet(self, logistic: str, logistic_items: list):
+        """ Constructs the pallet of an ADP logistic, whose boxes are already on a pallet. """
+        split_logistic = logistic.split(' -- ')
+        # Get the suggested pallet alpha
+        suggested_pallet_alpha = split_logistic[3].strip()
+        # Get the suggested pallet type
+        suggested_pallet_type = split_logistic[2].strip()
+
+        # Get the number of pallet
+        last_pallet_num = self.pallet_dict.get('last_pallet_num')
+
+        # Call upon the method that returns a valid pallet name
+        adp_distributor_cls = Distributor(last_pallet_num=last_pallet_num,
+                                          last_pallet_alpha=suggested_pallet_alpha)
+
+        adp_log_details = [logistic_items[1], logistic_items[2]]
+
+        # The function called below returns a tuple where the first item is the
+        # pallet full name and the other item is the pallet's number
+        pallet_full_name, pallet_number = adp_distributor_cls.distribute_adp_boxes(
+            logistic_details=adp_log_details
+        )
+        # Call upon the function that places adp boxes on it's pallet passing in the
+        # necessary parameters
+        self.place_boxes_on_pallets_adp(
+            adp_logistic=logistic, pallet_type=suggested_pallet_type,
+            pallet_number=pallet_number, pallet_alpha=suggested_pallet_alpha,
+            pallet_full_name=pallet_full_name
+        )
 
-                # If the current logistic is for ADP
-                if logistic_items[1] == settings.ADP_CHANNEL_CODE:
-                    split_logistic = logistic.split(' -- ')
-                    # Get the suggested pallet alpha
-                    suggested_pallet_alpha = split_logistic[3].strip()
-                    suggested_pallet_type = split_logistic[2].strip()
-                    # Get the suggested pallet type
-
-                    # Get the number of pallet
-                    last_pallet_num = self.pallet_dict.get('last_pallet_num')
-
-                    # Call upon the method that returns a valid pallet name
-                    adp_distributor_cls = Distributor(last_pallet_num=last_pallet_num,
-                                                      last_pallet_alpha=suggested_pallet_alpha)
-
-                    adp_log_details = [logistic_items[1], logistic_items[2]]
-
-                    # The function called below returns a tuple where the first item is the
-                    # pallet full name and the other item is the pallet's number
-                    pallet_full_name, pallet_number = adp_distributor_cls.distribute_adp_boxes(
-                        logistic_details=adp_log_details
-                    )
-                    # Call upon the function that places adp boxes on it's pallet passing in the
-                    # necessary parameters
-                    self.place_boxes_on_pallets_adp(
-                        adp_logistic=logistic, pallet_type=suggested_pallet_type,
-                        pallet_number=pallet_number, pallet_alpha=suggested_pallet_alpha,
-                        pallet_full_name=pallet_full_name
-                    )
-
-                    # Update pallet_dict
-                    self.pallet_dict.update({'last_pallet_num': last_pallet_num + 1})
-
-                    # Go on to the next logistic
-                    continue
+        # Update pallet_dict
+        self.pallet_dict.update({'last_pallet_num': int(last_pallet_num) + 1})
 
-                # If user has entered a value for max_boxes in the GUI and the current
-                # logistic is one to which such rule is applied
-                elif log_details in settings.POLAND_LOGISTICS_OVERWRITE \
-                        and self.user_max_boxes > 0:
-                    suggested_pallets = db_reader.get_pallet_info_pl(
-                        total_boxes=boxes, user_max=self.user_max_boxes
-                    )
+    def construct_logistic_pallets(self, logistic: str, logistic_items: list, strategy,
+                                   db_reader: DatabaseCommunicator):
+        """ Constructs the pallets of logistic using its resolved strategy. """
+        # logistic_items is a list of this kind
+        # [the total num of boxes the logistic has, the corresponding channel of the logistic,
+        # date of shipping, position of the alphabet given to the logistic]
+        boxes = ceil_boxes(logistic_items[0])
 
-                elif log_details in settings.POLAND_LOGISTICS:
-                    suggested_pallets = db_reader.get_pallet_info_pl(total_boxes=boxes)
+        suggested_pallets = strategy.sizing.get_pallets(db_reader, boxes, strategy.info)
+        place_boxes = getattr(self, strategy.placement.placer)
 
-                # Check to see maybe current logistic is for Kievit
-                elif log_details in settings.KIEVIT_LOGISTICS:
-                    suggested_pallets = db_reader.get_kievit_pallet_info(
-                        total_boxes=boxes
-                    )
+        box_distributor_cls = Distributor(last_pallet_num=self.pallet_dict.get('last_pallet_num'),
+                                          last_pallet_alpha='')
 
-                else:
-                    # Pass the total number of boxes each logistics has to the function that suggests
-                    # pallets
-                    suggested_pallets = db_reader.get_pallet_info(
-                        total_boxes=boxes
-                    )
-
-                box_distributor_cls = Distributor(last_pallet_num=self.pallet_dict.get('last_pallet_num'),
-                                                  last_pallet_alpha='')
-
-                for pallet in suggested_pallets:
-
-                    boxes_per_pallets = box_distributor_cls.box_distributor(
-                        pallet_type=pallet,
-                        boxes_per_pallets=suggested_pallets[pallet][1],
-                        logistic_details=[logistic_items[1], logistic_items[2]],
-                        tot_boxes_ordered=boxes,
-                        tot_pallets=suggested_pallets[pallet][0]
-                    )
-                    boxes = boxes_per_pallets['remaining_boxes']
-
-                    # Pass the value of boxes_per_pallets to the functions that places boxes
-                    # on the pallets
-                    # If the current channel is ALV
-                    if logistic_items[1] == settings.ALV_CHANNEL_CODE:
-                        self.place_boxes_on_pallets_alv(
-                            current_logistic=logistic,
-                            boxes_per_pallets_info=boxes_per_pallets,
-                            pallet_type=pallet
-                        )
-
-                    elif log_details in settings.CORBARI_LOGISTICS:
-                        self.place_boxes_on_pallets_corb(
-                            corbari_logistic=logistic,
-                            boxes_per_pallets_info=boxes_per_pallets,
-                            pallet_type=pallet
-                        )
-
-                    else:
-
-                        self.place_boxes_on_pallets(
-                            current_logistic=logistic,
-                            boxes_per_pallets_info=boxes_per_pallets,
-                            pallet_type=pallet
-                        )
-
-                self.pallet_dict.update({'last_pallet_num': boxes_per_pallets.get('last_box_num'),
-                                         'last_pallet_letter': boxes_per_pallets.get('last_box_alpha')})
-
-            # write the final data
-            write_request_response = self.write_data_to_google_sheet()
-
-            # Clear the list that stores already processed orders
-            PedApi.processed_orders.clear()
-
-            updated_range = write_request_response.get('updates').get('updatedRange')
-
-            # If the data writing request was successful
-            if updated_range:
-                self.finished.emit('Ho finito di comporre le pedane!')
+        for pallet in suggested_pallets:
 
-            else:
-                self.unfinished.emit("C'è stato un errore durante la composizione delle pedane")
-                # Clear any data written in google sheet
-                self.api_service.spreadsheets().values().batchClear(
-                    spreadsheetId=self.order_spreadsheet_id,
-                    body={'ranges': self.order_sheet_range_to_clear}
-                ).execute()
+            boxes_per_pallets = box_distributor_cls.box_distributor(
+                pallet_type=pallet,
+                boxes_per_pallets=suggested_pallets[pallet][1],
+                logistic_details=[logistic_items[1], logistic_items[2]],
+                tot_boxes_ordered=boxes,
+                tot_pallets=suggested_pallets[pallet][0]
+            )
+            boxes = boxes_per_pallets['remaining_boxes']
+
+            # Pass the value of boxes_per_pallets to the function that places boxes
+            # on the pallets
+            place_boxes(logistic, boxes_per_pallets, pallet)
+
+        self.pallet_dict.update({'last_pallet_num': boxes_per_pallets.get('last_box_num'),
+                                 'last_pallet_letter': boxes_per_pallets.get('last_box_alpha')})
 
     def get_adp_log_orders(self, adp_logistic: str):
         """ Returns a nested list of all orders pertaining to the current adp_logistic. """
-        return list(filter(lambda x: x[5] == adp_logistic and x[0] not in PedApi.processed_orders,
+        return list(filter(lambda x: x[LOGISTIC] == adp_logistic and x[PRODUCT_CODE] not in self.processed_orders,
                            self.all_orders))
 
     def get_client_order(self, client_order_num: str):
         """ Returns a nested list of all orders pertaining to a certain client
         with client_order_num. """
-        client_order = list(filter(lambda x: x[8] == client_order_num and x[0] not in PedApi.processed_orders,
+        client_order = list(filter(lambda x: x[CLIENT_ORDER] == client_order_num and x[PRODUCT_CODE] not in self.processed_orders,
                                    self.all_orders))
         return client_order
 
@@ -538,121 +1160,331 @@ class PedApi(QObject):
         with the parameter logistic.
         Returns a dict where keys are the clients and values are the total
         number of boxes they ordered (the pallet ratio) """
-        current_log_orders = list(filter(lambda x: x[5] == logistic and x[0] not in PedApi.processed_orders,
-                                         self.all_orders))
-        clients = {}
-        for order_ in current_log_orders:
-            current_ratio = helper_functions.name_controller(
-                name=order_[6], char_to_remove=',', new_char='.'
-            )
-            if order_[8] not in clients:
-                clients[order_[8]] = float(current_ratio)
-            else:
-                clients[order_[8]] += float(current_ratio)
-
         # The returned dict is sorted from highest to lowest
-        return dict(sorted(clients.items(), key=lambda item: item[1], reverse=True))
+        return self._get_aggregates(logistic).get_clients()
 
     def get_varieties_order(self, logistic: str, variety: str):
-        variety_order = list(filter(lambda x: all((
-            x[5] == logistic, x[0] not in PedApi.processed_orders, x[7] == variety)),
-                                    self.all_orders))
-        return sorted(variety_order, key=lambda x: (x[2], x[5], x[1], x[4], x[3]), reverse=True)
+        variety_order = self._get_aggregates(logistic).get_variety_orders(variety)
+        return sorted(variety_order, key=lambda x: (x[QUANTITY], x[LOGISTIC], x[DETAIL], x[SHIPPING_DATE], x[CHANNEL]), reverse=True)
 
     def get_corbari_orders(self, corbari_logistic: str) -> list[list]:
         """ Gets all orders pertaining to the entered corbari_logistic"""
-        log_orders = list(filter(lambda x: x[5] == corbari_logistic and x[0] not in PedApi.processed_orders,
+        log_orders = list(filter(lambda x: x[LOGISTIC] == corbari_logistic and x[PRODUCT_CODE] not in self.processed_orders,
                                  self.all_orders))
-        return sorted(log_orders, key=lambda x: x[9], reverse=True)
+        return sorted(log_orders, key=lambda x: x[PRIORITY], reverse=True)
 
     def get_log_varieties(self, logistic: str) -> dict:
         """ Returns all varieties pertaining to a specific logistic
         and their respective total boxes ratio from the order contents
-        read from Google Spreadsheet. """
-        log_varieties = list(filter(lambda x: x[5] == logistic and x[0] not in PedApi.processed_orders,
-                                    self.all_orders))
-        varieties = {}
-        for order_content in log_varieties:
-            float_ratio = float(helper_functions.name_controller(
-                name=order_content[6], new_char='.',
-                char_to_remove=','))
-            if order_content[7] not in varieties:
-                varieties[order_content[7]] = float_ratio
-            else:
-                varieties[order_content[7]] += float_ratio
-        sort_varieties = dict(sorted(varieties.items(), key=lambda x: x[1], reverse=True))
-
-        final_data = {}
-        # Loop over sort_varieties to check if their are MIX_BOXES
-        for product_code, value in sort_varieties.items():
-            if product_code.split('--')[0].strip() == settings.MIX_BOX_NAME:
-                final_data[product_code] = value
-
-        # At the end, add the remaining products
-        final_data.update(sort_varieties)
-        return final_data
+        read from Google Spreadsheet.
+        Mix boxes come first, then the other varieties from the highest to the lowest ratio. """
+        return self._get_aggregates(logistic).get_varieties()
+
+    def _get_aggregates(self, logistic: str) -> LogisticAggregates:
+        """ Returns the variety and client totals of logistic, building them the first time
+        they are asked for. Then they are kept up to date by _remove_order and _update_order_remaining. """
+        if self._aggregates is None or self._aggregates.logistic != logistic:
+            self._aggregates = LogisticAggregates(logistic=logistic, all_orders=self.all_orders,
+                                                  processed_orders=self.processed_orders,
+                                                  ratio_of=self._order_ratio)
+        return self._aggregates
+
+    @staticmethod
+    def _order_ratio(order: list) -> int:
+        return order[PALLET_RATIO]
+
+    def _add_placement(self, order: list, placement: list):
+        """ Adds placement (a row of final_data) of order to the plan. """
+        self.final_data.append(placement)
+        self.placement_details.append([order[LOGISTIC], order[CLIENT_ORDER]])
+
+    def _record_pallet_load(self, pallet_full_name: str, max_boxes, remaining_cap: int):
+        """ Records how much of the capacity of pallet_full_name (max_boxes) its placements occupied. """
+        pallet_cap = boxes_to_fixed(max_boxes)
+        self.pallet_loads[pallet_full_name] = [pallet_cap, min(pallet_cap, pallet_cap - remaining_cap)]
+
+    def _remove_order(self, order: list, processed: bool = False):
+        """ Removes order from all_orders. If processed, its product code is added to the processed orders. """
+        if processed:
+            self.processed_orders.append(order[PRODUCT_CODE])
+        # Identical rows are different orders: order is removed by identity, as the aggregates count it
+        del self.all_orders[self._position_of(order)]
+        self._track_order_change(order, removed=True)
+        if self._aggregates is not None:
+            self._aggregates.order_removed(order)
+            if processed:
+                self._aggregates.code_processed(order[PRODUCT_CODE])
+
+    def _position_of(self, order: list) -> int:
+        """ Returns the position of order (the object itself, not an equal row) in all_orders. """
+        for position, current_order in enumerate(self.all_orders):
+            if current_order is order:
+                return position
+        raise ValueError('Ordine non presente negli ordini da piazzare')
+
+    def _update_order_remaining(self, order: list, qta_placed: int, ratio_occupied: int):
+        """ Takes the quantity and the ratio placed on a pallet off order. """
+        order_in_all_orders = self.all_orders[self._position_of(order)]
+        product_qta_in_all_orders = float(helper_functions.name_controller(
+            name=order_in_all_orders[QUANTITY], char_to_remove=',', new_char='.'
+        ))
+        # Modify the quantity of the current product
+        order_in_all_orders[QUANTITY] = str(int(product_qta_in_all_orders - qta_placed))
+
+        # Modify the ratio of the current product
+        order_in_all_orders[PALLET_RATIO] -= ratio_occupied
+        self._track_order_change(order_in_all_orders)
+
+        if self._aggregates is not None:
+            self._aggregates.ratio_changed(order_in_all_orders)
 
     def get_all_logistics(self) -> dict:
-        """ Returns all logistics and there respective total boxes
+        """ Returns all logistics and there respective total boxes (in fixed point)
         from the order contents read from Google Spreadsheet. """
         logistics = {}
         for order_content in self.all_orders:
-            # Removes , from numbers that have it
-            float_num = helper_functions.name_controller(
-                name=order_content[6], new_char='.',
-                char_to_remove=',')
-            if order_content[5] not in logistics:
-                logistics[order_content[5]] = [float(float_num), order_content[3].strip(), order_content[4],
-                                               order_content[10]]
+            if order_content[LOGISTIC] not in logistics:
+                logistics[order_content[LOGISTIC]] = [order_content[PALLET_RATIO], order_content[CHANNEL].strip(),
+                                                      order_content[SHIPPING_DATE], order_content[ALPHA_POSITION]]
             else:
-                logistics[order_content[5]][0] += float(float_num)
+                logistics[order_content[LOGISTIC]][0] += order_content[PALLET_RATIO]
 
         # Sort logistics first by their shipping date, then by the name of their channel and lastly by
         # The position of the alphabet given to them
         # This is to prevent the algorithm from processing orders of the same channel at different interval
         return dict(sorted(logistics.items(), key=lambda x: (x[1][2], x[1][1], int(x[1][3]))))
 
-    def get_all_orders(self):
+    def get_all_orders(self, use_prefetched: bool = True):
         """ Reads from the spreadsheet that contains client orders and returns
-        the data from it. """
-        order_data = self.sheet_api.values().get(
-            spreadsheetId=self.order_spreadsheet_id,
-            range=self.order_sheet_range_to_read
-        ).execute()
-        all_orders = order_data.get('values', [])[1:]
-        self.all_orders = sorted(all_orders, key=lambda x: (x[2], x[5], x[1], x[4]), reverse=True)
+        the data from it. Orders read shortly before by prefetch_orders are used if available,
+        the snapshot of an earlier run (see order_snapshot.py) only if this run was asked to
+        resume it (and the snapshot is the one it was planned on) or in offline mode. """
+        prefetched_orders = None
+        if not self.order_file and settings.USE_ORDER_SNAPSHOTS:
+            prefetched_orders = self._load_order_snapshot()
+        if prefetched_orders is None and use_prefetched and not self.order_file:
+            prefetched_orders = self.context.take_orders(self.order_spreadsheet_id)
+
+        if self.order_file:
+            all_orders = [self._parse_order_row(row) for row in self._read_order_file()[1:]]
+        elif prefetched_orders is not None:
+            all_orders = prefetched_orders
+        else:
+            all_orders = []
+            for page in self._iter_order_pages():
+                all_orders.extend(page)
+        self.all_orders = sorted(all_orders, key=lambda x: (x[QUANTITY], x[LOGISTIC], x[DETAIL], x[SHIPPING_DATE]),
+                                 reverse=True)
+        # The snapshot has the orders as the run uses them, so that its hash can be checked against a checkpoint's
+        if prefetched_orders is None and not self.order_file and settings.USE_ORDER_SNAPSHOTS:
+            self._save_order_snapshot(self.all_orders)
+
+    def _load_order_snapshot(self):
+        """ Returns the orders of the snapshot of the order spreadsheet if they are to be used
+        instead of the sheet's, None otherwise. """
+        if settings.ORDER_SNAPSHOT_OFFLINE:
+            snapshot_orders = load_snapshot(self.order_spreadsheet_id)
+            if snapshot_orders is None:
+                raise RuntimeError('Nessuno snapshot degli ordini disponibile per lavorare offline')
+            return snapshot_orders
+        # Asked to resume an interrupted run: it was planned on the orders of the snapshot only if
+        # the snapshot has the orders its checkpoint was computed on (reading the sheet again
+        # would change the input and the checkpoint wouldn't be resumed)
+        if not self.resume_saved_orders or not settings.USE_RUN_CHECKPOINTS or self.dry_run:
+            return None
+        orders_hash = get_checkpoint_orders_hash(self.order_spreadsheet_id)
+        if orders_hash is None:
+            return None
+        snapshot_orders = load_snapshot(self.order_spreadsheet_id, content_hash=orders_hash)
+        self.used_saved_orders = snapshot_orders is not None
+        return snapshot_orders
+
+    def _save_order_snapshot(self, all_orders: list, content_hash: str = None, for_checkpoint: bool = False):
+        """ Saves the orders just read as the snapshot of the order spreadsheet.
+        The snapshot of an interrupted run is kept for resuming it, unless this run's checkpoint
+        (for_checkpoint) replaces the interrupted run's.
+        The snapshot is only a shortcut for later runs, failing to save it doesn't stop this one. """
+        if not for_checkpoint and settings.USE_RUN_CHECKPOINTS and has_checkpoint(self.order_spreadsheet_id):
+            return
+        try:
+            save_snapshot(self.order_spreadsheet_id, all_orders, content_hash=content_hash)
+        except OSError:
+            pass
+
+    def prefetch_orders(self):
+        """ Reads the orders before the run is started and keeps them in the context,
+        where the next run on the same spreadsheet takes them (see get_all_orders). """
+        self._prepare_api_access()
+        self.get_all_orders(use_prefetched=False)
+        self.context.put_orders(self.order_spreadsheet_id, self.all_orders)
+
+    def _iter_order_pages(self):
+        """ Reads the order range in windows of settings.ORDER_READ_PAGE_ROWS rows and yields
+        the orders of each of them (header excluded).
+        Only the columns of the order schema are requested, column by column
+        (majorDimension=COLUMNS), and each column is decoded with its parser.
+        The next window is downloaded while the current one is being decoded, so at most
+        two pages of raw data are held in memory. If the range has no end row, reading
+        stops at the first window with no values. """
+        range_parts = split_a1_range(self.order_sheet_range_to_read)
+        end_row = range_parts['end_row']
+        page_rows = settings.ORDER_READ_PAGE_ROWS
+        first_row = range_parts['start_row'] or 1
+        first_column = column_to_index(range_parts['start_column'] or 'A')
+        column_runs = get_column_runs()
+
+        def fetch_page(page_start: int) -> dict:
+            page_end = page_start + page_rows - 1
+            if end_row:
+                page_end = min(page_end, end_row)
+            page_ranges = [build_a1_range(sheet_name=range_parts['sheet_name'],
+                                          start_column=index_to_column(first_column + column_run[0]),
+                                          start_row=page_start,
+                                          end_column=index_to_column(first_column + column_run[-1]),
+                                          end_row=page_end)
+                           for column_run in column_runs]
+            value_ranges = self._execute(self.sheet_api.values().batchGet(
+                spreadsheetId=self.order_spreadsheet_id,
+                ranges=page_ranges,
+                majorDimension='COLUMNS'
+            )).get('valueRanges', [])
+
+            # Columns of the page by their offset in the order range
+            sheet_columns = {}
+            for column_run, value_range in zip(column_runs, value_ranges):
+                for sheet_offset, cells in zip(column_run, value_range.get('values', [])):
+                    sheet_columns[sheet_offset] = cells
+            return sheet_columns
+
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='ped_order_pages') as page_reader:
+            page_start = first_row
+            next_page = page_reader.submit(fetch_page, page_start)
+            while next_page is not None:
+                sheet_columns = next_page.result()
+                page_start += page_rows
+                # A bounded range is read up to its end row, blank blocks included;
+                # an open-ended one until an empty page is met
+                read_more = page_start <= end_row if end_row else any(sheet_columns.values())
+                if read_more:
+                    next_page = page_reader.submit(fetch_page, page_start)
+                else:
+                    next_page = None
+
+                # The first row of the range is the header
+                if page_start - page_rows == first_row:
+                    sheet_columns = {sheet_offset: cells[1:] for sheet_offset, cells in sheet_columns.items()}
+                yield columns_to_orders(sheet_columns)
+
+    @staticmethod
+    def _parse_order_row(row: list) -> list:
+        """ Returns the order row as used internally (see order_schema.py). """
+        return row_to_order(row)
+
+    def _read_order_file(self) -> list:
+        """ Reads the local order file. It must have the same columns as the order sheet. """
+        with open(self.order_file, newline='', encoding='utf-8') as order_file:
+            return [row for row in csv.reader(order_file, delimiter=settings.LOCAL_FILE_DELIMITER) if row]
+
+    def read_kievit_pallet_ranges(self) -> list:
+        """ Reads from a Google Spreadsheet some data related to Kievit pallet ranges. """
+        pallet_data = self._execute(self.sheet_api.values().get(
+            spreadsheetId=self.kievit_sheet_id,
+            range=self.kievit_range_to_read))
+        return pallet_data.get('values', [])[1:]
+
+    def read_pallet_ranges(self) -> list:
+        """ Reads from a Google Spreadsheet some data related to pallet ranges. """
+        pallet_data = self._execute(self.sheet_api.values().get(
+            spreadsheetId=self.pallet_info_sheet_id,
+            range=self.pallet_info_read_range))
+        return pallet_data.get('values', [])[1:]
 
     def update_kievit_pallet_table(self):
         """ Reads from a Google Spreadsheet some data related to Kievit pallet
         ranges and stores them in the database. """
-        db_writer_class = DatabaseCommunicator(write_to_db=True)
-        pallet_data = self.sheet_api.values().get(
-            spreadsheetId=self.kievit_sheet_id,
-            range=self.kievit_range_to_read).execute()
-        values_to_write = pallet_data.get('values', [])[1:]
-        for data in values_to_write:
-            write_result = db_writer_class.write_to_kievit_pallet_table(
-                info_to_write=data
-            )
-        return write_result is not None
+        return self._write_range_tables({settings.KIEVIT_PALLET_TABLE: self.read_kievit_pallet_ranges()})
 
     def update_pallet_table(self):
         """ Reads from a Google Spreadsheet some data related to pallet
         ranges and store them in the database. """
-        db_writer_class = DatabaseCommunicator(write_to_db=True)
-        pallet_data = self.sheet_api.values().get(
-            spreadsheetId=self.pallet_info_sheet_id,
-            range=self.pallet_info_read_range).execute()
-        values_to_write = pallet_data.get('values', [])[1:]
-        for data in values_to_write:
-            write_result = db_writer_class.write_to_pallet_table(
-                info_to_write=data
-            )
-        return write_result is not None
-
-    def _create_pallet_api_service(self):
-        self.api_service = build('sheets', 'v4', credentials=self.api_creds)
-        self.sheet_api = self.api_service.spreadsheets()
+        return self._write_range_tables({settings.PALLET_INFO_TABLE: self.read_pallet_ranges()})
+
+    def refresh_pallet_tables(self) -> bool:
+        """ Downloads the pallet and Kievit pallet ranges from Google Sheet and replaces
+        the pallet tables with them in a single transaction, so that planning runs
+        of other users keep on reading the old ranges until the new ones are committed.
+        Returns True if the update was successful, False otherwise. """
+        executor = get_prefetch_executor()
+        pallet_ranges = executor.submit(self.read_pallet_ranges)
+        kievit_ranges = executor.submit(self.read_kievit_pallet_ranges)
+        return self._write_range_tables({settings.PALLET_INFO_TABLE: pallet_ranges.result(),
+                                         settings.KIEVIT_PALLET_TABLE: kievit_ranges.result()})
+
+    def _write_range_tables(self, tables: dict) -> bool:
+        db_writer_class = DatabaseCommunicator(write_to_db=True, connection_tag=f'writer_{id(self)}')
+        try:
+            write_result = db_writer_class.replace_range_tables(tables=tables)
+        finally:
+            db_writer_class.close_connection()
+        self.context.invalidate_range_tables()
+        return write_result
+
+    def _execute(self, request):
+        """ Executes a Sheets API request with the http object of the calling thread,
+        since the one of the service can't be shared between threads.
+        The call is counted in api_usage (and refused if it exceeds the API budget). """
+        call = self.api_usage.start_call(request)
+        response, failed = None, True
+        try:
+            response = request.execute(http=self.context.get_http())
+            failed = False
+        finally:
+            self.api_usage.end_call(call, response, failed=failed)
+        return response
+
+    def _prepare_api_access(self):
+        """ Refreshes the credentials and builds the Sheets service before any
+        concurrent request is sent, so that they aren't built by several threads. """
+        self.context.refresh_credentials()
+        return self.context.get_api_service()
+
+    def _make_run_id(self) -> str:
+        """ Returns an id for the current run made of its start time, source and a random suffix:
+        runs started in the same second (e.g. by the daemon) must not share history rows or exports. """
+        if self.order_file:
+            source = os.path.splitext(os.path.basename(self.order_file))[0]
+        else:
+            source = self.order_spreadsheet_id or 'ped'
+        return f"{time.strftime('%Y%m%d_%H%M%S', time.localtime(self.run_started_at))}_{source}_" \
+               f"{uuid.uuid4().hex[:8]}"
+
+    def _close_run(self):
+        """ Records the run however it ended, even with an exception (its status is then 'error'):
+        its API usage is added to the rolling log and its placement trace, if any, is dumped.
+        Failing to record it doesn't change the outcome. """
+        if self.dry_run:
+            return
+        # No status, or still previewing, means it was interrupted by an exception
+        status = self.run_status if self.run_status not in (None, 'preview') else 'error'
+        if settings.API_USAGE_LOG:
+            try:
+                self.api_usage.write_log(run_id=self.run_id, status=status)
+            except OSError:
+                pass
+        # Crashed and discarded runs are the ones most worth diagnosing
+        if self.trace is not None:
+            try:
+                self.trace.dump(run_id=self.run_id)
+            except OSError:
+                pass
+
+    def _end_run(self, signal, status: str, message: str):
+        """ Records the outcome of construct_pallets and emits it with signal. """
+        self.run_status = status
+        self.run_message = message
+        if self._checkpoint is not None:
+            self._checkpoint.close()
+        signal.emit(message)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+""" Accounting of the Sheets API calls of planning runs.
+Every request executed by PedApi is counted with its operation, ranges, cells and
+bytes sent/received and latency. The totals of each run are appended to a rolling
+local log, and a budget (settings.API_BUDGET) warns or refuses calls that would
+exceed it. """
+
+import json
+import os
+import threading
+import time
+from urllib.parse import parse_qs, unquote, urlparse
+
+# Self defined modules
+import settings
+
+_LOG_LOCK = threading.Lock()
+
+READ_OPERATIONS = ('get', 'values.get', 'values.batchGet')
+CLEAR_OPERATIONS = ('values.clear', 'values.batchClear')
+
+
+class ApiBudgetExceeded(Exception):
+    """ Raised when a call would make a run exceed its API budget (if the budget refuses calls). """
+
+
+def get_operation(request) -> str:
+    """ Returns the operation of request, e.g. 'values.batchGet'. """
+    return request.methodId.replace('sheets.spreadsheets.', '', 1)
+
+
+def get_operation_kind(operation: str) -> str:
+    if operation in READ_OPERATIONS:
+        return 'read'
+    if operation in CLEAR_OPERATIONS:
+        return 'clear'
+    return 'write'
+
+
+def get_request_ranges(request, body: dict) -> list:
+    """ Returns the ranges request reads, writes or clears (if any). """
+    parsed_uri = urlparse(request.uri)
+    if '/values/' in parsed_uri.path:
+        return [unquote(parsed_uri.path.split('/values/', 1)[1]).split(':append')[0]]
+    ranges = parse_qs(parsed_uri.query).get('ranges', [])
+    ranges.extend(body.get('ranges', []))
+    ranges.extend(value_range['range'] for value_range in body.get('data', []) if 'range' in value_range)
+    return ranges
+
+
+def count_body_cells(body: dict) -> int:
+    """ Returns the number of cells written by a request body. """
+    rows = list(body.get('values', []))
+    for value_range in body.get('data', []):
+        rows.extend(value_range.get('values', []))
+    for update_request in body.get('requests', []):
+        rows.extend(row.get('values', []) for row in update_request.get('updateCells', {}).get('rows', []))
+    return sum(len(row) for row in rows)
+
+
+def count_response_cells(response: dict) -> int:
+    """ Returns the number of cells read in a response. """
+    value_ranges = response.get('valueRanges', [response])
+    return sum(len(row) for value_range in value_ranges for row in value_range.get('values', []))
+
+
+class ApiUsage:
+    """ Calls made during a run and their totals. Safe to use from several threads. """
+
+    def __init__(self, budget: dict = None, budget_action: str = settings.API_BUDGET_ACTION,
+                 on_warning=None):
+        self.budget = budget if budget is not None else settings.API_BUDGET
+        if budget_action not in ('warn', 'refuse'):
+            raise ValueError(f'Azione del budget API non valida: {budget_action}')
+        self.budget_action = budget_action
+        # Called with a message the first time a limit of the budget is exceeded
+        self.on_warning = on_warning
+
+        self.calls = []
+        self.totals = {'requests': 0, 'failed_requests': 0, 'reads': 0, 'writes': 0, 'clears': 0,
+                       'cells_read': 0, 'cells_written': 0,
+                       'bytes_in': 0, 'bytes_out': 0, 'seconds': 0.0}
+        self._warned = set()
+        self._lock = threading.Lock()
+
+    def start_call(self, request) -> dict:
+        """ Returns the record of request, before it's executed.
+        Raises ApiBudgetExceeded if the call would exceed the budget and the budget refuses calls. """
+        body_bytes = request.body or b''
+        if isinstance(body_bytes, str):
+            body_bytes = body_bytes.encode('utf-8')
+        body = json.loads(body_bytes) if body_bytes else {}
+        operation = get_operation(request)
+        call = {'operation': operation, 'kind': get_operation_kind(operation),
+                'ranges': get_request_ranges(request, body), 'cells_written': count_body_cells(body),
+                'cells_read': 0, 'bytes_out': len(body_bytes), 'bytes_in': 0, 'seconds': 0.0,
+                'started': time.perf_counter()}
+        with self._lock:
+            self._check_budget({'requests': self.totals['requests'] + 1,
+                                'cells_written': self.totals['cells_written'] + call['cells_written']})
+        return call
+
+    def end_call(self, call: dict, response: dict, failed: bool = False):
+        """ Records call, executed with response, or failed (e.g. an HttpError or a timeout):
+        failed calls count against the quota as well. """
+        call['seconds'] = time.perf_counter() - call.pop('started')
+        call['failed'] = failed
+        call['cells_read'] = count_response_cells(response) if call['kind'] == 'read' and not failed else 0
+        # The response is already parsed: its size is the one of its json
+        call['bytes_in'] = len(json.dumps(response)) if not failed else 0
+        with self._lock:
+            self.calls.append(call)
+            self.totals['requests'] += 1
+            self.totals['failed_requests'] += failed
+            self.totals[f"{call['kind']}s"] += 1
+            for total in ('cells_read', 'cells_written', 'bytes_in', 'bytes_out', 'seconds'):
+                self.totals[total] += call[total]
+            # Reads can only be checked once their cells are known: the next call is refused
+            self._warn_over_budget(self.totals)
+
+    def _check_budget(self, next_totals: dict):
+        over_budget = [limit for limit, value in next_totals.items()
+                       if limit in self.budget and value > self.budget[limit]]
+        over_budget.extend(limit for limit in ('cells_read',)
+                           if limit in self.budget and self.totals[limit] > self.budget[limit])
+        if over_budget and self.budget_action == 'refuse':
+            raise ApiBudgetExceeded(f"Budget API superato ({', '.join(over_budget)}): richiesta rifiutata")
+        self._warn_over_budget(next_totals)
+
+    def _warn_over_budget(self, totals: dict):
+        for limit, value in totals.items():
+            if limit in self.budget and value > self.budget[limit] and limit not in self._warned:
+                self._warned.add(limit)
+                if self.on_warning is not None:
+                    self.on_warning(f'Budget API superato: {limit} {value} su {self.budget[limit]}')
+
+    def summary(self) -> dict:
+        """ Returns the totals of the run and the totals of each operation. """
+        with self._lock:
+            operations = {}
+            for call in self.calls:
+                operation = operations.setdefault(call['operation'], {'requests': 0, 'cells_read': 0,
+                                                                      'cells_written': 0, 'seconds': 0.0,
+                                                                      'ranges': []})
+                operation['requests'] += 1
+                for total in ('cells_read', 'cells_written', 'seconds'):
+                    operation[total] += call[total]
+                operation['ranges'].extend(call_range for call_range in call['ranges']
+                                           if call_range not in operation['ranges'])
+            return {'totals': dict(self.totals), 'operations': operations,
+                    'over_budget': sorted(self._warned)}
+
+    def write_log(self, run_id: str, status: str, log_file: str = settings.API_USAGE_LOG,
+                  max_runs: int = settings.API_USAGE_LOG_MAX_RUNS):
+        """ Appends the summary of the run to log_file, keeping only its last max_runs runs.
+        Raises OSError if the log can't be written. """
+        entry = json.dumps(dict(self.summary(), run_id=run_id, status=status, logged_at=time.time()))
+        with _LOG_LOCK:
+            entries = []
+            if os.path.exists(log_file):
+                with open(log_file, encoding='utf-8') as usage_log:
+                    entries = [line.rstrip('\n') for line in usage_log if line.strip()]
+            entries = (entries + [entry])[-max_runs:]
+            temp_file_name = f'{log_file}.tmp'
+            with open(temp_file_name, 'w', encoding='utf-8') as usage_log:
+                usage_log.write('\n'.join(entries) + '\n')
+            os.replace(temp_file_name, log_file)
+
+
+if __name__ == '__main__':
+    pass
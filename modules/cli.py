@@ -1,6 +1,159 @@
 #!/usr/bin/env python
 
-from main_window import main
+import argparse
+import sys
+import time
+
+
+def run_plan_jobs(args):
+    """ Plans all the order sheets/files in args.sources concurrently,
+    on the planning daemon if asked to (and it's running). """
+    import planning_daemon
+
+    if args.daemon and planning_daemon.daemon_is_running():
+        jobs = planning_daemon.submit_and_wait(sources=args.sources, overwrite_data=not args.append,
+                                               user_max_boxes=args.max_boxes)
+    else:
+        from job_queue import JobQueue
+
+        job_queue = JobQueue(max_workers=args.workers)
+        queued_jobs = job_queue.submit_many(sources=args.sources, overwrite_data=not args.append,
+                                            user_max_boxes=args.max_boxes)
+        job_queue.wait(queued_jobs)
+        job_queue.shutdown()
+        jobs = [job.to_dict() for job in queued_jobs]
+
+    for job in jobs:
+        duration = f"{job['duration']:.1f}s" if job['duration'] is not None else '-'
+        print(f"[{job['job_id']}] {job['status']:<8} {duration:>8}  {job['source']}  {job['message']}")
+    return 0 if all(job['status'] == 'done' for job in jobs) else 1
+
+
+def run_daemon(args):
+    """ Runs the planning daemon until it's interrupted. """
+    from planning_daemon import PlanningDaemon
+
+    daemon = PlanningDaemon(port=args.port, max_workers=args.workers)
+    print(f'Daemon in ascolto su {daemon.server.server_address[0]}:{daemon.server.server_address[1]}')
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def show_history(args):
+    """ Prints the placements of the local plan history matching the filters given. """
+    from plan_history import PlanHistory
+
+    plan_history = PlanHistory()
+    if not any((args.product, args.client, args.logistic, args.pallet)):
+        for run in plan_history.get_runs(limit=args.limit):
+            started_at = time.strftime('%Y-%m-%d %H:%M', time.localtime(run['Started_At'] or 0))
+            print(f"{run['Run_Id']}  {started_at}  {run['Pallets']:>4} PED  {run['Placements']:>5} righe  "
+                  f"{run['Source']}")
+    else:
+        placements = plan_history.find_placements(product_code=args.product, client_order=args.client,
+                                                  logistic=args.logistic, pallet_number=args.pallet,
+                                                  limit=args.limit)
+        for placement in placements:
+            started_at = time.strftime('%Y-%m-%d %H:%M', time.localtime(placement['Started_At'] or 0))
+            print(f"{started_at}  PED {placement['Pallet_Number']:>4} {placement['Pallet_Letter']:<3} "
+                  f"{placement['Pallet_Type']:<10} {placement['Product_Code']:<12} x{placement['Quantity']:<5} "
+                  f"{placement['Logistic']}  {placement['Client_Order']}")
+        if not placements:
+            print('Nessun risultato nello storico')
+    plan_history.close_connection()
+    return 0
+
+
+def run_sweep(args):
+    """ Simulates, without writing anything, the plan of args.source for each "Max cubotti per PED" value. """
+    import what_if_sweep
+
+    if args.range:
+        start, stop, step = args.range
+        max_boxes_values = list(range(start, stop + 1, step or 1))
+    else:
+        max_boxes_values = args.values
+    if not max_boxes_values:
+        print('Nessun valore di Max cubotti da simulare (--values o --range)')
+        return 1
+
+    inputs = what_if_sweep.read_sweep_inputs(source=args.source, overwrite_data=not args.append)
+    results = what_if_sweep.run_sweep(inputs=inputs, max_boxes_values=max_boxes_values, workers=args.workers)
+
+    print(f"{'Max cubotti':>11}  {'PED':>5}  {'Riempimento':>11}  {'Righe divise':>12}  {'Ordini rimasti':>14}")
+    for result in results:
+        fill_rate = f"{result['fill_rate']:.1%}" if result['fill_rate'] is not None else '-'
+        print(f"{result['user_max_boxes']:>11}  {result['pallets']:>5}  {fill_rate:>11}  "
+              f"{result['split_lines']:>12}  {result['orders_left']:>14}")
+    return 0 if all(result['status'] == 'done' for result in results) else 1
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='PED RiC. Without a command, the GUI is opened.')
+    commands = parser.add_subparsers(dest='command')
+
+    plan_parser = commands.add_parser('plan', help='Plans several order sheets (links) or csv files concurrently')
+    plan_parser.add_argument('sources', nargs='+', help='Google Sheet links or local order files')
+    plan_parser.add_argument('--workers', type=int, default=None,
+                             help='Max number of jobs run at the same time')
+    plan_parser.add_argument('--append', action='store_true',
+                             help='Add new orders instead of overwriting existing data')
+    plan_parser.add_argument('--max-boxes', type=int, default=0,
+                             help='Max cubotti per PED (for the Poland logistics)')
+    plan_parser.add_argument('--daemon', action='store_true',
+                             help='Submit the jobs to the planning daemon if it is running')
+    plan_parser.set_defaults(handler=run_plan_jobs)
+
+    serve_parser = commands.add_parser('serve', help='Runs the planning daemon')
+    serve_parser.add_argument('--port', type=int, default=None, help='Port of the local endpoint')
+    serve_parser.add_argument('--workers', type=int, default=None,
+                              help='Max number of jobs run at the same time')
+    serve_parser.set_defaults(handler=run_daemon)
+
+    sweep_parser = commands.add_parser('sweep', help='Simulates (without writing) the plan of an order sheet '
+                                                     'or file for several "Max cubotti per PED" values')
+    sweep_parser.add_argument('source', help='Google Sheet link or local order file')
+    sweep_parser.add_argument('--values', type=int, nargs='+', default=[], help='Max cubotti values to try')
+    sweep_parser.add_argument('--range', type=int, nargs=3, metavar=('START', 'STOP', 'STEP'),
+                              help='Max cubotti values from START to STOP (included) every STEP')
+    sweep_parser.add_argument('--append', action='store_true',
+                              help='Simulate adding the orders to the existing data')
+    sweep_parser.add_argument('--workers', type=int, default=None,
+                              help='Max number of simulations run at the same time (processes)')
+    sweep_parser.set_defaults(handler=run_sweep, default_workers='SWEEP_WORKERS')
+
+    history_parser = commands.add_parser('history', help='Searches the local history of the plans written '
+                                                         '(without filters, lists the last runs)')
+    history_parser.add_argument('--product', help='Product code')
+    history_parser.add_argument('--client', help='Client order number')
+    history_parser.add_argument('--logistic', help='Logistic')
+    history_parser.add_argument('--pallet', type=int, help='PED number')
+    history_parser.add_argument('--limit', type=int, default=50, help='Max number of results')
+    history_parser.set_defaults(handler=show_history)
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    if args.command is None:
+        from main_window import main as gui_main
+        gui_main()
+        return 0
+
+    import settings
+    from PyQt5.QtCore import QCoreApplication
+
+    # The database drivers need an application instance
+    app = QCoreApplication(sys.argv)
+    if getattr(args, 'workers', 0) is None:
+        args.workers = getattr(settings, getattr(args, 'default_workers', 'JOB_QUEUE_WORKERS'))
+    if getattr(args, 'port', 0) is None:
+        args.port = settings.DAEMON_PORT
+    return args.handler(args)
+
 
 if __name__ == '__main__':
-    main()
+    raise SystemExit(main())
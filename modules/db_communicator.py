@@ -1,8 +1,12 @@
 #!/usr/bin/env python
 
 """ Communicates with the database that stores some necessary
-information needed in this project. """
+information needed in this project.
+The database is shared by several users: it's used in WAL mode, so that readers
+see a consistent snapshot while the pallet tables are being refreshed, and
+all the writes of this process go through replace_range_tables. """
 
+import threading
 
 from PyQt5.QtSql import QSqlQuery, QSqlDatabase
 
@@ -12,6 +16,10 @@ import settings
 from helper_modules import helper_functions
 
 
+# Serializes the writers of this process, SQLite serializes those of different processes
+_WRITER_LOCK = threading.Lock()
+
+
 def determine_max_per_pallet(pallet_name: str, tot_pallet: int, total_boxes_ordered: int,
                              alternative_max_min: int = 0, is_kievit: bool = False):
     if not tot_pallet:
@@ -67,11 +75,29 @@ def determine_max_per_pallet(pallet_name: str, tot_pallet: int, total_boxes_orde
             return final_tot_pallet, max_per_pallet
 
 
+def size_pallets(pallets: dict, total_boxes: int, is_kievit: bool = False) -> dict:
+    """ Returns the number of pallets and the boxes per pallet of each pallet type of pallets,
+    a dict where keys are pallet types and values are their suggested number of pallets.
+    Pallet types are sized in order, each one with the boxes the previous ones didn't take. """
+    remaining_boxes = total_boxes
+    final_pallets = {}
+    for pallet in pallets:
+        if not pallets[pallet]:
+            continue
+        else:
+            final_pallets[pallet] = determine_max_per_pallet(pallet_name=pallet, tot_pallet=pallets[pallet],
+                                                             total_boxes_ordered=remaining_boxes,
+                                                             is_kievit=is_kievit)
+            remaining_boxes -= final_pallets[pallet][0] * final_pallets[pallet][1]
+    return final_pallets
+
+
 class DatabaseCommunicator:
     """ Communicates with the database used in this project. """
 
     def __init__(self, write_to_db: bool = False,
-                 read_from_db: bool = True):
+                 read_from_db: bool = True, connection_tag: str = '',
+                 range_tables: dict = None, pallet_optimizer=None):
         self.db_driver = settings.DATABASE_DRIVER
         self.db_name = settings.DATABASE_NAME
 
@@ -80,6 +106,19 @@ class DatabaseCommunicator:
         elif read_from_db:
             self.con_name = settings.READER_CONNECTION_NAME
 
+        # Qt connections can only be used in the thread that created them, so
+        # a class used in another thread must have a connection of its own
+        if connection_tag:
+            self.con_name = f'{self.con_name}_{connection_tag}'
+
+        # Pallet range tables already loaded in memory (see load_range_tables).
+        # When available, pallet suggestions are read from here instead of the database
+        self.range_tables = range_tables
+
+        # If set (see pallet_optimizer.py), the Euro/Industrial suggestions of the range
+        # tables are compared with (and possibly replaced by) the ones it finds
+        self.pallet_optimizer = pallet_optimizer
+
         self.pallet_table_name = settings.PALLET_INFO_TABLE
         self.kievit_pallet_table = settings.KIEVIT_PALLET_TABLE
         self.client_table_name = settings.CLIENT_INFO_TABLE
@@ -102,6 +141,9 @@ class DatabaseCommunicator:
     def check_table(self, table_name) -> bool:
         """ Returns True if the said table is not empty,
         False otherwise. """
+        if self.range_tables is not None and table_name in self.range_tables:
+            return bool(self.range_tables[table_name])
+
         if not self.connection:
             self.create_connection()
         check_query = QSqlQuery(self.connection)
@@ -117,185 +159,212 @@ class DatabaseCommunicator:
         check_query.finish()
         return record_check is not None
 
-    def get_pallet_info_pl(self, total_boxes: int,
-                           user_max: int = 0):
-        """ Returns the suggested pallet combination necessary for the
-        total_boxes entered for all logistics that are for Poland """
+    def load_range_tables(self) -> dict:
+        """ Reads the pallet range tables in memory and returns them as a dict
+        where keys are the table names and values are lists of rows (dicts). """
+        if not self.connection:
+            self.create_connection()
+
+        range_tables = {}
+        table_columns = {
+            self.pallet_table_name: settings.PALLET_TABLE_COLUMNS,
+            self.kievit_pallet_table: settings.KIEVIT_TABLE_COLUMNS
+        }
+        # Both tables are read in the same transaction so that they come from the same snapshot
+        # even if someone else is refreshing them
+        self.connection.transaction()
+        for table_name, columns in table_columns.items():
+            rows = []
+            range_query = QSqlQuery(self.connection)
+            range_query.exec_(f'SELECT {", ".join(columns)} FROM {table_name} ORDER BY Min_Value')
+            while range_query.next():
+                rows.append({column: range_query.value(range_query.record().indexOf(column))
+                             for column in columns})
+            range_query.finish()
+            range_tables[table_name] = rows
+        self.connection.commit()
+
+        self.range_tables = range_tables
+        return range_tables
+
+    def _get_range_row(self, table_name: str, total_boxes: int, columns: list) -> dict:
+        """ Returns the values of columns for the row of table_name whose range
+        contains total_boxes. Values are None if no such row exists. """
+        if self.range_tables is not None:
+            for row in self.range_tables.get(table_name, []):
+                if row['Min_Value'] <= total_boxes <= row['Max_Value']:
+                    return {column: row.get(column) for column in columns}
+            return {column: None for column in columns}
+
         if not self.connection:
             self.create_connection()
 
-        pl_pallet_info_query = QSqlQuery(self.connection)
-        query = f'SELECT Poland_Euro FROM {self.pallet_table_name} ' \
+        range_query = QSqlQuery(self.connection)
+        query = f'SELECT {", ".join(columns)} FROM {table_name} ' \
                 f'WHERE Min_Value <= {total_boxes} AND Max_Value >= {total_boxes}'
-        if pl_pallet_info_query.prepare(query):
-            pl_pallet_info_query.exec_()
+        if not range_query.prepare(query):
+            return {}
+        range_query.exec_()
+        range_query.first()
+        return {column: range_query.value(range_query.record().indexOf(column))
+                for column in columns}
 
-            pl_pallet_info_query.first()
-            pl_euro_pallet = pl_pallet_info_query.value(
-                pl_pallet_info_query.record().indexOf('Poland_Euro')
-            )
-            if user_max > 0:
-                return {'euro': determine_max_per_pallet(pallet_name='euro', tot_pallet=pl_euro_pallet,
-                                                         total_boxes_ordered=total_boxes,
-                                                         alternative_max_min=user_max)}
+    def get_pallet_info_pl(self, total_boxes: int,
+                           user_max: int = 0):
+        """ Returns the suggested pallet combination necessary for the
+        total_boxes entered for all logistics that are for Poland """
+        range_row = self._get_range_row(table_name=self.pallet_table_name, total_boxes=total_boxes,
+                                        columns=['Poland_Euro'])
+        if not range_row:
+            return None
 
+        pl_euro_pallet = range_row.get('Poland_Euro')
+        if user_max > 0:
             return {'euro': determine_max_per_pallet(pallet_name='euro', tot_pallet=pl_euro_pallet,
-                                                     total_boxes_ordered=total_boxes)}
+                                                     total_boxes_ordered=total_boxes,
+                                                     alternative_max_min=user_max)}
+
+        return {'euro': determine_max_per_pallet(pallet_name='euro', tot_pallet=pl_euro_pallet,
+                                                 total_boxes_ordered=total_boxes)}
 
     def get_kievit_pallet_info(self, total_boxes: int):
         """ Returns the suggested pallet combination necessary for the
         total_boxes entered for Kievit's order. """
-        if not self.connection:
-            self.create_connection()
+        range_row = self._get_range_row(table_name=self.kievit_pallet_table, total_boxes=total_boxes,
+                                        columns=['Euro', 'Industrial'])
+        if not range_row:
+            return {}
 
-        kievit_pallet_query = QSqlQuery(self.connection)
-        query = f'SELECT Euro, Industrial ' \
-                f'FROM {self.kievit_pallet_table} WHERE Min_Value <= {total_boxes} ' \
-                f'AND Max_Value >= {total_boxes}'
+        euro_pallet = range_row.get('Euro')
+        ind_pallet = range_row.get('Industrial')
 
-        if kievit_pallet_query.prepare(query):
+        if all((not euro_pallet, not ind_pallet)):
+            return {}
 
-            kievit_pallet_query.exec_()
-            kievit_pallet_query.first()
-            euro_pallet = kievit_pallet_query.value(
-                kievit_pallet_query.record().indexOf('Euro')
-            )
+        pallets = {
+            'euro': euro_pallet,
+            'industrial': ind_pallet,
+        }
+        if self.pallet_optimizer is not None:
+            pallets = self.pallet_optimizer.choose(table_pallets=pallets, total_boxes=total_boxes, is_kievit=True)
+        final_pallets = size_pallets(pallets=pallets, total_boxes=total_boxes, is_kievit=True)
 
-            ind_pallet = kievit_pallet_query.value(
-                kievit_pallet_query.record().indexOf('Industrial')
-            )
-
-            if all((not euro_pallet, not ind_pallet)):
-                return {}
-
-            pallets = {
-                'euro': euro_pallet,
-                'industrial': ind_pallet,
-            }
-            remaining_boxes = total_boxes
-            final_pallets = {}
-            for pallet in pallets:
-                if not pallets[pallet]:
-                    continue
-                else:
-                    final_pallets[pallet] = determine_max_per_pallet(pallet_name=pallet, tot_pallet=pallets[pallet],
-                                                                     total_boxes_ordered=remaining_boxes,
-                                                                     is_kievit=True)
-                    remaining_boxes -= final_pallets[pallet][0] * final_pallets[pallet][1]
-
-            return dict(sorted(final_pallets.items(), key=lambda x: x[1][0] * x[1][1], reverse=True))
-        else:
-            return {}
+        return dict(sorted(final_pallets.items(), key=lambda x: x[1][0] * x[1][1], reverse=True))
 
     def get_pallet_info(self, total_boxes: int):
         """ Returns the suggested pallet combination necessary for the
         total_boxes entered for all logistics that aren't for Poland. """
-        if not self.connection:
-            self.create_connection()
+        range_row = self._get_range_row(table_name=self.pallet_table_name, total_boxes=total_boxes,
+                                        columns=['Euro', 'Industrial', 'Alternative_Euro'])
+        if not range_row:
+            return {}
 
-        pallet_info_query = QSqlQuery(self.connection)
-        query = f'SELECT Euro, Industrial, Alternative_Euro ' \
-                f'FROM {self.pallet_table_name} WHERE Min_Value <= {total_boxes}' \
-                f' and Max_Value >= {total_boxes}'
-        if pallet_info_query.prepare(query):
-            pallet_info_query.exec_()
+        euro_pallet = range_row.get('Euro')
+        industrial_pallet = range_row.get('Industrial')
+        alternative_euro = range_row.get('Alternative_Euro')
 
-            pallet_info_query.first()
+        # If no value is found for the specified total_boxes
+        if all((not euro_pallet, not industrial_pallet, not alternative_euro)):
+            return {}
 
-            euro_pallet = pallet_info_query.value(
-                pallet_info_query.record().indexOf('Euro')
-            )
-            industrial_pallet = pallet_info_query.value(
-                pallet_info_query.record().indexOf('Industrial')
-            )
-            alternative_euro = pallet_info_query.value(
-                pallet_info_query.record().indexOf('Alternative_Euro')
-            )
-            # If no value is found for the specified total_boxes
-            if all((not euro_pallet, not industrial_pallet, not alternative_euro)):
-                return {}
-
-            pallets = {
-                'euro': euro_pallet,
-                'industrial': industrial_pallet,
-                'alternative_euro': alternative_euro
-            }
-            # If there is a value for alternative euro
-            if pallets.get('alternative_euro'):
-                return {'alternative_euro':
-                        determine_max_per_pallet(pallet_name='alternative_euro',
-                                                 tot_pallet=pallets.get('alternative_euro'),
-                                                 total_boxes_ordered=total_boxes)}
+        pallets = {
+            'euro': euro_pallet,
+            'industrial': industrial_pallet,
+            'alternative_euro': alternative_euro
+        }
+        # If there is a value for alternative euro
+        if pallets.get('alternative_euro'):
+            return {'alternative_euro':
+                    determine_max_per_pallet(pallet_name='alternative_euro',
+                                             tot_pallet=pallets.get('alternative_euro'),
+                                             total_boxes_ordered=total_boxes)}
+
+        if self.pallet_optimizer is not None:
+            pallets = self.pallet_optimizer.choose(table_pallets=pallets, total_boxes=total_boxes)
+        return size_pallets(pallets=pallets, total_boxes=total_boxes)
+
+    def replace_range_tables(self, tables: dict) -> bool:
+        """ Replaces the contents of the pallet range tables with the rows in tables,
+        a dict where keys are table names and values are lists of rows as read from Google Sheet.
+        Everything is done in a single transaction: readers keep on seeing the old rows
+        until it's committed and never find a missing or half written table.
+        Returns True if the transaction was committed, False otherwise. """
+        with _WRITER_LOCK:
+            if not self.connection:
+                self.create_connection()
 
-            remaining_boxes = total_boxes
-            final_pallets = {}
-            for pallet in pallets:
-                if not pallets[pallet]:
-                    continue
-                else:
-                    final_pallets[pallet] = determine_max_per_pallet(pallet_name=pallet, tot_pallet=pallets[pallet],
-                                                                     total_boxes_ordered=remaining_boxes)
-                    remaining_boxes -= final_pallets[pallet][0] * final_pallets[pallet][1]
-
-            return final_pallets
-        else:
-            return {}
+            begin_query = QSqlQuery(self.connection)
+            # IMMEDIATE takes the write lock now, waiting (busy timeout) for other writers
+            if not begin_query.exec_('BEGIN IMMEDIATE'):
+                return False
+
+            try:
+                written = True
+                for table_name, rows in tables.items():
+                    self.create_range_table(table_name)
+                    clear_query = QSqlQuery(self.connection)
+                    written = written and clear_query.exec_(f'DELETE FROM {table_name}')
+                    for row in rows:
+                        written = written and self._insert_range_row(table_name=table_name, info_to_write=row)
+            except Exception:
+                # The write lock must not be kept by a transaction left open
+                QSqlQuery(self.connection).exec_('ROLLBACK')
+                raise
+
+            end_query = QSqlQuery(self.connection)
+            if written:
+                return end_query.exec_('COMMIT')
+            end_query.exec_('ROLLBACK')
+            return False
+
+    def _insert_range_row(self, table_name: str, info_to_write: list) -> bool:
+        """ Inserts a row read from Google Sheet in a pallet range table.
+        Rows that don't have as many values as the table's columns are skipped.
+        Returns False if the row wasn't inserted, e.g. because a value isn't a number. """
+        columns = settings.PALLET_TABLE_COLUMNS if table_name == self.pallet_table_name \
+            else settings.KIEVIT_TABLE_COLUMNS
+        if len(info_to_write) != len(columns):
+            return True
+        try:
+            values = [int(value) for value in info_to_write]
+        except (TypeError, ValueError):
+            return False
+
+        pallet_writer_query = QSqlQuery(self.connection)
+        query = f'INSERT INTO {table_name} ({", ".join(columns)}) ' \
+                f'VALUES ({", ".join("?" * len(columns))})'
+        if not pallet_writer_query.prepare(query):
+            return False
+        for value in values:
+            pallet_writer_query.addBindValue(value)
+        return pallet_writer_query.exec_()
 
     def write_to_kievit_pallet_table(self, info_to_write: list):
         """ Writes the necessary information passed into info_to_write parameter
         into kievit table in the database used in this project.
         """
         if len(info_to_write) == settings.MAX_KIEVIT_INFO:
-            self.create_kievit_pallet_table()
-            if not self.connection:
-                self.create_connection()
-            pallet_writer_query = QSqlQuery(self.connection)
-            query = (
-                f"""INSERT INTO {self.kievit_pallet_table} (
-                Min_Value,
-                Max_Value,
-                Euro,
-                Industrial)
-                VALUES (?, ?, ?, ?)"""
-            )
-            if pallet_writer_query.prepare(query):
-                pallet_writer_query.addBindValue(int(info_to_write[0]))
-                pallet_writer_query.addBindValue(int(info_to_write[1]))
-                pallet_writer_query.addBindValue(int(info_to_write[2]))
-                pallet_writer_query.addBindValue(int(info_to_write[3]))
-
-                pallet_writer_query.exec_()
-                return True
+            with _WRITER_LOCK:
+                self.create_kievit_pallet_table()
+                return self._insert_range_row(table_name=self.kievit_pallet_table,
+                                              info_to_write=info_to_write)
 
     def write_to_pallet_table(self, info_to_write: list):
         """ Writes the necessary information passed into info_to_write parameter
         into pallet_table in the database used in this project.
         """
         if len(info_to_write) == settings.MAX_PALLET_INFO:
+            with _WRITER_LOCK:
+                self.create_pallet_table()
+                return self._insert_range_row(table_name=self.pallet_table_name,
+                                              info_to_write=info_to_write)
+
+    def create_range_table(self, table_name: str):
+        """ Creates the pallet range table called table_name. """
+        if table_name == self.pallet_table_name:
             self.create_pallet_table()
-            if not self.connection:
-                self.create_connection()
-            pallet_writer_query = QSqlQuery(self.connection)
-            query = (
-                f"""INSERT INTO {self.pallet_table_name} (
-                Min_Value,
-                Max_Value,
-                Euro,
-                Industrial,
-                Alternative_Euro,
-                Poland_Euro)
-                VALUES (?, ?, ?, ?, ?, ?)"""
-            )
-            if pallet_writer_query.prepare(query):
-                pallet_writer_query.addBindValue(int(info_to_write[0]))
-                pallet_writer_query.addBindValue(int(info_to_write[1]))
-                pallet_writer_query.addBindValue(int(info_to_write[2]))
-                pallet_writer_query.addBindValue(int(info_to_write[3]))
-                pallet_writer_query.addBindValue(int(info_to_write[4]))
-                pallet_writer_query.addBindValue(int(info_to_write[5]))
-
-                pallet_writer_query.exec_()
-                return True
+        else:
+            self.create_kievit_pallet_table()
 
     def create_pallet_table(self):
         """ Creates the table where information related to pallets
@@ -339,8 +408,23 @@ class DatabaseCommunicator:
             self.db_driver, self.con_name
         )
         self.connection.setDatabaseName(self.db_name)
+        # Wait for other users' locks instead of failing straight away
+        self.connection.setConnectOptions(f'QSQLITE_BUSY_TIMEOUT={settings.DATABASE_BUSY_TIMEOUT_MS}')
         if not self.connection.open():
             self.con_error = True
+            return
+
+        # WAL lets readers go on while someone is writing (it's stored in the database file)
+        wal_query = QSqlQuery(self.connection)
+        wal_query.exec_('PRAGMA journal_mode=WAL')
+        wal_query.finish()
+
+    def close_connection(self):
+        """ Closes and removes the connection of this class. """
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+            QSqlDatabase.removeDatabase(self.con_name)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+""" Fixed point numbers used for the pallet ratios of orders and the capacity of pallets.
+Values are integers in RATIO_SCALE-ths of a box (hundredths by default), so that
+placing boxes only needs exact integer arithmetic.
+Rounding is half to even, as Python's round() does. """
+
+from decimal import Decimal, ROUND_HALF_EVEN
+
+# Self defined modules
+import settings
+
+RATIO_SCALE = settings.RATIO_SCALE
+
+
+def parse_ratio(text: str) -> int:
+    """ Returns the ratio written in text (e.g. '12,5' or '12.5') in fixed point. """
+    ratio = Decimal(str(text).strip().replace(',', '.')) * RATIO_SCALE
+    return int(ratio.to_integral_value(rounding=ROUND_HALF_EVEN))
+
+
+def round_div(numerator: int, denominator: int) -> int:
+    """ Returns numerator / denominator rounded half to even. denominator must be positive. """
+    quotient, remainder = divmod(numerator, denominator)
+    if remainder * 2 > denominator or (remainder * 2 == denominator and quotient % 2):
+        quotient += 1
+    return quotient
+
+
+def boxes_to_fixed(boxes: int) -> int:
+    return boxes * RATIO_SCALE
+
+
+def round_to_boxes(value: int) -> int:
+    """ Returns value rounded to whole boxes, still in fixed point. """
+    return round_div(value, RATIO_SCALE) * RATIO_SCALE
+
+
+def ceil_boxes(value: int) -> int:
+    """ Returns the number of whole boxes needed for value. """
+    return -(-value // RATIO_SCALE)
+
+
+if __name__ == '__main__':
+    pass
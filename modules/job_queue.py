@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+""" Runs several planning jobs (one per Google Sheet link or local order file)
+concurrently, sharing credentials, Sheets service and pallet range tables. """
+
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from helper_modules import helper_functions
+
+# Self defined modules
+import settings
+from api_communicator import PedApi
+from planning_context import get_default_context
+
+
+class PlanJob:
+    """ A planning job and its status. """
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, job_id: int, source: str, overwrite_data: bool = True,
+                 user_max_boxes: int = 0):
+        self.job_id = job_id
+        # Google Sheet link or path of a local order file
+        self.source = source
+        self.overwrite_data = overwrite_data
+        self.user_max_boxes = user_max_boxes
+
+        self.status = PlanJob.PENDING
+        self.message = ''
+        self.queued_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+        self.future = None
+
+    @property
+    def is_local_file(self) -> bool:
+        return os.path.isfile(self.source)
+
+    @property
+    def duration(self):
+        """ Seconds spent running the job, None if it hasn't finished. """
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+    def to_dict(self) -> dict:
+        return {'job_id': self.job_id, 'source': self.source, 'status': self.status,
+                'message': self.message, 'queued_at': self.queued_at,
+                'started_at': self.started_at, 'finished_at': self.finished_at,
+                'duration': self.duration}
+
+
+class JobQueue:
+    """ Runs planning jobs on max_workers threads. All jobs share the same context. """
+
+    def __init__(self, max_workers: int = settings.JOB_QUEUE_WORKERS, context=None):
+        self.context = context if context is not None else get_default_context()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ped_job')
+
+        self.jobs = {}
+        self._job_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+        # Finished jobs are forgotten after finished_job_ttl seconds, and only the
+        # last max_finished_jobs of them are kept (a daemon runs for days)
+        self.finished_job_ttl = settings.FINISHED_JOB_TTL
+        self.max_finished_jobs = settings.MAX_FINISHED_JOBS
+
+    def submit(self, source: str, overwrite_data: bool = True,
+               user_max_boxes: int = 0) -> PlanJob:
+        """ Queues a job for source (a Google Sheet link or a local order file). """
+        with self._lock:
+            self._prune_jobs()
+            job = PlanJob(job_id=next(self._job_ids), source=source,
+                          overwrite_data=overwrite_data, user_max_boxes=user_max_boxes)
+            self.jobs[job.job_id] = job
+        job.future = self.executor.submit(self._run_job, job)
+        return job
+
+    def submit_many(self, sources: list, overwrite_data: bool = True,
+                    user_max_boxes: int = 0) -> list:
+        return [self.submit(source=source, overwrite_data=overwrite_data,
+                            user_max_boxes=user_max_boxes)
+                for source in sources]
+
+    def get_job(self, job_id: int):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def get_jobs(self) -> list:
+        with self._lock:
+            return list(self.jobs.values())
+
+    def _prune_jobs(self):
+        """ Forgets the finished jobs older than finished_job_ttl and the oldest ones beyond
+        max_finished_jobs. To be called holding the lock. """
+        now = time.time()
+        finished_jobs = sorted((job for job in self.jobs.values() if job.finished_at is not None),
+                               key=lambda job: job.finished_at)
+        expired_jobs = [job for job in finished_jobs if now - job.finished_at > self.finished_job_ttl]
+        kept_jobs = finished_jobs[len(expired_jobs):]
+        expired_jobs += kept_jobs[:max(0, len(kept_jobs) - self.max_finished_jobs)]
+        for job in expired_jobs:
+            del self.jobs[job.job_id]
+
+    def wait(self, jobs: list = None) -> list:
+        """ Waits for jobs (all the queued jobs by default) to finish and returns them. """
+        jobs = self.get_jobs() if jobs is None else jobs
+        wait([job.future for job in jobs])
+        return jobs
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    def _run_job(self, job: PlanJob):
+        job.status = PlanJob.RUNNING
+        job.started_at = time.time()
+        try:
+            if job.is_local_file:
+                pallet_api = PedApi(order_file=job.source, for_pallets=True,
+                                    overwrite_data=job.overwrite_data,
+                                    user_max_boxes=job.user_max_boxes, context=self.context)
+            elif helper_functions.get_sheet_id(google_sheet_link=job.source):
+                pallet_api = PedApi(order_spreadsheet=job.source, for_pallets=True,
+                                    overwrite_data=job.overwrite_data,
+                                    user_max_boxes=job.user_max_boxes, context=self.context)
+            else:
+                job.status = PlanJob.FAILED
+                job.message = 'Link o file non valido'
+                return job
+
+            pallet_api.construct_pallets()
+            job.status = PlanJob.DONE if pallet_api.run_status == 'done' else PlanJob.FAILED
+            job.message = pallet_api.run_message
+        except Exception as error:
+            job.status = PlanJob.FAILED
+            job.message = str(error)
+        finally:
+            job.finished_at = time.time()
+        return job
+
+
+if __name__ == '__main__':
+    pass
@@ -1,26 +1,27 @@
 #!/usr/bin/env python
 import sys
 
-from PyQt5.QtCore import QThread
+from PyQt5.QtCore import QTimer
 from PyQt5.QtGui import QFont, QIntValidator
 from PyQt5.QtWidgets import (QApplication, QLabel,
                              QWidget, QMainWindow, QPushButton,
                              QComboBox, QLineEdit, QGridLayout,
-                             QMessageBox)
+                             QMessageBox, QDialog)
 # Self defined modules
 from helper_modules import helper_functions
 
+import planning_daemon
 import settings
 from api_communicator import PedApi
 from db_communicator import DatabaseCommunicator
+from plan_preview import PlanPreviewDialog
+from planning_context import get_default_context
+from run_checkpoint import has_checkpoint
+from workers import Worker
 
 MSG_FONT = QFont('Italics', 13)
 BUTTONS_FONT = QFont('Times', 13)
 
-APP_INFO_JSON_CONTENTS = helper_functions.json_file_loader(
-    file_name=settings.INFORMATION_JSON
-)
-
 
 class MainPage(QMainWindow):
     """" User GUI. """
@@ -52,6 +53,37 @@ class MainPage(QMainWindow):
 
         self.max_boxes = 0
 
+        # Background jobs that load what a run needs while the user fills in the form
+        self.warm_up_worker = None
+        self.orders_prefetch_worker = None
+        self.prefetched_sheet_link = None
+        # The orders are read once the user stops typing the link
+        self.orders_prefetch_timer = QTimer(self)
+        self.orders_prefetch_timer.setSingleShot(True)
+        self.orders_prefetch_timer.setInterval(settings.ORDERS_PREFETCH_DELAY_MS)
+        self.orders_prefetch_timer.timeout.connect(self._prefetch_orders)
+
+    def showEvent(self, event):
+        """ Starts loading credentials, Sheets client and pallet range tables
+        as soon as the window is shown for the first time. """
+        super(MainPage, self).showEvent(event)
+        if self.warm_up_worker is None:
+            self.warm_up_worker = Worker(get_default_context().warm_up)
+            self.warm_up_worker.start()
+
+    def _prefetch_orders(self):
+        """ Starts reading the orders of the link entered, unless they are already being read. """
+        if self.google_sheet_link == self.prefetched_sheet_link:
+            return
+        self.prefetched_sheet_link = self.google_sheet_link
+        self.orders_prefetch_worker = Worker(PedApi(order_spreadsheet=self.google_sheet_link).prefetch_orders)
+        # Nothing to tell the user: the run reads the orders itself, and may read them again next time
+        self.orders_prefetch_worker.signals.error.connect(self._forget_prefetch)
+        self.orders_prefetch_worker.start()
+
+    def _forget_prefetch(self):
+        self.prefetched_sheet_link = None
+
     def _connect_signals_slots(self):
         """ Connects widgets with their respective functions """
         self.g_sheet_link.textChanged.connect(self._link_label_responder)
@@ -78,56 +110,120 @@ class MainPage(QMainWindow):
                 custom_msg=msg
             )
 
+        resume_saved_orders = False
         if ask_user == QMessageBox.Yes:
-            self.pallet_thread = QThread()
-            if self.max_boxes:
-
-                self.pallet_api_cls = PedApi(order_spreadsheet=self.google_sheet_link,
-                                             for_pallets=True,
-                                             overwrite_data=self.value_dict[self.to_do_combo.currentText()],
-                                             user_max_boxes=self.max_boxes)
-            else:
-                self.pallet_api_cls = PedApi(order_spreadsheet=self.google_sheet_link,
-                                             for_pallets=True,
-                                             overwrite_data=self.value_dict[self.to_do_combo.currentText()])
-
-            # Move thread
-            self.pallet_api_cls.moveToThread(self.pallet_thread)
-
-            # Connect this thread and the function that constructs pallets
-            self.pallet_thread.started.connect(
-                self.pallet_api_cls.construct_pallets
-            )
-
-            # Update app's state
-            self.pallet_api_cls.started.connect(self._update_while_busy)
-            self.pallet_api_cls.finished.connect(self._update_after_done)
-            self.pallet_api_cls.finished.connect(self._communicate_pallet_success_outcome)
-
-            self.pallet_api_cls.unfinished.connect(self._update_after_done)
-            self.pallet_api_cls.unfinished.connect(self._communicate_pallet_error_outcome)
-
-            self.pallet_api_cls.empty_orders.connect(self._update_after_done)
-            self.pallet_api_cls.empty_orders.connect(self._communicate_pallet_error_outcome)
-
-            self.pallet_api_cls.empty_order_table.connect(self._update_after_done)
-            self.pallet_api_cls.empty_order_table.connect(self._communicate_pallet_error_outcome)
-
-            # Do clean up
-            self.pallet_api_cls.finished.connect(self.pallet_thread.quit)
-            self.pallet_api_cls.finished.connect(self.pallet_thread.deleteLater)
-
-            self.pallet_api_cls.unfinished.connect(self.pallet_thread.quit)
-            self.pallet_api_cls.unfinished.connect(self.pallet_thread.deleteLater)
-
-            self.pallet_api_cls.empty_orders.connect(self.pallet_thread.quit)
-            self.pallet_api_cls.empty_orders.connect(self.pallet_thread.deleteLater)
-
-            self.pallet_api_cls.empty_order_table.connect(self.pallet_thread.quit)
-            self.pallet_api_cls.empty_order_table.connect(self.pallet_thread.deleteLater)
-
-            # Start thread
-            self.pallet_thread.start()
+            # Orders read from now on would come too late for this run
+            self.orders_prefetch_timer.stop()
+            resume_saved_orders = self._ask_for_resume()
+
+        # Interrupted runs are resumed locally, where their checkpoint is
+        if ask_user == QMessageBox.Yes and settings.USE_PLANNING_DAEMON and not settings.PREVIEW_BEFORE_WRITE \
+                and not resume_saved_orders:
+            self._submit_to_daemon()
+
+        elif ask_user == QMessageBox.Yes:
+            self._construct_pallets_locally(resume_saved_orders=resume_saved_orders)
+
+    def _construct_pallets_locally(self, resume_saved_orders: bool = False):
+        """ Runs the pallet construction in this process, on the thread pool. """
+        # Creating PedApi does no I/O, all the fetching is done by construct_pallets
+        # which is run on the shared thread pool
+        if self.max_boxes:
+
+            self.pallet_api_cls = PedApi(order_spreadsheet=self.google_sheet_link,
+                                         for_pallets=True,
+                                         overwrite_data=self.value_dict[self.to_do_combo.currentText()],
+                                         user_max_boxes=self.max_boxes,
+                                         preview_before_write=settings.PREVIEW_BEFORE_WRITE,
+                                         resume_saved_orders=resume_saved_orders)
+        else:
+            self.pallet_api_cls = PedApi(order_spreadsheet=self.google_sheet_link,
+                                         for_pallets=True,
+                                         overwrite_data=self.value_dict[self.to_do_combo.currentText()],
+                                         preview_before_write=settings.PREVIEW_BEFORE_WRITE,
+                                         resume_saved_orders=resume_saved_orders)
+
+        # Update app's state
+        self.pallet_api_cls.started.connect(self._update_while_busy)
+        self.pallet_api_cls.finished.connect(self._update_after_done)
+        self.pallet_api_cls.finished.connect(self._communicate_pallet_success_outcome)
+
+        self.pallet_api_cls.unfinished.connect(self._update_after_done)
+        self.pallet_api_cls.unfinished.connect(self._communicate_pallet_error_outcome)
+
+        self.pallet_api_cls.empty_orders.connect(self._update_after_done)
+        self.pallet_api_cls.empty_orders.connect(self._communicate_pallet_error_outcome)
+
+        self.pallet_api_cls.empty_order_table.connect(self._update_after_done)
+        self.pallet_api_cls.empty_order_table.connect(self._communicate_pallet_error_outcome)
+
+        self.pallet_api_cls.api_budget_warning.connect(self._communicate_pallet_error_outcome)
+        self.pallet_api_cls.history_error.connect(self._communicate_pallet_error_outcome)
+        self.pallet_api_cls.export_error.connect(self._communicate_pallet_error_outcome)
+
+        self.pallet_api_cls.plan_ready.connect(self._show_plan_preview)
+
+        self.pallet_worker = Worker(self.pallet_api_cls.construct_pallets)
+        # If something goes wrong (e.g. network errors)
+        self.pallet_worker.signals.error.connect(self._update_after_done)
+        self.pallet_worker.signals.error.connect(self._communicate_pallet_error_outcome)
+
+        self._update_while_busy()
+        self.pallet_worker.start()
+
+    def _ask_for_resume(self) -> bool:
+        """ If a run on the link was interrupted, asks whether to resume it on the orders it read then
+        (changes made to the sheet since are ignored) instead of reading them again. """
+        if not settings.USE_ORDER_SNAPSHOTS or not settings.USE_RUN_CHECKPOINTS:
+            return False
+        if not has_checkpoint(helper_functions.get_sheet_id(google_sheet_link=self.google_sheet_link)):
+            return False
+        user_choice = QMessageBox.question(
+            self, settings.WINDOW_TITLE,
+            'La composizione precedente delle pedane di questo foglio è stata interrotta.\n'
+            'Vuoi riprenderla con gli ordini letti allora? Le modifiche fatte dopo nel foglio non saranno incluse.\n'
+            'Clicca su "No" per rileggere gli ordini dal foglio.',
+            QMessageBox.Yes | QMessageBox.No, QMessageBox.No
+        )
+        return user_choice == QMessageBox.Yes
+
+    def _show_plan_preview(self):
+        """ Shows the plan constructed and, if the user confirms it, writes it on the thread pool. """
+        plan_preview = PlanPreviewDialog(final_data=self.pallet_api_cls.final_data,
+                                         placement_details=self.pallet_api_cls.placement_details, parent=self)
+        if plan_preview.exec_() != QDialog.Accepted:
+            self.pallet_api_cls.discard_plan()
+            self._update_after_done()
+            return
+
+        self.pallet_write_worker = Worker(self.pallet_api_cls.write_previewed_plan)
+        self.pallet_write_worker.signals.error.connect(self._update_after_done)
+        self.pallet_write_worker.signals.error.connect(self._communicate_pallet_error_outcome)
+        self.pallet_write_worker.start()
+
+    def _submit_to_daemon(self):
+        """ Runs the pallet construction on the planning daemon, waiting for it on the thread pool.
+        If the daemon isn't running, the pallets are constructed locally. """
+        self.daemon_worker = Worker(planning_daemon.submit_and_wait_if_running, sources=[self.google_sheet_link],
+                                    overwrite_data=self.value_dict[self.to_do_combo.currentText()],
+                                    user_max_boxes=self.max_boxes)
+        self.daemon_worker.signals.result.connect(self._daemon_result_communicator)
+        self.daemon_worker.signals.error.connect(self._update_after_done)
+        self.daemon_worker.signals.error.connect(self._communicate_pallet_error_outcome)
+
+        self._update_while_busy()
+        self.daemon_worker.start()
+
+    def _daemon_result_communicator(self, jobs):
+        if jobs is None:
+            self._construct_pallets_locally()
+            return
+        self._update_after_done()
+        job = jobs[0]
+        if job['status'] == 'done':
+            self._communicate_pallet_success_outcome(job['message'])
+        else:
+            self._communicate_pallet_error_outcome(job['message'])
 
     def _communicate_pallet_error_outcome(self, msg):
         helper_functions.output_communicator(
@@ -160,7 +256,8 @@ class MainPage(QMainWindow):
 
     def _pallet_db_update(self):
         """ Responds to user's click on the button called Aggiornare DB.
-        It basically reads data from a Google Sheet and saves it in database (sqlite). """
+        It basically reads data from a Google Sheet and saves it in database (sqlite).
+        The download and the database writing are run on the shared thread pool. """
         db_class = DatabaseCommunicator()
         check_pallet_table = db_class.check_table(settings.PALLET_INFO_TABLE)
         if check_pallet_table:
@@ -168,25 +265,19 @@ class MainPage(QMainWindow):
             ask_user = helper_functions.ask_for_overwrite(
                 msg_box_font=MSG_FONT, window_tile=settings.WINDOW_TITLE,
                 custom_msg=custom_message)
-            # If user chooses to drop table
-            if ask_user == QMessageBox.Yes:
-                # Drop table
-                db_class.drop_table(settings.PALLET_INFO_TABLE)
-                db_class.drop_table(settings.KIEVIT_PALLET_TABLE)
-
-                db_update_class = PedApi()
-                # Then update it with new data.
-                update_req = db_update_class.update_pallet_table()
-                update_kievit_req = db_update_class.update_kievit_pallet_table()
-                if all((update_kievit_req, update_req)):
-                    self._db_result_communicator(result=update_req)
-                else:
-                    self._db_result_communicator(result=False)
-        else:
-            db_update_class = PedApi()
-            # Then update it with new data.
-            update_result = db_update_class.update_pallet_table()
-            self._db_result_communicator(result=update_result)
+            # If user chooses not to overwrite the existing data
+            if ask_user != QMessageBox.Yes:
+                return
+
+        # The tables are replaced in a single transaction, planning runs
+        # going on meanwhile keep on reading the old data
+        self.db_update_worker = Worker(PedApi().refresh_pallet_tables)
+        self.db_update_worker.signals.result.connect(self._db_result_communicator)
+        self.db_update_worker.signals.error.connect(lambda: self._db_result_communicator(result=False))
+        self.db_update_worker.signals.finished.connect(lambda: self.update_db_btn.setEnabled(True))
+
+        self.update_db_btn.setEnabled(False)
+        self.db_update_worker.start()
 
     def _db_result_communicator(self, result: bool):
         if result:
@@ -242,10 +333,12 @@ class MainPage(QMainWindow):
                 self.max_boxes_value_line_edit.setEnabled(True)
                 self.combine_pallet_btn.setEnabled(True)
                 self.google_sheet_link = self.g_sheet_link.text()
+                self.orders_prefetch_timer.start()
         else:
             self.to_do_combo.setEnabled(False)
             self.max_boxes_value_line_edit.setEnabled(False)
             self.combine_pallet_btn.setEnabled(False)
+            self.orders_prefetch_timer.stop()
 
     def _set_initial_state(self):
         """ Sets the initial state of the GUI by enabling some widgets. """
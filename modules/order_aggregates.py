@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+""" Per logistic totals (by variety and by client) of the orders still to be placed.
+They are built once per logistic and updated as boxes are placed, instead of
+being computed again from all the orders for every pallet. """
+
+# Self defined modules
+import settings
+from order_schema import CLIENT_ORDER, LOGISTIC, PRODUCT_CODE, VARIETY
+
+
+class GroupTotals:
+    """ Totals of the rows of a group (e.g. a variety) and the order they must be read in:
+    highest total first and, when equal, the group whose first remaining row comes first. """
+
+    def __init__(self):
+        self.totals = {}
+        self.counts = {}
+        # Positions of the group's rows (in all_orders) and the index of the first remaining one
+        self.positions = {}
+        self.heads = {}
+
+    def add(self, key: str, value, position: int):
+        if key not in self.totals:
+            self.totals[key] = 0
+            self.counts[key] = 0
+            self.positions[key] = []
+            self.heads[key] = 0
+        self.totals[key] += value
+        self.counts[key] += 1
+        self.positions[key].append(position)
+
+    def change(self, key: str, delta):
+        self.totals[key] += delta
+
+    def remove(self, key: str, value, removed_positions: set):
+        self.counts[key] -= 1
+        if not self.counts[key]:
+            for group in (self.totals, self.counts, self.positions, self.heads):
+                del group[key]
+            return
+        self.totals[key] -= value
+        key_positions = self.positions[key]
+        while key_positions[self.heads[key]] in removed_positions:
+            self.heads[key] += 1
+
+    def ordered(self) -> list:
+        """ Returns the (key, total) pairs, highest total first. """
+        return sorted(self.totals.items(),
+                      key=lambda item: (-item[1], self.positions[item[0]][self.heads[item[0]]]))
+
+
+class LogisticAggregates:
+    """ Variety and client totals of the orders of logistic that aren't processed yet.
+    ratio_of(order) returns the pallet ratio of an order. """
+
+    def __init__(self, logistic: str, all_orders: list, processed_orders: list, ratio_of):
+        self.logistic = logistic
+        self.ratio_of = ratio_of
+
+        self.varieties = GroupTotals()
+        self.clients = GroupTotals()
+
+        # Rows counted in the totals: id(row) -> [row, position, ratio]
+        self._counted = {}
+        self._ids_by_code = {}
+        self._removed_positions = set()
+        # Rows of each variety, in the order they have in all_orders
+        self._variety_rows = {}
+
+        for position, order in enumerate(all_orders):
+            if order[LOGISTIC] != logistic or order[PRODUCT_CODE] in processed_orders:
+                continue
+            ratio = self.ratio_of(order)
+            self._counted[id(order)] = [order, position, ratio]
+            self._ids_by_code.setdefault(order[PRODUCT_CODE], []).append(id(order))
+            self._variety_rows.setdefault(order[VARIETY], []).append(order)
+            self.varieties.add(order[VARIETY], ratio, position)
+            self.clients.add(order[CLIENT_ORDER], ratio, position)
+
+    def get_varieties(self) -> dict:
+        """ Same as PedApi.get_log_varieties: mix boxes first, then the other varieties,
+        each from the highest to the lowest total ratio. """
+        sort_varieties = dict(self.varieties.ordered())
+        final_data = {}
+        for product_code, value in sort_varieties.items():
+            if product_code.split('--')[0].strip() == settings.MIX_BOX_NAME:
+                final_data[product_code] = value
+        final_data.update(sort_varieties)
+        return final_data
+
+    def get_clients(self) -> dict:
+        """ Same as PedApi.get_logistic_clients: clients from the highest to the lowest total ratio. """
+        return dict(self.clients.ordered())
+
+    def get_variety_orders(self, variety: str) -> list:
+        """ Returns the rows of variety still to be placed, in the order they have in all_orders. """
+        return [order for order in self._variety_rows.get(variety, []) if id(order) in self._counted]
+
+    def order_removed(self, order: list):
+        """ To be called when order is removed from all_orders. """
+        counted = self._counted.pop(id(order), None)
+        if counted is None:
+            return
+        _, position, ratio = counted
+        self._removed_positions.add(position)
+        self.varieties.remove(order[VARIETY], ratio, self._removed_positions)
+        self.clients.remove(order[CLIENT_ORDER], ratio, self._removed_positions)
+
+    def code_processed(self, product_code: str):
+        """ To be called when product_code is added to the processed orders:
+        none of its rows is counted anymore. """
+        for order_id in self._ids_by_code.pop(product_code, []):
+            if order_id in self._counted:
+                self.order_removed(self._counted[order_id][0])
+
+    def ratio_changed(self, order: list):
+        """ To be called after the ratio of order has been modified in place. """
+        counted = self._counted.get(id(order))
+        if counted is None:
+            return
+        new_ratio = self.ratio_of(order)
+        delta = new_ratio - counted[2]
+        counted[2] = new_ratio
+        self.varieties.change(order[VARIETY], delta)
+        self.clients.change(order[CLIENT_ORDER], delta)
+
+
+if __name__ == '__main__':
+    pass
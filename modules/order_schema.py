@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+""" Columns of the order sheet used by the planner and how they are decoded.
+Orders are handled internally as lists whose positions are the ones declared
+here (e.g. order[PALLET_RATIO]). sheet_offset is the position of the column in
+the order range, so that only the columns declared are read from the sheet. """
+
+# Self defined modules
+from fixed_point import parse_ratio
+
+
+class OrderColumn:
+    """ A column of the order sheet, whose cells are decoded with parse.
+    typecode is the array type the column is stored as in order snapshots (see order_snapshot.py):
+    orders are mutable rows, so the planner never holds a column as an array. """
+
+    def __init__(self, name: str, sheet_offset: int, parse=str, typecode: str = None):
+        self.name = name
+        self.sheet_offset = sheet_offset
+        self.parse = parse
+        self.typecode = typecode
+
+    def decode(self, cells: list) -> list:
+        return [self.parse(cell) for cell in cells]
+
+
+# Positions of the columns in the orders
+PRODUCT_CODE = 0
+DETAIL = 1
+QUANTITY = 2
+CHANNEL = 3
+SHIPPING_DATE = 4
+LOGISTIC = 5
+PALLET_RATIO = 6
+VARIETY = 7
+CLIENT_ORDER = 8
+PRIORITY = 9
+ALPHA_POSITION = 10
+
+ORDER_SCHEMA = [
+    OrderColumn('product_code', sheet_offset=0),
+    # Only used to sort orders
+    OrderColumn('detail', sheet_offset=1),
+    # Boxes ordered, kept as written in the sheet
+    OrderColumn('quantity', sheet_offset=2),
+    OrderColumn('channel', sheet_offset=3),
+    OrderColumn('shipping_date', sheet_offset=4),
+    OrderColumn('logistic', sheet_offset=5),
+    # In fixed point (see fixed_point.py)
+    OrderColumn('pallet_ratio', sheet_offset=6, parse=parse_ratio, typecode='q'),
+    OrderColumn('variety', sheet_offset=7),
+    OrderColumn('client_order', sheet_offset=8),
+    # Sorts the orders of Corbari's logistics
+    OrderColumn('priority', sheet_offset=9),
+    # Position of the letter given to the logistic
+    OrderColumn('alpha_position', sheet_offset=10),
+]
+
+
+def get_column_runs(schema: list = None) -> list:
+    """ Returns the sheet offsets of the columns of schema grouped in runs of adjacent columns,
+    e.g. [[0, 1, 2], [5]], so that each run can be read as a single range. """
+    runs = []
+    for sheet_offset in sorted(column.sheet_offset for column in (schema or ORDER_SCHEMA)):
+        if runs and sheet_offset == runs[-1][-1] + 1:
+            runs[-1].append(sheet_offset)
+        else:
+            runs.append([sheet_offset])
+    return runs
+
+
+def columns_to_orders(sheet_columns: dict, schema: list = None) -> list:
+    """ Returns the orders whose cells are in sheet_columns, a dict where keys are sheet offsets
+    and values are the cells of that column (as read with majorDimension=COLUMNS).
+    Rows with no value in any column are skipped. """
+    schema = schema or ORDER_SCHEMA
+    rows_read = max((len(cells) for cells in sheet_columns.values()), default=0)
+    raw_columns = []
+    for column in schema:
+        cells = sheet_columns.get(column.sheet_offset, [])
+        raw_columns.append(cells + [''] * (rows_read - len(cells)))
+
+    filled_rows = [row_index for row_index in range(rows_read)
+                   if any(str(cells[row_index]).strip() for cells in raw_columns)]
+    decoded_columns = [column.decode([cells[row_index] for row_index in filled_rows])
+                       for column, cells in zip(schema, raw_columns)]
+    return [list(order) for order in zip(*decoded_columns)]
+
+
+def row_to_order(row: list, schema: list = None) -> list:
+    """ Returns the order written in row (a row of the order range, e.g. of a local order file). """
+    schema = schema or ORDER_SCHEMA
+    cells = [row[column.sheet_offset] if column.sheet_offset < len(row) else '' for column in schema]
+    return [column.parse(cell) for column, cell in zip(schema, cells)]
+
+
+if __name__ == '__main__':
+    pass
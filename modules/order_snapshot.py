@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+""" Local snapshots of the orders read from an order spreadsheet.
+After the orders are read, they are saved column by column in a binary file keyed
+by spreadsheet id, with a hash of their content: the file is rewritten only when
+the orders changed. A run asked to resume an interrupted one reads the snapshot, if it
+has the orders the interrupted run was planned on, instead of downloading the order
+range again (see PedApi.get_all_orders), as does any run in
+offline mode, and the snapshot can be memory-mapped for offline analysis (see
+OrderSnapshot.get_columns).
+
+File layout: MAGIC, the length of the header (8 bytes, little endian), the header
+(json) and the columns, each starting at an offset multiple of 8. Columns with a
+typecode (see order_schema.py) are stored as a native array of that type; the other
+columns as the utf-8 text of all their values followed by the offsets (in characters)
+where each value ends, as an int64 array. """
+
+import hashlib
+import json
+import mmap
+import os
+import sys
+import time
+from array import array
+
+# Self defined modules
+import settings
+from order_schema import ORDER_SCHEMA
+
+MAGIC = b'PEDSNAP1'
+SNAPSHOT_VERSION = 1
+ALIGNMENT = 8
+
+
+def get_snapshot_file_name(spreadsheet_id: str, snapshot_dir: str = settings.ORDER_SNAPSHOT_DIR) -> str:
+    source_key = hashlib.sha1(spreadsheet_id.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(snapshot_dir, f'{source_key}.ped')
+
+
+def get_orders_hash(orders: list) -> str:
+    """ Returns a hash of the content of orders. """
+    return hashlib.sha256(json.dumps(orders, default=str).encode('utf-8')).hexdigest()
+
+
+def _encode_column(column, values: list) -> tuple:
+    """ Returns the blocks (bytes) column is stored in and its layout for the header. """
+    if column.typecode:
+        data = array(column.typecode, values).tobytes()
+        return [data], {'name': column.name, 'typecode': column.typecode, 'length': len(data)}
+
+    text = ''.join(values)
+    ends, position = array('q'), 0
+    for value in values:
+        position += len(value)
+        ends.append(position)
+    text_data = text.encode('utf-8')
+    return [text_data, ends.tobytes()], {'name': column.name, 'text_length': len(text_data),
+                                         'length': len(ends) * ends.itemsize}
+
+
+def _padding(size: int) -> bytes:
+    return b'\0' * (-size % ALIGNMENT)
+
+
+def write_snapshot(file_name: str, spreadsheet_id: str, orders: list, content_hash: str, schema: list = None):
+    """ Writes orders (as handled internally, see order_schema.py) to file_name.
+    The file is replaced only once it has been fully written. """
+    schema = schema or ORDER_SCHEMA
+    column_values = list(zip(*orders)) if orders else [()] * len(schema)
+
+    columns, blocks = [], []
+    for column, values in zip(schema, column_values):
+        column_blocks, layout = _encode_column(column, [value if column.typecode else str(value)
+                                                        for value in values])
+        columns.append(layout)
+        blocks.append(column_blocks)
+
+    header = {'version': SNAPSHOT_VERSION, 'spreadsheet_id': spreadsheet_id, 'content_hash': content_hash,
+              'saved_at': time.time(), 'rows': len(orders), 'byteorder': sys.byteorder, 'columns': columns}
+    # Offsets depend on the header's length, which depends on the offsets: they're given
+    # relative to the end of the padded header
+    offset = 0
+    for layout, column_blocks in zip(columns, blocks):
+        layout['offset'] = offset
+        for block in column_blocks:
+            offset += len(block) + len(_padding(len(block)))
+    header_data = json.dumps(header).encode('utf-8')
+    header_data += b' ' * (-(len(MAGIC) + 8 + len(header_data)) % ALIGNMENT)
+
+    os.makedirs(os.path.dirname(file_name) or '.', exist_ok=True)
+    temp_file_name = f'{file_name}.tmp'
+    with open(temp_file_name, 'wb') as snapshot_file:
+        snapshot_file.write(MAGIC)
+        snapshot_file.write(len(header_data).to_bytes(8, 'little'))
+        snapshot_file.write(header_data)
+        for column_blocks in blocks:
+            for block in column_blocks:
+                snapshot_file.write(block)
+                snapshot_file.write(_padding(len(block)))
+    os.replace(temp_file_name, file_name)
+
+
+class OrderSnapshot:
+    """ A snapshot file, memory-mapped. Use it as a context manager (or call close). """
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        with open(file_name, 'rb') as snapshot_file:
+            self._map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if self._map[:len(MAGIC)] != MAGIC:
+                raise ValueError(f'{file_name} non è uno snapshot degli ordini')
+            header_length = int.from_bytes(self._map[len(MAGIC):len(MAGIC) + 8], 'little')
+            self._data_start = len(MAGIC) + 8 + header_length
+            self.header = json.loads(self._map[len(MAGIC) + 8:self._data_start].decode('utf-8'))
+            if self.header.get('version') != SNAPSHOT_VERSION or self.header.get('byteorder') != sys.byteorder:
+                raise ValueError(f'Snapshot {file_name} in un formato non supportato')
+        except Exception:
+            self._map.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def content_hash(self) -> str:
+        return self.header['content_hash']
+
+    @property
+    def age(self) -> float:
+        """ Seconds since the snapshot was last found up to date with the sheet (see save_snapshot). """
+        return time.time() - os.path.getmtime(self.file_name)
+
+    def get_column(self, name: str):
+        """ Returns the values of column name: a read-only memoryview on the file for columns
+        with a typecode (nothing is copied), a list of strings for the others. """
+        layout = next(layout for layout in self.header['columns'] if layout['name'] == name)
+        start = self._data_start + layout['offset']
+        if 'typecode' in layout:
+            return memoryview(self._map)[start:start + layout['length']].cast(layout['typecode'])
+
+        text = self._map[start:start + layout['text_length']].decode('utf-8')
+        ends_start = start + layout['text_length'] + len(_padding(layout['text_length']))
+        ends = memoryview(self._map)[ends_start:ends_start + layout['length']].cast('q')
+        values, value_start = [], 0
+        for value_end in ends:
+            values.append(text[value_start:value_end])
+            value_start = value_end
+        ends.release()
+        return values
+
+    def get_columns(self) -> dict:
+        return {layout['name']: self.get_column(layout['name']) for layout in self.header['columns']}
+
+    def to_orders(self, schema: list = None) -> list:
+        """ Returns the orders of the snapshot, as handled internally (see order_schema.py). """
+        columns = []
+        for column in schema or ORDER_SCHEMA:
+            values = self.get_column(column.name)
+            if isinstance(values, memoryview):
+                copied_values = values.tolist()
+                values.release()
+                values = copied_values
+            columns.append(values)
+        return [list(order) for order in zip(*columns)]
+
+    def close(self):
+        self._map.close()
+
+
+def load_snapshot(spreadsheet_id: str, max_age: float = None, content_hash: str = None,
+                  snapshot_dir: str = settings.ORDER_SNAPSHOT_DIR):
+    """ Returns the orders of the snapshot of spreadsheet_id if it exists (and is less than
+    max_age seconds old and has content_hash, if given), None otherwise. """
+    try:
+        with OrderSnapshot(get_snapshot_file_name(spreadsheet_id, snapshot_dir)) as snapshot:
+            if snapshot.header.get('spreadsheet_id') != spreadsheet_id:
+                return None
+            if content_hash is not None and snapshot.content_hash != content_hash:
+                return None
+            if max_age is not None and snapshot.age > max_age:
+                return None
+            return snapshot.to_orders()
+    except (OSError, ValueError, KeyError, StopIteration):
+        return None
+
+
+def save_snapshot(spreadsheet_id: str, orders: list, content_hash: str = None,
+                  snapshot_dir: str = settings.ORDER_SNAPSHOT_DIR) -> bool:
+    """ Saves orders as the snapshot of spreadsheet_id, unless the snapshot already has them.
+    content_hash is their hash (see get_orders_hash), if already computed.
+    Returns True if the snapshot was written. """
+    file_name = get_snapshot_file_name(spreadsheet_id, snapshot_dir)
+    content_hash = content_hash or get_orders_hash(orders)
+    try:
+        with OrderSnapshot(file_name) as snapshot:
+            up_to_date = snapshot.content_hash == content_hash
+    except (OSError, ValueError, KeyError):
+        up_to_date = False
+    if up_to_date:
+        # The orders haven't changed: only the time they were checked is updated
+        os.utime(file_name)
+        return False
+    write_snapshot(file_name, spreadsheet_id=spreadsheet_id, orders=orders, content_hash=content_hash)
+    return True
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+""" Output of a plan partitioned by shipping date (or channel).
+Each partition is written to a tab of its own of the order spreadsheet (see
+PedApi.write_partition). Logistics are planned in shipping date order, so a
+partition is published as soon as its last logistic has been planned, while the
+next ones are still being planned: the crew loading the first trucks gets its
+pallets before the whole plan is done. Partitions are written concurrently, on
+at most PARTITION_WRITE_WORKERS threads and PARTITION_WRITES_PER_MINUTE writes
+per minute (the Sheets API limits write requests per minute). """
+
+import collections
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Self defined modules
+import settings
+
+# Position, in the values of get_all_logistics, of what the output can be partitioned by
+PARTITION_FIELDS = {'shipping_date': 2, 'channel': 1}
+# Header row of the partition tabs (columns of final_data)
+PARTITION_HEADER = ['Prodotto', 'Cubotti', 'Pedana', 'Tipo', 'Lettera', 'PED']
+# Characters replaced in tab titles
+TITLE_SEPARATORS = re.compile(r'[/\\?*\[\]:]')
+
+
+def get_partition_title(partition_key: str, prefix: str = settings.PARTITION_SHEET_PREFIX) -> str:
+    """ Returns the title of the tab of partition_key (e.g. a shipping date like 20/10/2026). """
+    return f"{prefix}{TITLE_SEPARATORS.sub('-', partition_key.strip()) or '-'}"
+
+
+class PartitionPublisher:
+    """ Publishes the partitions of the plan of pallet_api (a PedApi) as their logistics are planned.
+    all_logs is what get_all_logistics returned; logistic_done must be called after each logistic.
+    If not publish_early, nothing is published before finish (e.g. when the plan is previewed). """
+
+    def __init__(self, pallet_api, all_logs: dict, partition_by: str = settings.OUTPUT_PARTITION_BY,
+                 publish_early: bool = True, max_workers: int = settings.PARTITION_WRITE_WORKERS,
+                 writes_per_minute: int = settings.PARTITION_WRITES_PER_MINUTE):
+        if partition_by not in PARTITION_FIELDS:
+            raise ValueError(f'Partizione non valida: {partition_by}')
+        self.pallet_api = pallet_api
+        self.publish_early = publish_early
+        self.writes_per_minute = writes_per_minute
+
+        # Partition of each logistic and the logistics of each partition not planned yet
+        self.logistic_partitions = {logistic: str(logistic_info[PARTITION_FIELDS[partition_by]])
+                                    for logistic, logistic_info in all_logs.items()}
+        self._pending = collections.defaultdict(set)
+        for logistic, partition_key in self.logistic_partitions.items():
+            self._pending[partition_key].add(logistic)
+
+        self._futures = {}
+        self._write_times = collections.deque()
+        self._quota_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ped_partition')
+
+    def logistic_done(self, logistic: str):
+        """ Publishes the partition of logistic if it was its last logistic to be planned. """
+        partition_key = self.logistic_partitions.get(logistic)
+        if partition_key is None:
+            return
+        self._pending[partition_key].discard(logistic)
+        if self.publish_early and not self._pending[partition_key]:
+            self._publish(partition_key)
+
+    def finish(self) -> bool:
+        """ Publishes the partitions not published yet and waits for all the writes.
+        When overwriting, the partition tabs of earlier runs not in this plan are then deleted.
+        Returns True if every partition was written. """
+        for partition_key in self._pending:
+            if partition_key not in self._futures:
+                self._publish(partition_key)
+        results = []
+        for future in self._futures.values():
+            try:
+                results.append(bool(future.result()))
+            except Exception:
+                results.append(False)
+        self.executor.shutdown(wait=True)
+        if self.pallet_api.overwrite_data and all(results):
+            try:
+                results.append(self.pallet_api.delete_partition_tabs(
+                    keep_titles={get_partition_title(partition_key) for partition_key in self._futures}))
+            except Exception:
+                results.append(False)
+        return all(results)
+
+    def _publish(self, partition_key: str):
+        # The rows are copied now: final_data keeps on growing while the partition is written
+        logistics = {logistic for logistic, key in self.logistic_partitions.items() if key == partition_key}
+        rows = [list(placement) for placement, details
+                in zip(self.pallet_api.final_data, self.pallet_api.placement_details) if details[0] in logistics]
+        self._futures[partition_key] = self.executor.submit(self._write, get_partition_title(partition_key), rows)
+
+    def _write(self, title: str, rows: list) -> bool:
+        self._wait_for_quota()
+        return self.pallet_api.write_partition(title=title, rows=rows)
+
+    def _wait_for_quota(self):
+        """ Waits until a write can be sent without exceeding writes_per_minute. """
+        while True:
+            with self._quota_lock:
+                now = time.monotonic()
+                while self._write_times and now - self._write_times[0] >= 60:
+                    self._write_times.popleft()
+                if len(self._write_times) < self.writes_per_minute:
+                    self._write_times.append(now)
+                    return
+                wait_time = 60 - (now - self._write_times[0])
+            time.sleep(wait_time)
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+""" Searches the Euro/Industrial pallet mix of a logistic instead of taking it from
+the pallet range tables.
+Every combination of Euro and Industrial pallets is sized like the table suggestions
+are (see db_communicator.size_pallets, which applies the capacity limits of settings),
+and the one with the fewest pallets, then the fewest empty slots, is kept.
+The search stops when its time budget runs out, and its result is always compared
+with the table's: in 'compare' mode the table's suggestion is still used, in 'use'
+mode the optimizer's is used when it's better. """
+
+import math
+import time
+
+# Self defined modules
+import settings
+from db_communicator import size_pallets
+
+PALLET_TYPES = ('euro', 'industrial')
+
+
+def score_pallets(final_pallets: dict, total_boxes: int):
+    """ Returns (number of pallets, empty slots) of the sized pallets final_pallets,
+    None if they can't hold total_boxes. """
+    if any(pallet_info[0] < 0 for pallet_info in final_pallets.values()):
+        return None
+    tot_pallets = sum(pallet_info[0] for pallet_info in final_pallets.values())
+    capacity = sum(pallet_info[0] * pallet_info[1] for pallet_info in final_pallets.values())
+    if capacity < total_boxes:
+        return None
+    return tot_pallets, capacity - total_boxes
+
+
+class PalletMixOptimizer:
+    """ Chooses the pallet mix of the logistics of a run and keeps the comparison
+    between its choices and the range tables' suggestions. """
+
+    def __init__(self, mode: str = settings.PALLET_OPTIMIZER_MODE,
+                 time_budget: float = settings.PALLET_OPTIMIZER_TIME_BUDGET):
+        if mode not in ('compare', 'use'):
+            raise ValueError(f"Modalità dell'ottimizzatore non valida: {mode}")
+        self.mode = mode
+        self.time_budget = time_budget
+        self.comparisons = []
+
+    def choose(self, table_pallets: dict, total_boxes: int, is_kievit: bool = False) -> dict:
+        """ Returns the pallets (a dict where keys are pallet types and values are their number)
+        to be sized for total_boxes: table_pallets or the mix found by the search. """
+        table_score = score_pallets(size_pallets(pallets=table_pallets, total_boxes=total_boxes,
+                                                 is_kievit=is_kievit), total_boxes)
+        best_pallets, best_score, timed_out = self.search(total_boxes=total_boxes, is_kievit=is_kievit)
+
+        use_optimizer = (self.mode == 'use' and best_score is not None
+                         and (table_score is None or best_score < table_score))
+        self.comparisons.append({'total_boxes': total_boxes, 'is_kievit': is_kievit,
+                                 'table': table_score, 'optimizer': best_score,
+                                 'optimizer_pallets': best_pallets, 'timed_out': timed_out,
+                                 'used': 'optimizer' if use_optimizer else 'table'})
+        return best_pallets if use_optimizer else table_pallets
+
+    def search(self, total_boxes: int, is_kievit: bool = False):
+        """ Returns the best pallet mix for total_boxes, its score and whether the time budget ran out. """
+        min_capacity = min(settings.KIEVIT_EURO_MIN, settings.KIEVIT_IND_MIN) if is_kievit \
+            else min(settings.EURO_PALLET_MIN, settings.INDUSTRIAL_PALLET_LIMIT_MIN)
+        max_pallets = math.ceil(total_boxes / min_capacity)
+        deadline = time.perf_counter() + self.time_budget
+
+        best_pallets, best_score = None, None
+        for euro_pallets in range(max_pallets + 1):
+            if time.perf_counter() > deadline:
+                return best_pallets, best_score, True
+            for industrial_pallets in range(max_pallets + 1 - euro_pallets):
+                pallets = dict(zip(PALLET_TYPES, (euro_pallets, industrial_pallets)))
+                score = score_pallets(size_pallets(pallets=pallets, total_boxes=total_boxes,
+                                                   is_kievit=is_kievit), total_boxes)
+                if score is not None and (best_score is None or score < best_score):
+                    best_pallets, best_score = pallets, score
+        return best_pallets, best_score, False
+
+    def summary(self) -> dict:
+        """ Returns how many logistics were sized and how the optimizer compared with the tables. """
+        compared = [comparison for comparison in self.comparisons
+                    if comparison['table'] is not None and comparison['optimizer'] is not None]
+        return {
+            'mode': self.mode,
+            'logistics': len(self.comparisons),
+            'better_than_table': sum(comparison['optimizer'] < comparison['table'] for comparison in compared),
+            'pallets_saved': sum(comparison['table'][0] - comparison['optimizer'][0] for comparison in compared
+                                 if comparison['optimizer'] < comparison['table']),
+            'used_optimizer': sum(comparison['used'] == 'optimizer' for comparison in self.comparisons),
+            'timed_out': sum(comparison['timed_out'] for comparison in self.comparisons),
+        }
+
+
+if __name__ == '__main__':
+    pass
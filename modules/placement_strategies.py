@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+""" Registry of the strategies used by PedApi to construct the pallets of a logistic.
+A strategy is made of a sizing rule (which pallets a logistic needs) and a
+placement rule (how boxes are put on those pallets). Rules are tried in order,
+the first one that matches a logistic is used.
+Strategies are resolved once per run so that the construction loop doesn't have
+to go through the special clients' lists for every logistic and pallet. """
+
+# Self defined modules
+import settings
+
+POLAND_LOGISTICS_OVERWRITE = frozenset(settings.POLAND_LOGISTICS_OVERWRITE)
+POLAND_LOGISTICS = frozenset(settings.POLAND_LOGISTICS)
+KIEVIT_LOGISTICS = frozenset(settings.KIEVIT_LOGISTICS)
+CORBARI_LOGISTICS = frozenset(settings.CORBARI_LOGISTICS)
+
+
+class LogisticInfo:
+    """ What the rules need to know about a logistic. """
+
+    def __init__(self, logistic: str, channel: str, user_max_boxes: int = 0):
+        self.logistic = logistic
+        # e.g. 'UPS Polska' for 'UPS Polska -- 12/10/2022 -- ...'
+        self.destination = logistic.split('--')[0].strip()
+        self.channel = channel
+        self.user_max_boxes = user_max_boxes
+
+
+class SizingRule:
+    """ get_pallets(db_reader, total_boxes, logistic_info) returns the suggested pallets
+    of a logistic. Logistics whose get_pallets is None construct their own pallets (ADP). """
+
+    def __init__(self, name: str, matches, get_pallets=None):
+        self.name = name
+        self.matches = matches
+        self.get_pallets = get_pallets
+
+
+class PlacementRule:
+    """ placer is the name of the PedApi method that places the boxes of a logistic
+    on its pallets. It's called with (logistic, boxes_per_pallets_info, pallet_type). """
+
+    def __init__(self, name: str, matches, placer: str):
+        self.name = name
+        self.matches = matches
+        self.placer = placer
+
+
+SIZING_RULES = [
+    SizingRule(name='adp', matches=lambda info: info.channel == settings.ADP_CHANNEL_CODE),
+    # If user has entered a value for max_boxes in the GUI and the logistic is one to which such rule is applied
+    SizingRule(name='poland_user_max',
+               matches=lambda info: info.destination in POLAND_LOGISTICS_OVERWRITE and info.user_max_boxes > 0,
+               get_pallets=lambda db_reader, boxes, info: db_reader.get_pallet_info_pl(
+                   total_boxes=boxes, user_max=info.user_max_boxes)),
+    SizingRule(name='poland', matches=lambda info: info.destination in POLAND_LOGISTICS,
+               get_pallets=lambda db_reader, boxes, info: db_reader.get_pallet_info_pl(total_boxes=boxes)),
+    SizingRule(name='kievit', matches=lambda info: info.destination in KIEVIT_LOGISTICS,
+               get_pallets=lambda db_reader, boxes, info: db_reader.get_kievit_pallet_info(total_boxes=boxes)),
+    SizingRule(name='default', matches=lambda info: True,
+               get_pallets=lambda db_reader, boxes, info: db_reader.get_pallet_info(total_boxes=boxes)),
+]
+
+PLACEMENT_RULES = [
+    PlacementRule(name='adp', matches=lambda info: info.channel == settings.ADP_CHANNEL_CODE,
+                  placer='place_boxes_on_pallets_adp'),
+    PlacementRule(name='alv', matches=lambda info: info.channel == settings.ALV_CHANNEL_CODE,
+                  placer='place_boxes_on_pallets_alv'),
+    PlacementRule(name='corbari', matches=lambda info: info.destination in CORBARI_LOGISTICS,
+                  placer='place_boxes_on_pallets_corb'),
+    PlacementRule(name='default', matches=lambda info: True, placer='place_boxes_on_pallets'),
+]
+
+
+def register_sizing_rule(rule: SizingRule, before: str = 'default'):
+    """ Adds rule to the sizing rules, before the one called before. """
+    _insert_rule(SIZING_RULES, rule, before)
+
+
+def register_placement_rule(rule: PlacementRule, before: str = 'default'):
+    """ Adds rule to the placement rules, before the one called before. """
+    _insert_rule(PLACEMENT_RULES, rule, before)
+
+
+def _insert_rule(rules: list, rule, before: str):
+    rule_names = [current_rule.name for current_rule in rules]
+    position = rule_names.index(before) if before in rule_names else len(rules)
+    rules.insert(position, rule)
+
+
+class Strategy:
+    """ The sizing and placement rules resolved for a logistic. """
+
+    def __init__(self, info: LogisticInfo, sizing: SizingRule, placement: PlacementRule):
+        self.info = info
+        self.sizing = sizing
+        self.placement = placement
+
+    @property
+    def name(self) -> str:
+        return f'{self.sizing.name}/{self.placement.name}'
+
+
+def resolve_strategies(all_logs: dict, user_max_boxes: int = 0) -> dict:
+    """ Returns a dict where keys are the logistics of all_logs (see PedApi.get_all_logistics)
+    and values are their Strategy. """
+    strategies = {}
+    for logistic, logistic_items in all_logs.items():
+        info = LogisticInfo(logistic=logistic, channel=logistic_items[1], user_max_boxes=user_max_boxes)
+        sizing = next(rule for rule in SIZING_RULES if rule.matches(info))
+        placement = next(rule for rule in PLACEMENT_RULES if rule.matches(info))
+        strategies[logistic] = Strategy(info=info, sizing=sizing, placement=placement)
+    return strategies
+
+
+class StrategyStats:
+    """ Counts logistics and pallets handled by each strategy and the time spent in them. """
+
+    def __init__(self):
+        self.stats = {}
+
+    def record(self, strategy_name: str, pallets: int, seconds: float):
+        strategy_stats = self.stats.setdefault(strategy_name, {'logistics': 0, 'pallets': 0, 'seconds': 0.0})
+        strategy_stats['logistics'] += 1
+        strategy_stats['pallets'] += pallets
+        strategy_stats['seconds'] += seconds
+
+    def as_dict(self) -> dict:
+        return {name: dict(values) for name, values in self.stats.items()}
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+""" Trace of the decisions taken while placing boxes on pallets.
+Each decision (which pallet, which order, the capacity left on the pallet, the branch
+taken and the boxes placed) is stored in a ring buffer allocated once, so only the
+last `size` decisions are kept and recording one costs a few assignments.
+When tracing is off PedApi has no trace and the placement code only checks for None.
+The trace of a run is dumped to a json file (see PlacementTrace.dump). """
+
+import json
+import os
+
+# Self defined modules
+import settings
+from order_schema import CLIENT_ORDER, LOGISTIC, PRODUCT_CODE
+
+TRACE_FIELDS = ('pallet', 'logistic', 'product_code', 'client_order', 'remaining_cap', 'branch', 'quantity')
+
+
+class PlacementTrace:
+    """ Ring buffer of the last size placement decisions. """
+
+    def __init__(self, size: int = settings.PLACEMENT_TRACE_SIZE):
+        self.size = size
+        # A list per field, so that recording a decision allocates nothing
+        self._columns = tuple([None] * size for _ in TRACE_FIELDS)
+        self.recorded = 0
+
+    def record(self, pallet: str, order: list, remaining_cap: int, branch: str, quantity: int = 0):
+        """ Records that, with remaining_cap (fixed point) left on pallet, branch was taken
+        for order and quantity of its boxes were placed. """
+        position = self.recorded % self.size
+        pallets, logistics, product_codes, client_orders, remaining_caps, branches, quantities = self._columns
+        pallets[position] = pallet
+        logistics[position] = order[LOGISTIC]
+        product_codes[position] = order[PRODUCT_CODE]
+        client_orders[position] = order[CLIENT_ORDER]
+        remaining_caps[position] = remaining_cap
+        branches[position] = branch
+        quantities[position] = quantity
+        self.recorded += 1
+
+    @property
+    def dropped(self) -> int:
+        """ Number of decisions overwritten by later ones. """
+        return max(0, self.recorded - self.size)
+
+    def get_decisions(self) -> list:
+        """ Returns the decisions kept (dicts), oldest first. """
+        first = self.recorded - min(self.recorded, self.size)
+        decisions = []
+        for sequence in range(first, self.recorded):
+            position = sequence % self.size
+            decision = {field: column[position] for field, column in zip(TRACE_FIELDS, self._columns)}
+            decision['remaining_cap'] = decision['remaining_cap'] / settings.RATIO_SCALE
+            decision['sequence'] = sequence
+            decisions.append(decision)
+        return decisions
+
+    def dump(self, run_id: str, trace_dir: str = settings.PLACEMENT_TRACE_DIR) -> str:
+        """ Writes the decisions kept to a json file named after run_id and returns its name. """
+        os.makedirs(trace_dir, exist_ok=True)
+        file_name = os.path.join(trace_dir, f'{run_id}.json')
+        with open(file_name, 'w', encoding='utf-8') as trace_file:
+            json.dump({'run_id': run_id, 'recorded': self.recorded, 'dropped': self.dropped,
+                       'decisions': self.get_decisions()}, trace_file, indent=1, default=str)
+        return file_name
+
+
+if __name__ == '__main__':
+    pass
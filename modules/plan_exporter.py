@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+""" Exports plans (the placements computed by PedApi) to local files so that
+they can be read without going through Google Sheet.
+Each plan is written in its own directory as a placements table, a pallets
+table and a json file with the run metadata.
+Parquet and Arrow IPC need pyarrow, csv needs nothing more. """
+
+import csv
+import json
+import os
+
+# Self defined modules
+import settings
+
+PLACEMENT_COLUMNS = ['product_code', 'quantity', 'pallet_name', 'pallet_type',
+                     'pallet_letter', 'pallet_number']
+PALLET_COLUMNS = ['pallet_number', 'pallet_name', 'pallet_type', 'pallet_letter',
+                  'lines', 'boxes']
+
+FILE_EXTENSIONS = {'parquet': 'parquet', 'arrow': 'arrow', 'csv': 'csv'}
+
+
+def get_pallet_rows(final_data: list) -> list:
+    """ Returns a row per pallet of final_data, in the order pallets appear in it. """
+    pallets = {}
+    for placement in final_data:
+        pallet_name = placement[2]
+        if pallet_name not in pallets:
+            pallets[pallet_name] = [int(placement[5]), pallet_name, placement[3], placement[4], 0, 0]
+        pallets[pallet_name][4] += 1
+        pallets[pallet_name][5] += int(placement[1])
+    return list(pallets.values())
+
+
+class PlanExporter:
+    """ Writes plans to export_dir in file_format ('parquet', 'arrow' or 'csv'). """
+
+    def __init__(self, export_dir: str = settings.PLAN_EXPORT_DIR,
+                 file_format: str = settings.PLAN_EXPORT_FORMAT):
+        if file_format not in FILE_EXTENSIONS:
+            raise ValueError(f'Formato di esportazione non valido: {file_format}')
+        self.export_dir = export_dir
+        self.file_format = file_format
+
+    def export(self, run_id: str, final_data: list, metadata: dict) -> str:
+        """ Writes the plan made of final_data and its metadata.
+        Returns the directory the plan was written in. """
+        plan_dir = os.path.join(self.export_dir, run_id)
+        os.makedirs(plan_dir, exist_ok=True)
+
+        pallet_rows = get_pallet_rows(final_data)
+        metadata = dict(metadata, run_id=run_id, rows=len(final_data), pallets=len(pallet_rows),
+                        file_format=self.file_format)
+
+        placement_rows = [[placement[0], int(placement[1]), placement[2], placement[3],
+                           placement[4], int(placement[5])] for placement in final_data]
+        tables = {'placements': (PLACEMENT_COLUMNS, placement_rows),
+                  'pallets': (PALLET_COLUMNS, pallet_rows)}
+        for table_name, (columns, rows) in tables.items():
+            file_name = os.path.join(plan_dir, f'{table_name}.{FILE_EXTENSIONS[self.file_format]}')
+            if self.file_format == 'csv':
+                self._write_csv(file_name, columns, rows)
+            else:
+                self._write_arrow(file_name, columns, rows, metadata)
+
+        with open(os.path.join(plan_dir, 'metadata.json'), 'w', encoding='utf-8') as metadata_file:
+            json.dump(metadata, metadata_file, indent=2, default=str)
+
+        return plan_dir
+
+    @staticmethod
+    def _write_csv(file_name: str, columns: list, rows: list):
+        with open(file_name, 'w', newline='', encoding='utf-8') as table_file:
+            writer = csv.writer(table_file)
+            writer.writerow(columns)
+            writer.writerows(rows)
+
+    def _write_arrow(self, file_name: str, columns: list, rows: list, metadata: dict):
+        try:
+            import pyarrow
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError(f"pyarrow è necessario per esportare in formato {self.file_format}, "
+                              f"altrimenti usare 'csv'")
+
+        table = pyarrow.table({column: [row[index] for row in rows]
+                               for index, column in enumerate(columns)})
+        table = table.replace_schema_metadata({'ped_ric': json.dumps(metadata, default=str)})
+
+        if self.file_format == 'parquet':
+            pyarrow.parquet.write_table(table, file_name, compression='zstd')
+        else:
+            with pyarrow.OSFile(file_name, 'wb') as sink:
+                with pyarrow.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+""" Local history of the plans constructed by PedApi.
+Every completed run is stored in a SQLite database next to the pallet database:
+the run's metadata, its pallets and its placements (which product, how many boxes,
+on which pallet, for which logistic and client order), indexed so that the pallet of
+an order or product can be found without going through Google Sheet. """
+
+import json
+import threading
+import time
+
+from PyQt5.QtSql import QSqlQuery, QSqlDatabase
+
+# Self defined modules
+import settings
+from plan_exporter import get_pallet_rows
+
+TABLE_QUERIES = [
+    'CREATE TABLE IF NOT EXISTS Runs (Run_Id TEXT PRIMARY KEY, Source TEXT, Started_At REAL, '
+    'Saved_At REAL, Overwrite_Data INTEGER, User_Max_Boxes INTEGER, Pallets INTEGER, '
+    'Placements INTEGER, Metadata TEXT)',
+    'CREATE TABLE IF NOT EXISTS Pallets (Run_Id TEXT, Pallet_Number INTEGER, Pallet_Name TEXT, '
+    'Pallet_Type TEXT, Pallet_Letter TEXT, Lines INTEGER, Boxes INTEGER)',
+    'CREATE TABLE IF NOT EXISTS Placements (Run_Id TEXT, Product_Code TEXT, Quantity INTEGER, '
+    'Pallet_Name TEXT, Pallet_Type TEXT, Pallet_Letter TEXT, Pallet_Number INTEGER, '
+    'Logistic TEXT, Client_Order TEXT)',
+    'CREATE INDEX IF NOT EXISTS Runs_Started_At ON Runs (Started_At)',
+    'CREATE INDEX IF NOT EXISTS Pallets_Run ON Pallets (Run_Id, Pallet_Number)',
+    'CREATE INDEX IF NOT EXISTS Placements_Run ON Placements (Run_Id)',
+    'CREATE INDEX IF NOT EXISTS Placements_Product ON Placements (Product_Code)',
+    'CREATE INDEX IF NOT EXISTS Placements_Client_Order ON Placements (Client_Order)',
+    'CREATE INDEX IF NOT EXISTS Placements_Logistic ON Placements (Logistic)',
+    'CREATE INDEX IF NOT EXISTS Placements_Pallet_Number ON Placements (Pallet_Number)',
+]
+
+PLACEMENT_COLUMNS = ['Run_Id', 'Product_Code', 'Quantity', 'Pallet_Name', 'Pallet_Type',
+                     'Pallet_Letter', 'Pallet_Number', 'Logistic', 'Client_Order']
+PALLET_COLUMNS = ['Run_Id', 'Pallet_Number', 'Pallet_Name', 'Pallet_Type', 'Pallet_Letter',
+                  'Lines', 'Boxes']
+# Filters of find_placements and the columns they apply to
+PLACEMENT_FILTERS = {'product_code': 'Product_Code', 'client_order': 'Client_Order',
+                     'logistic': 'Logistic', 'pallet_number': 'Pallet_Number'}
+
+# Serializes the writers of this process
+_HISTORY_LOCK = threading.Lock()
+
+
+class PlanHistory:
+    """ Stores plans in, and reads them from, the history database.
+    Each thread must use a class of its own (Qt connections can't be shared). """
+
+    def __init__(self, db_name: str = settings.HISTORY_DATABASE_NAME):
+        self.db_name = db_name
+        self.con_name = f'{settings.HISTORY_CONNECTION_NAME}_{threading.get_ident()}'
+        self.connection = None
+        self.con_error = False
+
+    def save_run(self, run_id: str, final_data: list, placement_details: list, metadata: dict) -> bool:
+        """ Stores the plan made of final_data (and the logistic and client order of each of its rows).
+        Returns True if it was stored, False otherwise. """
+        if not self.connection:
+            self.create_connection()
+        if self.con_error:
+            return False
+
+        pallet_rows = get_pallet_rows(final_data)
+        placement_rows = [[run_id, placement[0], int(placement[1]), placement[2], placement[3],
+                           placement[4], int(placement[5]), details[0], details[1]]
+                          for placement, details in zip(final_data, placement_details)]
+        run_row = [run_id, metadata.get('source'), metadata.get('started_at'), time.time(),
+                   int(bool(metadata.get('overwrite_data'))), metadata.get('user_max_boxes'),
+                   len(pallet_rows), len(placement_rows), json.dumps(metadata, default=str)]
+
+        with _HISTORY_LOCK:
+            begin_query = QSqlQuery(self.connection)
+            if not begin_query.exec_('BEGIN IMMEDIATE'):
+                return False
+            saved = all((self._insert_rows('Runs', None, [run_row]),
+                         self._insert_rows('Pallets', PALLET_COLUMNS,
+                                           [[run_id] + pallet_row for pallet_row in pallet_rows]),
+                         self._insert_rows('Placements', PLACEMENT_COLUMNS, placement_rows)))
+            end_query = QSqlQuery(self.connection)
+            if saved:
+                return end_query.exec_('COMMIT')
+            end_query.exec_('ROLLBACK')
+            return False
+
+    def _insert_rows(self, table_name: str, columns: list, rows: list) -> bool:
+        """ Inserts rows in table_name with a single batch query. """
+        if not rows:
+            return True
+        column_names = f' ({", ".join(columns)})' if columns else ''
+        insert_query = QSqlQuery(self.connection)
+        if not insert_query.prepare(f'INSERT INTO {table_name}{column_names} '
+                                    f'VALUES ({", ".join("?" * len(rows[0]))})'):
+            return False
+        for values in zip(*rows):
+            insert_query.addBindValue(list(values))
+        return insert_query.execBatch()
+
+    def find_placements(self, product_code: str = None, client_order: str = None, logistic: str = None,
+                        pallet_number: int = None, since: float = None, limit: int = 100) -> list:
+        """ Returns the placements (dicts) matching all the filters given, most recent runs first. """
+        filters = {'product_code': product_code, 'client_order': client_order,
+                   'logistic': logistic, 'pallet_number': pallet_number}
+        conditions, values = [], []
+        for filter_name, value in filters.items():
+            if value is not None:
+                conditions.append(f'Placements.{PLACEMENT_FILTERS[filter_name]} = ?')
+                values.append(value)
+        if since is not None:
+            conditions.append('Runs.Started_At >= ?')
+            values.append(since)
+
+        where_clause = f'WHERE {" AND ".join(conditions)} ' if conditions else ''
+        columns = [f'Placements.{column}' for column in PLACEMENT_COLUMNS] + ['Runs.Source', 'Runs.Started_At']
+        return self._select(f'SELECT {", ".join(columns)} FROM Placements '
+                            f'JOIN Runs ON Runs.Run_Id = Placements.Run_Id {where_clause}'
+                            f'ORDER BY Runs.Started_At DESC, Placements.Pallet_Number LIMIT ?',
+                            values + [limit])
+
+    def get_runs(self, limit: int = 20) -> list:
+        """ Returns the last runs stored (dicts), most recent first. """
+        return self._select('SELECT Run_Id, Source, Started_At, Saved_At, Overwrite_Data, User_Max_Boxes, '
+                            'Pallets, Placements FROM Runs ORDER BY Started_At DESC LIMIT ?', [limit])
+
+    def get_run_pallets(self, run_id: str) -> list:
+        """ Returns the pallets (dicts) of run_id. """
+        return self._select(f'SELECT {", ".join(PALLET_COLUMNS)} FROM Pallets WHERE Run_Id = ? '
+                            f'ORDER BY Pallet_Number', [run_id])
+
+    def _select(self, query: str, values: list) -> list:
+        if not self.connection:
+            self.create_connection()
+        if self.con_error:
+            return []
+        select_query = QSqlQuery(self.connection)
+        if not select_query.prepare(query):
+            return []
+        for value in values:
+            select_query.addBindValue(value)
+        select_query.exec_()
+
+        rows = []
+        record = select_query.record()
+        column_names = [record.fieldName(index) for index in range(record.count())]
+        while select_query.next():
+            rows.append({column_name: select_query.value(index) for index, column_name in enumerate(column_names)})
+        select_query.finish()
+        return rows
+
+    def create_connection(self):
+        """ Creates the database connection and the history tables (if they don't exist). """
+        self.connection = QSqlDatabase.addDatabase(settings.DATABASE_DRIVER, self.con_name)
+        self.connection.setDatabaseName(self.db_name)
+        self.connection.setConnectOptions(f'QSQLITE_BUSY_TIMEOUT={settings.DATABASE_BUSY_TIMEOUT_MS}')
+        if not self.connection.open():
+            self.con_error = True
+            return
+
+        setup_query = QSqlQuery(self.connection)
+        setup_query.exec_('PRAGMA journal_mode=WAL')
+        for table_query in TABLE_QUERIES:
+            setup_query.exec_(table_query)
+        setup_query.finish()
+
+    def close_connection(self):
+        """ Closes and removes the connection of this class. """
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+            QSqlDatabase.removeDatabase(self.con_name)
+
+
+if __name__ == '__main__':
+    pass
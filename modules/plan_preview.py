@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+""" Preview of a plan before it is written.
+PlanTableModel shows the rows of final_data (with the logistic and client order
+each of them comes from) grouped by pallet. Rows are handed to the view in batches
+as it scrolls (canFetchMore/fetchMore), and sorting and filtering only reorder the
+positions of the rows in the plan, which is never copied. """
+
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt, QTimer
+from PyQt5.QtWidgets import (QDialog, QDialogButtonBox, QHeaderView, QLabel,
+                             QLineEdit, QTableView, QVBoxLayout)
+
+# Self defined modules
+import settings
+
+# Header, where the value comes from ('plan' for final_data, 'details' for
+# placement_details) and its position there
+PREVIEW_COLUMNS = [
+    ('PED', 'plan', 5),
+    ('Lettera', 'plan', 4),
+    ('Pedana', 'plan', 2),
+    ('Tipo', 'plan', 3),
+    ('Prodotto', 'plan', 0),
+    ('Cubotti', 'plan', 1),
+    ('Logistica', 'details', 0),
+    ('Ordine cliente', 'details', 1),
+]
+# Columns sorted (and aligned) as numbers
+NUMERIC_COLUMNS = frozenset({0, 5})
+
+
+def _to_number(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+class PlanTableModel(QAbstractTableModel):
+    """ Table model over a plan: final_data and its placement_details (see PedApi). """
+
+    def __init__(self, final_data: list, placement_details: list,
+                 fetch_rows: int = settings.PREVIEW_FETCH_ROWS, parent=None):
+        super(PlanTableModel, self).__init__(parent)
+        self.final_data = final_data
+        self.placement_details = placement_details
+        self.fetch_rows = fetch_rows
+
+        self.filter_text = ''
+        # None keeps the rows grouped by pallet
+        self.sort_column = None
+        self.sort_order = Qt.AscendingOrder
+
+        # Lower case text searched by the filter, built the first time it's needed
+        self._search_text = None
+        # Positions in final_data of the rows shown, in the order they are shown,
+        # and how many of them the view has been given so far
+        self._rows = []
+        self._loaded = 0
+        self._arrange_rows()
+
+    def value(self, plan_row: int, column: int):
+        _, source, position = PREVIEW_COLUMNS[column]
+        row = self.final_data[plan_row] if source == 'plan' else self.placement_details[plan_row]
+        return row[position] if position < len(row) else ''
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else self._loaded
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(PREVIEW_COLUMNS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            return str(self.value(self._rows[index.row()], index.column()))
+        if role == Qt.TextAlignmentRole and index.column() in NUMERIC_COLUMNS:
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return PREVIEW_COLUMNS[section][0]
+        return str(section + 1)
+
+    def canFetchMore(self, parent=QModelIndex()) -> bool:
+        return not parent.isValid() and self._loaded < len(self._rows)
+
+    def fetchMore(self, parent=QModelIndex()):
+        rows_to_fetch = min(self.fetch_rows, len(self._rows) - self._loaded)
+        if parent.isValid() or rows_to_fetch <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self._loaded, self._loaded + rows_to_fetch - 1)
+        self._loaded += rows_to_fetch
+        self.endInsertRows()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        """ Sorts the rows by column (a negative column groups them by pallet again). """
+        self.sort_column = column if column >= 0 else None
+        self.sort_order = order
+        self.beginResetModel()
+        self._arrange_rows()
+        self.endResetModel()
+
+    def set_filter(self, text: str):
+        """ Shows only the rows whose product, pallet, logistic or client order contains text. """
+        self.filter_text = text.strip().lower()
+        self.beginResetModel()
+        self._arrange_rows()
+        self.endResetModel()
+
+    def get_summary(self) -> dict:
+        """ Returns the number of pallets, rows and boxes shown. """
+        return {'pallets': len({self.final_data[plan_row][2] for plan_row in self._rows}),
+                'rows': len(self._rows),
+                'boxes': sum(_to_number(self.final_data[plan_row][1]) for plan_row in self._rows)}
+
+    def _arrange_rows(self):
+        plan_rows = range(len(self.final_data))
+        if self.filter_text:
+            if self._search_text is None:
+                text_columns = [column for column in range(len(PREVIEW_COLUMNS)) if column not in NUMERIC_COLUMNS]
+                self._search_text = ['\t'.join(str(self.value(plan_row, column)) for column in text_columns).lower()
+                                     for plan_row in plan_rows]
+            plan_rows = [plan_row for plan_row in plan_rows if self.filter_text in self._search_text[plan_row]]
+
+        if self.sort_column is None:
+            # Rows of the same pallet are next to each other, in the order they were placed
+            self._rows = sorted(plan_rows, key=lambda plan_row: _to_number(self.value(plan_row, 0)))
+        else:
+            column = self.sort_column
+            if column in NUMERIC_COLUMNS:
+                sort_key = lambda plan_row: _to_number(self.value(plan_row, column))
+            else:
+                sort_key = lambda plan_row: str(self.value(plan_row, column))
+            self._rows = sorted(plan_rows, key=sort_key, reverse=self.sort_order == Qt.DescendingOrder)
+        self._loaded = min(self.fetch_rows, len(self._rows))
+
+
+class PlanPreviewDialog(QDialog):
+    """ Shows a plan and asks whether it should be written (accepted) or not (rejected). """
+
+    def __init__(self, final_data: list, placement_details: list, parent=None):
+        super(PlanPreviewDialog, self).__init__(parent)
+        self.setWindowTitle(f'{settings.WINDOW_TITLE} - Anteprima piano')
+        self.resize(900, 600)
+
+        self.plan_model = PlanTableModel(final_data=final_data, placement_details=placement_details, parent=self)
+
+        self.summary_lbl = QLabel()
+
+        self.filter_line_edit = QLineEdit()
+        self.filter_line_edit.setPlaceholderText('Filtra per prodotto, pedana, logistica o ordine cliente')
+        # The filter is applied once the user stops typing
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(settings.PREVIEW_FILTER_DELAY_MS)
+        self.filter_timer.timeout.connect(self._apply_filter)
+        self.filter_line_edit.textChanged.connect(self.filter_timer.start)
+
+        self.table_view = QTableView()
+        self.table_view.setModel(self.plan_model)
+        # Rows of the same height let the view skip measuring them
+        self.table_view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.table_view.verticalHeader().setDefaultSectionSize(22)
+        self.table_view.horizontalHeader().setStretchLastSection(True)
+        self.table_view.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.table_view.setSortingEnabled(True)
+
+        self.buttons = QDialogButtonBox()
+        self.buttons.addButton('Scrivere piano', QDialogButtonBox.AcceptRole)
+        self.buttons.addButton('Annulla', QDialogButtonBox.RejectRole)
+        self.buttons.accepted.connect(self.accept)
+        self.buttons.rejected.connect(self.reject)
+
+        layout = QVBoxLayout()
+        for wid in (self.summary_lbl, self.filter_line_edit, self.table_view, self.buttons):
+            layout.addWidget(wid)
+        self.setLayout(layout)
+        self._update_summary()
+
+    def _apply_filter(self):
+        self.plan_model.set_filter(self.filter_line_edit.text())
+        self._update_summary()
+
+    def _update_summary(self):
+        summary = self.plan_model.get_summary()
+        self.summary_lbl.setText(f"<b>{summary['pallets']}</b> PED, <b>{summary['rows']}</b> righe, "
+                                 f"<b>{summary['boxes']}</b> cubotti")
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+""" Resources shared by planning runs: Google credentials, the Sheets service
+and the pallet range tables read from database.
+Several PedApi classes (e.g. the jobs of a JobQueue) can share the same context
+so that these are loaded only once.
+The Google client libraries are only imported when they are first needed, so that
+importing this module (and the GUI) stays fast. """
+
+import os
+import threading
+import time
+
+from helper_modules import helper_functions
+
+# Self defined modules
+import settings
+from db_communicator import DatabaseCommunicator
+from sheets_cassette import Cassette, RecordingHttp, ReplayHttp
+
+_DEFAULT_CONTEXT = None
+
+
+def get_default_context():
+    """ Returns the context shared by all the PedApi classes created without one. """
+    global _DEFAULT_CONTEXT
+    if _DEFAULT_CONTEXT is None:
+        _DEFAULT_CONTEXT = PlanningContext()
+    return _DEFAULT_CONTEXT
+
+
+class PlanningContext:
+    """ Holds the resources shared by planning runs. Safe to use from several threads. """
+
+    def __init__(self, traffic_mode: str = settings.SHEETS_TRAFFIC_MODE,
+                 cassette_file: str = settings.SHEETS_CASSETTE):
+        self.scopes = ['https://www.googleapis.com/auth/spreadsheets']
+        self._app_info = None
+
+        # 'live', 'record' or 'replay' (see sheets_cassette.py)
+        if traffic_mode not in ('live', 'record', 'replay'):
+            raise ValueError(f'Modalità del traffico Sheets non valida: {traffic_mode}')
+        self.traffic_mode = traffic_mode
+        self.cassette = Cassette(cassette_file) if traffic_mode != 'live' else None
+
+        self._lock = threading.RLock()
+        self._thread_data = threading.local()
+
+        self._credentials = None
+        self._api_service = None
+
+        self._range_tables = None
+        # Modification times of the database files when the range tables were loaded
+        self._range_tables_stamp = None
+
+        # Orders read before a run asked for them (see put_orders): spreadsheet id -> (time read, orders)
+        self._prefetched_orders = {}
+
+    @property
+    def app_info(self) -> dict:
+        """ The contents of the app's information json file. """
+        with self._lock:
+            if self._app_info is None:
+                self._app_info = helper_functions.json_file_loader(
+                    file_name=settings.INFORMATION_JSON
+                )
+            return self._app_info
+
+    def get_credentials(self):
+        with self._lock:
+            if self._credentials is None:
+                from google.oauth2 import service_account
+
+                self._credentials = service_account.Credentials.from_service_account_file(
+                    self.app_info.get('api_key_file_name'), scopes=self.scopes
+                )
+            return self._credentials
+
+    def refresh_credentials(self):
+        """ Refreshes the access token so that the requests that follow don't have to. """
+        if self.traffic_mode == 'replay':
+            return None
+        with self._lock:
+            credentials = self.get_credentials()
+            if not credentials.valid:
+                from google.auth.transport.requests import Request
+
+                credentials.refresh(Request())
+            return credentials
+
+    def get_api_service(self):
+        """ Returns the Google Sheets service, building it the first time. """
+        with self._lock:
+            if self._api_service is None:
+                from googleapiclient.discovery import build
+
+                if self.traffic_mode == 'replay':
+                    # No credentials are needed to replay a run
+                    self._api_service = build('sheets', 'v4', http=self.get_http())
+                else:
+                    self._api_service = build('sheets', 'v4', credentials=self.get_credentials())
+            return self._api_service
+
+    def get_http(self):
+        """ Returns the authorized http object of the calling thread.
+        Requests must be executed with it since the http object of the
+        service can't be shared between threads.
+        When recording or replaying, it's wrapped or replaced by the cassette's. """
+        http = getattr(self._thread_data, 'http', None)
+        if http is None:
+            if self.traffic_mode == 'replay':
+                http = ReplayHttp(self.cassette)
+            else:
+                import google_auth_httplib2
+                import httplib2
+
+                http = google_auth_httplib2.AuthorizedHttp(self.get_credentials(), http=httplib2.Http())
+                if self.traffic_mode == 'record':
+                    http = RecordingHttp(http, self.cassette)
+            self._thread_data.http = http
+        return http
+
+    def get_range_tables(self) -> dict:
+        """ Returns the pallet range tables, loading them from database the first time
+        and whenever the database file has changed since they were loaded. """
+        with self._lock:
+            current_stamp = self._database_stamp()
+            if self._range_tables is None or current_stamp != self._range_tables_stamp:
+                db_reader = DatabaseCommunicator(read_from_db=True,
+                                                 connection_tag=f'context_{threading.get_ident()}')
+                self._range_tables = db_reader.load_range_tables()
+                db_reader.close_connection()
+                self._range_tables_stamp = current_stamp
+            return self._range_tables
+
+    def put_orders(self, spreadsheet_id: str, orders: list):
+        """ Keeps the orders of spreadsheet_id, read before a run was started, for that run. """
+        with self._lock:
+            self._prefetched_orders[spreadsheet_id] = (time.time(), orders)
+
+    def take_orders(self, spreadsheet_id: str, max_age: float = settings.ORDERS_PREFETCH_MAX_AGE) -> list:
+        """ Returns the orders kept for spreadsheet_id if they finished being read less than
+        max_age seconds ago, None otherwise. They are given to one run only. """
+        with self._lock:
+            read_at, orders = self._prefetched_orders.pop(spreadsheet_id, (None, None))
+        if orders is None or time.time() - read_at > max_age:
+            return None
+        return orders
+
+    def warm_up(self):
+        """ Loads everything a planning run needs before the first run asks for it. """
+        self.refresh_credentials()
+        self.get_api_service()
+        self.get_range_tables()
+
+    def invalidate_range_tables(self):
+        """ Forces the range tables to be read again on next use. """
+        with self._lock:
+            self._range_tables = None
+
+    @staticmethod
+    def _database_stamp() -> tuple:
+        stamp = []
+        for file_name in (settings.DATABASE_NAME, f'{settings.DATABASE_NAME}-wal'):
+            try:
+                stamp.append(os.path.getmtime(file_name))
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+
+
+if __name__ == '__main__':
+    pass
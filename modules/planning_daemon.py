@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+
+""" Long running planning service.
+It keeps credentials, Sheets service and pallet range tables warm and runs the
+plan jobs it receives on a local HTTP endpoint, so that the GUI, the CLI and
+cron jobs of the user running it share the same warm cache.
+Requests to /jobs must carry the token of DAEMON_TOKEN_FILE (see get_daemon_token)
+in the TOKEN_HEADER header, and posted jobs must be sent as application/json:
+a web page can't read the token, nor send such a request to another origin
+without the daemon agreeing to it.
+
+Endpoints (JSON):
+    GET  /health          -> daemon status
+    GET  /jobs            -> all jobs
+    GET  /jobs/<job_id>   -> one job
+    POST /jobs            -> {'sources': [...], 'overwrite_data': bool, 'user_max_boxes': int}
+"""
+
+import hmac
+import json
+import os
+import secrets
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Self defined modules
+import settings
+from job_queue import JobQueue, PlanJob
+from planning_context import PlanningContext
+
+TOKEN_HEADER = 'X-Ped-Token'
+
+
+def get_daemon_token(create: bool = False) -> str:
+    """ Returns the token of DAEMON_TOKEN_FILE, creating the file (readable by its user only)
+    first if create and it doesn't exist. """
+    token_file_name = os.path.expanduser(settings.DAEMON_TOKEN_FILE)
+    if create:
+        try:
+            token_file = os.open(token_file_name, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(token_file, 'w') as token_file:
+                token_file.write(secrets.token_hex(32))
+    with open(token_file_name, encoding='utf-8') as token_file:
+        return token_file.read().strip()
+
+
+class PlanningDaemon:
+    """ Owns the warm context and the job queue of the service. """
+
+    def __init__(self, host: str = settings.DAEMON_HOST, port: int = settings.DAEMON_PORT,
+                 max_workers: int = settings.JOB_QUEUE_WORKERS):
+        self.context = PlanningContext()
+        self.job_queue = JobQueue(max_workers=max_workers, context=self.context)
+        self.started_at = time.time()
+        self.token = get_daemon_token(create=True)
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+
+    def serve_forever(self):
+        self.context.warm_up()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.job_queue.shutdown()
+
+    def shutdown(self):
+        self.server.shutdown()
+
+    def _make_handler(self):
+        daemon = self
+
+        class Handler(DaemonRequestHandler):
+            planning_daemon = daemon
+
+        return Handler
+
+
+def get_job_request_error(request_body) -> str:
+    """ Returns what's wrong with the body of a POST /jobs request, an empty string if nothing is. """
+    if not isinstance(request_body, dict):
+        return 'Il corpo della richiesta deve essere un oggetto JSON'
+    sources = request_body.get('sources')
+    if not isinstance(sources, list) or not sources or not all(isinstance(source, str) and source.strip()
+                                                                  for source in sources):
+        return "'sources' deve essere una lista non vuota di link o file"
+    order_file_dir = os.path.realpath(os.path.expanduser(settings.DAEMON_ORDER_FILE_DIR))
+    for source in sources:
+        # Local order files (see PlanJob.is_local) are only accepted from DAEMON_ORDER_FILE_DIR:
+        # the plan is written next to them
+        if os.path.isfile(source) and \
+                os.path.commonpath([os.path.realpath(source), order_file_dir]) != order_file_dir:
+            return f'I file degli ordini devono essere in {order_file_dir}'
+    if not isinstance(request_body.get('overwrite_data', True), bool):
+        return "'overwrite_data' deve essere true o false"
+    user_max_boxes = request_body.get('user_max_boxes', 0)
+    # bool is a subclass of int
+    if not isinstance(user_max_boxes, int) or isinstance(user_max_boxes, bool) or user_max_boxes < 0:
+        return "'user_max_boxes' deve essere un intero non negativo"
+    return ''
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    """ Handles the requests of the daemon's endpoints. """
+
+    planning_daemon = None
+
+    def do_GET(self):
+        job_queue = self.planning_daemon.job_queue
+        if self.path != '/health' and not self._is_authorized():
+            self._send_json(401, {'error': 'Token mancante o non valido'})
+        elif self.path == '/health':
+            self._send_json(200, {'status': 'ok', 'started_at': self.planning_daemon.started_at,
+                                  'jobs': len(job_queue.get_jobs())})
+        elif self.path == '/jobs':
+            self._send_json(200, {'jobs': [job.to_dict() for job in job_queue.get_jobs()]})
+        elif self.path.startswith('/jobs/'):
+            job_id = self.path[len('/jobs/'):]
+            job = job_queue.get_job(int(job_id)) if job_id.isdigit() else None
+            if job is None:
+                self._send_json(404, {'error': f'Job {job_id} non trovato'})
+            else:
+                self._send_json(200, job.to_dict())
+        else:
+            self._send_json(404, {'error': f'{self.path} non trovato'})
+
+    def do_POST(self):
+        if self.path != '/jobs':
+            self._send_json(404, {'error': f'{self.path} non trovato'})
+            return
+        if self.headers.get_content_type() != 'application/json':
+            self._send_json(415, {'error': 'Il corpo della richiesta deve essere application/json'})
+            return
+        if not self._is_authorized():
+            self._send_json(401, {'error': 'Token mancante o non valido'})
+            return
+        try:
+            body_length = int(self.headers.get('Content-Length', 0))
+            request_body = json.loads(self.rfile.read(body_length) or b'{}')
+        except ValueError:
+            self._send_json(400, {'error': 'Il corpo della richiesta non è un JSON valido'})
+            return
+        request_error = get_job_request_error(request_body)
+        if request_error:
+            self._send_json(400, {'error': request_error})
+            return
+
+        jobs = self.planning_daemon.job_queue.submit_many(
+            sources=request_body['sources'], overwrite_data=request_body.get('overwrite_data', True),
+            user_max_boxes=request_body.get('user_max_boxes', 0)
+        )
+        self._send_json(202, {'jobs': [job.to_dict() for job in jobs]})
+
+    def _is_authorized(self) -> bool:
+        return hmac.compare_digest(self.headers.get(TOKEN_HEADER, '').encode('utf-8'),
+                                   self.planning_daemon.token.encode('utf-8'))
+
+    def log_message(self, format, *args):
+        # Requests aren't logged to stderr
+        pass
+
+    def _send_json(self, status: int, content: dict):
+        response_body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response_body)))
+        self.end_headers()
+        self.wfile.write(response_body)
+
+
+def _daemon_request(path: str, payload: dict = None, timeout: float = 5) -> dict:
+    url = f'http://{settings.DAEMON_HOST}:{settings.DAEMON_PORT}{path}'
+    data = json.dumps(payload).encode('utf-8') if payload is not None else None
+    headers = {'Content-Type': 'application/json'}
+    if path != '/health':
+        headers[TOKEN_HEADER] = get_daemon_token()
+    request = urllib.request.Request(url, data=data, headers=headers)
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def daemon_is_running() -> bool:
+    """ Returns True if the planning daemon answers on this machine. """
+    try:
+        return _daemon_request('/health', timeout=0.5).get('status') == 'ok'
+    except (OSError, ValueError, urllib.error.URLError):
+        return False
+
+
+def submit_jobs(sources: list, overwrite_data: bool = True, user_max_boxes: int = 0) -> list:
+    """ Submits a job per source to the daemon and returns the jobs (dicts). """
+    return _daemon_request('/jobs', payload={'sources': sources, 'overwrite_data': overwrite_data,
+                                             'user_max_boxes': user_max_boxes})['jobs']
+
+
+def get_job(job_id: int) -> dict:
+    return _daemon_request(f'/jobs/{job_id}')
+
+
+def _failed_job(job: dict, message: str) -> dict:
+    return dict(job, status=PlanJob.FAILED, message=message)
+
+
+def wait_for_jobs(jobs: list, poll_seconds: float = settings.DAEMON_POLL_SECONDS,
+                  timeout: float = settings.DAEMON_JOB_TIMEOUT) -> list:
+    """ Polls the daemon until all jobs have finished, or timeout seconds have passed, and returns
+    their final state. Jobs the daemon doesn't know anymore (pruned, or the daemon was restarted)
+    or not finished in time are returned as failed, with a message saying why. """
+    deadline = time.monotonic() + timeout
+    finished_jobs = {}
+    while len(finished_jobs) < len(jobs):
+        for job in jobs:
+            if job['job_id'] in finished_jobs:
+                continue
+            try:
+                current_job = get_job(job['job_id'])
+            except urllib.error.HTTPError as error:
+                if error.code != 404:
+                    raise
+                finished_jobs[job['job_id']] = _failed_job(
+                    job, 'Il servizio di pianificazione non conosce più questo lavoro (forse è stato riavviato): '
+                         'controlla il foglio prima di ripeterlo')
+                continue
+            if current_job['status'] in (PlanJob.DONE, PlanJob.FAILED):
+                finished_jobs[job['job_id']] = current_job
+        if len(finished_jobs) < len(jobs):
+            if time.monotonic() >= deadline:
+                for job in jobs:
+                    finished_jobs.setdefault(job['job_id'], _failed_job(
+                        job, 'Il servizio di pianificazione non ha finito in tempo: il lavoro potrebbe essere '
+                             'ancora in corso, controlla il foglio prima di ripeterlo'))
+                break
+            time.sleep(poll_seconds)
+    return [finished_jobs[job['job_id']] for job in jobs]
+
+
+def submit_and_wait(sources: list, overwrite_data: bool = True, user_max_boxes: int = 0) -> list:
+    return wait_for_jobs(submit_jobs(sources=sources, overwrite_data=overwrite_data,
+                                     user_max_boxes=user_max_boxes))
+
+
+def submit_and_wait_if_running(sources: list, overwrite_data: bool = True, user_max_boxes: int = 0) -> list:
+    """ Same as submit_and_wait, but returns None at once if the daemon isn't running. """
+    if not daemon_is_running():
+        return None
+    return submit_and_wait(sources=sources, overwrite_data=overwrite_data, user_max_boxes=user_max_boxes)
+
+
+if __name__ == '__main__':
+    pass
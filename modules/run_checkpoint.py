@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+""" Checkpoints of planning runs.
+A run interrupted by a crash or a network error can be resumed from its last
+completed logistic. The checkpoint is a journal (one json object per line): a
+header with the hash of the run's input (see get_input_hash), then, after each
+logistic, only what that logistic changed: its placements, the orders it
+consumed and the pallet numbering. A run on the same input starts from the same
+orders, so replaying the journal on them rebuilds the state of the interrupted
+run (see PedApi._resume_from_checkpoint). Saving a logistic costs what the
+logistic changed, not the whole state of the run.
+The journal is rewritten (without a line left half written) only when a run
+resumes it, and deleted once the plan has been written. """
+
+import hashlib
+import json
+import os
+
+# Self defined modules
+import settings
+
+CHECKPOINT_VERSION = 3
+
+
+def get_input_hash(all_orders: list, pallet_dict: dict, overwrite_data: bool, user_max_boxes: int) -> str:
+    """ Returns a hash of everything the placements of a run depend on. """
+    run_input = json.dumps([all_orders, pallet_dict, overwrite_data, user_max_boxes], sort_keys=True)
+    return hashlib.sha256(run_input.encode('utf-8')).hexdigest()
+
+
+def get_checkpoint_file_name(source: str, checkpoint_dir: str = settings.CHECKPOINT_DIR) -> str:
+    source_key = hashlib.sha1(source.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(checkpoint_dir, f'{source_key}.jsonl')
+
+
+def has_checkpoint(source: str, checkpoint_dir: str = settings.CHECKPOINT_DIR) -> bool:
+    """ Returns True if an interrupted run of source left a checkpoint (of any input). """
+    return os.path.exists(get_checkpoint_file_name(source, checkpoint_dir))
+
+
+def get_checkpoint_orders_hash(source: str, checkpoint_dir: str = settings.CHECKPOINT_DIR) -> str:
+    """ Returns the hash of the orders (see order_snapshot.get_orders_hash) the checkpoint
+    of source was computed on, None if there's no checkpoint or it doesn't say. """
+    try:
+        with open(get_checkpoint_file_name(source, checkpoint_dir), encoding='utf-8') as journal_file:
+            return json.loads(journal_file.readline()).get('orders_hash')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class RunCheckpoint:
+    """ Checkpoint of the runs of source (a spreadsheet id or an order file),
+    stored as a journal in checkpoint_dir. """
+
+    def __init__(self, source: str, input_hash: str, orders_hash: str = None,
+                 checkpoint_dir: str = settings.CHECKPOINT_DIR):
+        self.input_hash = input_hash
+        # Identifies the snapshot of the orders the run was planned on (see order_snapshot.py)
+        self.orders_hash = orders_hash
+        self.file_name = get_checkpoint_file_name(source, checkpoint_dir)
+        self._journal = None
+
+    def load(self) -> list:
+        """ Returns the entries (one per completed logistic) of the journal if it belongs to a run
+        on the same input, None otherwise. A last line left half written is ignored. """
+        try:
+            with open(self.file_name, encoding='utf-8') as journal_file:
+                header = json.loads(journal_file.readline())
+                if header.get('version') != CHECKPOINT_VERSION or header.get('input_hash') != self.input_hash:
+                    return None
+                entries = []
+                for line in journal_file:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        break
+        except (OSError, ValueError, AttributeError):
+            return None
+        return entries
+
+    def begin(self, entries: list = ()):
+        """ Starts the journal of a run, carrying on with entries (those of the run it resumes).
+        The file is replaced only once it has been fully written. """
+        os.makedirs(os.path.dirname(self.file_name), exist_ok=True)
+        temp_file_name = f'{self.file_name}.tmp'
+        with open(temp_file_name, 'w', encoding='utf-8') as journal_file:
+            journal_file.write(json.dumps({'version': CHECKPOINT_VERSION, 'input_hash': self.input_hash,
+                                           'orders_hash': self.orders_hash}) + '\n')
+            for entry in entries:
+                journal_file.write(json.dumps(entry) + '\n')
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        os.replace(temp_file_name, self.file_name)
+        self._journal = open(self.file_name, 'a', encoding='utf-8')
+
+    def append(self, entry: dict):
+        """ Adds the entry of a completed logistic to the journal. """
+        self._journal.write(json.dumps(entry) + '\n')
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def discard(self):
+        self.close()
+        try:
+            os.remove(self.file_name)
+        except FileNotFoundError:
+            pass
+
+
+if __name__ == '__main__':
+    pass
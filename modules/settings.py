@@ -1,8 +1,6 @@
 """ Contains some information necessary for the correct
 functioning of this algorithm. """
 
-from helper_modules import helper_functions
-
 WINDOW_TITLE = 'PED RiC'
 INFORMATION_JSON = '../app_info_json.json'
 TO_DO_COMBO_ITEMS = ['Sì (cancella vecchi ordini)', 'No (Aggiungi nuovi ordini)']
@@ -24,9 +22,151 @@ CLIENT_INFO_TABLE = 'Clients'
 
 MAX_PALLET_INFO = 6
 MAX_KIEVIT_INFO = 4
-WRITING_CONNECTION_NAME = f'{helper_functions.get_user_name()}_Writer'
+PALLET_TABLE_COLUMNS = ['Min_Value', 'Max_Value', 'Euro', 'Industrial',
+                        'Alternative_Euro', 'Poland_Euro']
+KIEVIT_TABLE_COLUMNS = ['Min_Value', 'Max_Value', 'Euro', 'Industrial']
+# WRITING_CONNECTION_NAME and READER_CONNECTION_NAME depend on the user: they're computed
+# the first time they're used (see __getattr__) so that importing settings doesn't look the user up
+_USER_CONNECTION_NAMES = {'WRITING_CONNECTION_NAME': '_Writer', 'READER_CONNECTION_NAME': '_Reader'}
 DATABASE_DRIVER = 'QSQLITE'
-READER_CONNECTION_NAME = f'{helper_functions.get_user_name()}_Reader'
+# How long a connection waits for another user's lock before giving up
+DATABASE_BUSY_TIMEOUT_MS = 10000
+
+# Local history of the plans written (see plan_history.py)
+USE_PLAN_HISTORY = True
+HISTORY_DATABASE_NAME = 'storico_pedane.sqlite'
+HISTORY_CONNECTION_NAME = 'Plan_History'
+
+# Max number of threads used for the jobs run in background (network calls, db refresh...)
+WORKER_POOL_SIZE = 4
+
+# Max number of threads used to fetch the inputs of a planning run concurrently
+PREFETCH_WORKERS = 4
+
+# Max number of planning jobs run at the same time by the job queue
+JOB_QUEUE_WORKERS = 4
+# Finished jobs are kept (e.g. for the daemon's /jobs endpoint) for FINISHED_JOB_TTL seconds,
+# at most MAX_FINISHED_JOBS of them
+FINISHED_JOB_TTL = 3600
+MAX_FINISHED_JOBS = 200
+
+# Max number of processes used by the what-if sweep over "Max cubotti per PED" (see what_if_sweep.py)
+SWEEP_WORKERS = 4
+
+# How a plan replaces the existing output of the order sheet (when overwriting):
+# 'full' clears order_range_sheet_to_be_cleared at the start of the run and appends all the rows at the end,
+# 'atomic' clears and writes at the end of the run in a single request,
+# 'diff' reads the output block and writes only the rows that changed (atomic rewrite if too many did).
+# Use 'diff' only if the range to be cleared is the output block (OUTPUT_COLUMNS columns from the writing range).
+# 'atomic' (and the rewrite of 'diff') writes cells as they are, not parsed like USER_ENTERED: only integers
+# and formulas are written as such, decimals and dates are written as text (see sheet_ranges.to_cell_data)
+SHEET_WRITE_MODE = 'full'
+OUTPUT_COLUMNS = 6
+# If more than this share of the rows changed, the whole output is rewritten
+DIFF_WRITE_MAX_CHANGED_SHARE = 0.5
+
+# Orders are read in windows of ORDER_READ_PAGE_ROWS rows.
+# Only the columns declared in order_schema.py are read
+ORDER_READ_PAGE_ROWS = 2000
+
+# Orders read in background when a link is entered in the GUI (ORDERS_PREFETCH_DELAY_MS
+# milliseconds after the user stops typing it) are used by the run only if it starts within
+# ORDERS_PREFETCH_MAX_AGE seconds from when they were read: older orders may have changed
+ORDERS_PREFETCH_DELAY_MS = 500
+ORDERS_PREFETCH_MAX_AGE = 5
+
+# The orders read from a spreadsheet are saved in ORDER_SNAPSHOT_DIR (see order_snapshot.py).
+# A run reads them from there instead of the sheet only when the user chooses to resume an
+# interrupted run (see run_checkpoint.py) and they are the orders its checkpoint was computed on,
+# or if ORDER_SNAPSHOT_OFFLINE (the sheet is never read: the orders may be out of date)
+USE_ORDER_SNAPSHOTS = False
+ORDER_SNAPSHOT_OFFLINE = False
+ORDER_SNAPSHOT_DIR = 'snapshot'
+
+# Planning daemon (see planning_daemon.py): it only listens on the local machine
+DAEMON_HOST = '127.0.0.1'
+DAEMON_PORT = 8765
+# Token the daemon's clients must send, created by the daemon in the user's profile (readable only by them)
+DAEMON_TOKEN_FILE = '~/.ped_daemon_token'
+# The only directory (and subdirectories) local order files can be submitted to the daemon from
+DAEMON_ORDER_FILE_DIR = '~/ordini_ped'
+# If True, the GUI submits its runs to the daemon when it's running
+USE_PLANNING_DAEMON = True
+DAEMON_POLL_SECONDS = 1
+# Clients stop waiting for a job of the daemon after this many seconds
+DAEMON_JOB_TIMEOUT = 1800
+
+# Local order files (csv) have the same columns as the order sheet.
+# The plan of an order file is written next to it, in a file whose name ends with LOCAL_PLAN_FILE_SUFFIX
+LOCAL_FILE_DELIMITER = ';'
+LOCAL_PLAN_FILE_SUFFIX = '_pedane.csv'
+
+# Where plans are written: 'sheet' (the sheet/file orders were read from), 'local'
+# (PLAN_EXPORT_DIR, in PLAN_EXPORT_FORMAT: 'parquet', 'arrow' or 'csv') and/or 'partitions'
+# (a tab of the order spreadsheet per OUTPUT_PARTITION_BY value, see output_partitions.py)
+PLAN_OUTPUT_TARGETS = ['sheet']
+PLAN_EXPORT_DIR = 'piani'
+PLAN_EXPORT_FORMAT = 'parquet'
+
+# What the 'partitions' output is split by: 'shipping_date' or 'channel'
+OUTPUT_PARTITION_BY = 'shipping_date'
+# Partition tabs are named PARTITION_SHEET_PREFIX followed by the date (or channel).
+# When overwriting, the tabs with this prefix that aren't partitions of the plan are deleted
+PARTITION_SHEET_PREFIX = 'PED '
+# Partitions written at the same time, and at most in a minute
+PARTITION_WRITE_WORKERS = 3
+PARTITION_WRITES_PER_MINUTE = 30
+
+# The GUI shows the plan (see plan_preview.py) and writes it only once the user confirms.
+# Runs with a preview are constructed locally, not on the planning daemon (USE_PLANNING_DAEMON
+# is ignored while the preview is on)
+PREVIEW_BEFORE_WRITE = False
+# Rows handed to the preview table at a time, as the user scrolls
+PREVIEW_FETCH_ROWS = 500
+# The preview filter is applied once the user stops typing for this long
+PREVIEW_FILTER_DELAY_MS = 250
+
+# After each logistic, planning runs append what it changed to a journal in CHECKPOINT_DIR
+# so that an interrupted run can be resumed (see run_checkpoint.py)
+USE_RUN_CHECKPOINTS = True
+CHECKPOINT_DIR = 'checkpoint'
+
+# Startup benchmark (see startup_benchmark.py): max time spent importing the GUI
+# and modules that mustn't be imported before the window is shown
+STARTUP_IMPORT_BUDGET_MS = 1500
+STARTUP_LAZY_MODULES = ['googleapiclient', 'google.auth', 'google.oauth2', 'google_auth_httplib2',
+                        'httplib2', 'pyarrow']
+
+# Search of the Euro/Industrial pallet mix of each logistic (see pallet_optimizer.py):
+# 'off', 'compare' (the range tables' suggestion is used, the search is only compared with it)
+# or 'use' (the search's mix is used when it needs fewer pallets or leaves fewer empty slots).
+# The search of a logistic stops after PALLET_OPTIMIZER_TIME_BUDGET seconds
+PALLET_OPTIMIZER_MODE = 'off'
+PALLET_OPTIMIZER_TIME_BUDGET = 0.05
+
+# Sheets API traffic (see sheets_cassette.py): 'live', 'record' (the requests and responses of
+# the runs since the program started are written to SHEETS_CASSETTE, replacing what it had) or 'replay' (responses are read from SHEETS_CASSETTE,
+# each one after its recorded latency times SHEETS_REPLAY_LATENCY_SCALE)
+SHEETS_TRAFFIC_MODE = 'live'
+SHEETS_CASSETTE = 'sheets_cassette.jsonl'
+SHEETS_REPLAY_LATENCY_SCALE = 1.0
+
+# Sheets API budget of a planning run (see api_usage.py): max requests, cells read and cells written.
+# When a run exceeds it, API_BUDGET_ACTION is 'warn' (the user is told) or 'refuse' (the run fails)
+API_BUDGET = {'requests': 300, 'cells_read': 500000, 'cells_written': 100000}
+API_BUDGET_ACTION = 'warn'
+# The API usage of the last API_USAGE_LOG_MAX_RUNS runs is kept in API_USAGE_LOG ('' to disable it)
+API_USAGE_LOG = 'api_usage.jsonl'
+API_USAGE_LOG_MAX_RUNS = 500
+
+# If PLACEMENT_TRACE, the last PLACEMENT_TRACE_SIZE placement decisions of each run are
+# dumped to PLACEMENT_TRACE_DIR (see placement_trace.py)
+PLACEMENT_TRACE = False
+PLACEMENT_TRACE_SIZE = 100000
+PLACEMENT_TRACE_DIR = 'trace'
+
+# Pallet ratios and capacities are handled as integers in RATIO_SCALE-ths of a box (see fixed_point.py)
+RATIO_SCALE = 100
 
 # Some info and functions related to pallets -
 # these are information that remain the same for a long time
@@ -63,5 +203,16 @@ POLAND_LOGISTICS = ['UPS Polska', 'Good Speed',
 # enters a value in the GUI
 POLAND_LOGISTICS_OVERWRITE = ['DPD Polska', 'UPS Polska', 'Good Speed']
 
+
+def __getattr__(name: str):
+    """ Computes the user's connection names on first use. """
+    if name not in _USER_CONNECTION_NAMES:
+        raise AttributeError(f"module 'settings' has no attribute '{name}'")
+    from helper_modules import helper_functions
+
+    globals()[name] = f'{helper_functions.get_user_name()}{_USER_CONNECTION_NAMES[name]}'
+    return globals()[name]
+
+
 if __name__ == '__main__':
     pass
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+""" Helpers for Google Sheet ranges in A1 notation (e.g. 'Ordini!A1:K'). """
+
+import re
+
+CELL_PATTERN = re.compile(r'^([A-Za-z]*)(\d*)$')
+
+
+def column_to_index(column: str) -> int:
+    """ Returns the 0 based index of column letters (A -> 0, Z -> 25, AA -> 26). """
+    index = 0
+    for letter in column.upper():
+        index = index * 26 + (ord(letter) - ord('A') + 1)
+    return index - 1
+
+
+def index_to_column(index: int) -> str:
+    """ Returns the column letters of a 0 based index (0 -> A, 26 -> AA). """
+    column = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        column = chr(ord('A') + remainder) + column
+    return column
+
+
+def quote_sheet_name(sheet_name: str) -> str:
+    """ Quotes sheet_name so that it can be used in a range. """
+    if re.fullmatch(r'[A-Za-z0-9_]+', sheet_name):
+        return sheet_name
+    escaped_name = sheet_name.replace("'", "''")
+    return f"'{escaped_name}'"
+
+
+def split_a1_range(a1_range: str) -> dict:
+    """ Splits a1_range into its sheet name, start/end columns and start/end rows.
+    Parts that aren't in a1_range are None (e.g. end_row of 'Ordini!A1:K'). """
+    if '!' in a1_range:
+        sheet_name, cells = a1_range.rsplit('!', 1)
+    else:
+        sheet_name, cells = a1_range, ''
+    if sheet_name.startswith("'") and sheet_name.endswith("'"):
+        sheet_name = sheet_name[1:-1].replace("''", "'")
+
+    parts = {'sheet_name': sheet_name, 'start_column': None, 'start_row': None,
+             'end_column': None, 'end_row': None}
+    if not cells:
+        return parts
+
+    start_cell, _, end_cell = cells.partition(':')
+    for prefix, cell in (('start', start_cell), ('end', end_cell)):
+        match = CELL_PATTERN.match(cell)
+        if not match:
+            continue
+        column, row = match.groups()
+        parts[f'{prefix}_column'] = column.upper() or None
+        parts[f'{prefix}_row'] = int(row) if row else None
+    return parts
+
+
+def build_a1_range(sheet_name: str, start_column: str = None, start_row: int = None,
+                   end_column: str = None, end_row: int = None) -> str:
+    """ Builds a range in A1 notation from its parts. """
+    start_cell = f"{start_column or ''}{start_row or ''}"
+    end_cell = f"{end_column or ''}{end_row or ''}"
+    if not start_cell and not end_cell:
+        return quote_sheet_name(sheet_name)
+    cells = f'{start_cell}:{end_cell}' if end_cell else start_cell
+    return f'{quote_sheet_name(sheet_name)}!{cells}'
+
+
+def to_grid_range(a1_range: str, sheet_ids: dict) -> dict:
+    """ Returns a1_range as a GridRange (as used by spreadsheets.batchUpdate).
+    sheet_ids is a dict where keys are sheet names and values are their sheetId. """
+    range_parts = split_a1_range(a1_range)
+    grid_range = {'sheetId': sheet_ids[range_parts['sheet_name']]}
+    if range_parts['start_row']:
+        grid_range['startRowIndex'] = range_parts['start_row'] - 1
+    if range_parts['end_row']:
+        grid_range['endRowIndex'] = range_parts['end_row']
+    if range_parts['start_column']:
+        grid_range['startColumnIndex'] = column_to_index(range_parts['start_column'])
+    if range_parts['end_column']:
+        grid_range['endColumnIndex'] = column_to_index(range_parts['end_column']) + 1
+    return grid_range
+
+
+def to_cell_data(value) -> dict:
+    """ Returns value as CellData: numbers (and strings made of digits) as numbers,
+    strings starting with = as formulas, anything else as text.
+    Unlike USER_ENTERED, decimals and dates written as strings are not parsed. """
+    if isinstance(value, bool):
+        return {'userEnteredValue': {'boolValue': value}}
+    if isinstance(value, (int, float)):
+        return {'userEnteredValue': {'numberValue': value}}
+    value = str(value)
+    if re.fullmatch(r'-?\d+', value):
+        return {'userEnteredValue': {'numberValue': int(value)}}
+    if value.startswith('='):
+        return {'userEnteredValue': {'formulaValue': value}}
+    return {'userEnteredValue': {'stringValue': value}}
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+""" Record and replay of the Sheets API traffic of planning runs.
+In 'record' mode every request sent to Google Sheets and its response are written
+to a cassette file (one json object per line), which is truncated when recording starts. In 'replay' mode the responses
+are read from the cassette instead of the network, after a simulated latency,
+so that a run recorded in production can be profiled offline.
+Both work at the http level: they replace the http object requests are executed
+with (see PlanningContext.get_http), PedApi doesn't know about them. """
+
+import json
+import os
+import threading
+import time
+
+# Self defined modules
+import settings
+
+
+def get_request_key(method: str, uri: str, body) -> str:
+    if isinstance(body, bytes):
+        body = body.decode('utf-8')
+    return f'{method} {uri} {body or ""}'
+
+
+class Cassette:
+    """ The interactions (requests and responses) recorded in file_name. """
+
+    def __init__(self, file_name: str = settings.SHEETS_CASSETTE):
+        self.file_name = file_name
+        self._lock = threading.Lock()
+        # Whether this cassette has recorded anything yet: the first interaction truncates the file
+        self._recording = False
+        # Responses not replayed yet, by request and by method and uri (see next_response)
+        self._responses = None
+        self._responses_by_uri = None
+
+    def record(self, method: str, uri: str, body, response, content: bytes, latency: float):
+        interaction = {'method': method, 'uri': uri,
+                       'body': body.decode('utf-8') if isinstance(body, bytes) else body,
+                       'status': response.status, 'headers': dict(response),
+                       'content': content.decode('utf-8'), 'latency': latency}
+        with self._lock:
+            with open(self.file_name, 'a' if self._recording else 'w', encoding='utf-8') as cassette_file:
+                cassette_file.write(json.dumps(interaction) + '\n')
+            self._recording = True
+
+    def load(self):
+        with self._lock:
+            self._responses = {}
+            self._responses_by_uri = {}
+            if not os.path.exists(self.file_name):
+                raise FileNotFoundError(f'Cassetta {self.file_name} non trovata')
+            with open(self.file_name, encoding='utf-8') as cassette_file:
+                for line in cassette_file:
+                    if not line.strip():
+                        continue
+                    interaction = json.loads(line)
+                    key = get_request_key(interaction['method'], interaction['uri'], interaction['body'])
+                    self._responses.setdefault(key, []).append(interaction)
+                    self._responses_by_uri.setdefault(f"{interaction['method']} {interaction['uri']}",
+                                                      []).append(interaction)
+
+    def next_response(self, method: str, uri: str, body) -> dict:
+        """ Returns the first recorded interaction of the request not replayed yet.
+        Requests are matched on method, uri and body; if the body doesn't match
+        (e.g. the plan written changed) on method and uri only. """
+        if self._responses is None:
+            self.load()
+        with self._lock:
+            for responses, key in ((self._responses, get_request_key(method, uri, body)),
+                                   (self._responses_by_uri, f'{method} {uri}')):
+                if responses.get(key):
+                    interaction = responses[key].pop(0)
+                    self._discard(interaction)
+                    return interaction
+        raise LookupError(f'Nessuna risposta registrata per {method} {uri}')
+
+    def _discard(self, interaction: dict):
+        """ Removes interaction from both indexes, so that it's replayed only once. """
+        for responses, key in ((self._responses, get_request_key(interaction['method'], interaction['uri'],
+                                                                 interaction['body'])),
+                               (self._responses_by_uri, f"{interaction['method']} {interaction['uri']}")):
+            if interaction in responses.get(key, []):
+                responses[key].remove(interaction)
+
+
+class RecordingHttp:
+    """ Sends requests with http and records them in cassette. """
+
+    def __init__(self, http, cassette: Cassette):
+        self.http = http
+        self.cassette = cassette
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        request_start = time.perf_counter()
+        response, content = self.http.request(uri, method=method, body=body, headers=headers, **kwargs)
+        self.cassette.record(method=method, uri=uri, body=body, response=response, content=content,
+                             latency=time.perf_counter() - request_start)
+        return response, content
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
+
+
+class ReplayHttp:
+    """ Answers requests with the responses recorded in cassette.
+    Each response is delayed by its recorded latency times latency_scale (0 for no delay). """
+
+    def __init__(self, cassette: Cassette, latency_scale: float = settings.SHEETS_REPLAY_LATENCY_SCALE):
+        self.cassette = cassette
+        self.latency_scale = latency_scale
+        # Read by googleapiclient when the service is built
+        self.timeout = None
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        interaction = self.cassette.next_response(method=method, uri=uri, body=body)
+        if self.latency_scale:
+            time.sleep(interaction['latency'] * self.latency_scale)
+        import httplib2
+
+        response = httplib2.Response(dict(interaction['headers'], status=str(interaction['status'])))
+        return response, interaction['content'].encode('utf-8')
+
+
+if __name__ == '__main__':
+    pass
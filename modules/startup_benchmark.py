@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+""" Measures the time spent importing the GUI with python -X importtime and
+fails (exit code 1) if it exceeds settings.STARTUP_IMPORT_BUDGET_MS or if any
+module of settings.STARTUP_LAZY_MODULES is imported before the window is shown.
+Run it from the modules directory:
+    python startup_benchmark.py [--module main_window] [--runs 5] [--top 15] """
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# Self defined modules
+import settings
+
+
+def measure_imports(module: str) -> dict:
+    """ Imports module in a new interpreter and returns the cumulative import time
+    (microseconds) of each module it imported. """
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                               capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if completed.returncode:
+        raise RuntimeError(f'Import di {module} fallito:\n{completed.stderr}')
+
+    import_times = {}
+    for line in completed.stderr.splitlines():
+        # e.g. "import time:       120 |        450 |   settings"
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, imported_module = line[len('import time:'):].split('|')
+        import_times[imported_module.strip()] = int(cumulative)
+    return import_times
+
+
+def get_lazy_modules_imported(import_times: dict, lazy_modules: list) -> list:
+    return sorted(imported_module for imported_module in import_times
+                  if any(imported_module == lazy_module or imported_module.startswith(f'{lazy_module}.')
+                         for lazy_module in lazy_modules))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup import time of the GUI')
+    parser.add_argument('--module', default='main_window', help='Module imported at startup')
+    parser.add_argument('--runs', type=int, default=5, help='Number of measures (the median is used)')
+    parser.add_argument('--top', type=int, default=15, help='Number of slowest modules shown')
+    parser.add_argument('--budget-ms', type=float, default=settings.STARTUP_IMPORT_BUDGET_MS)
+    args = parser.parse_args()
+
+    runs = [measure_imports(args.module) for _ in range(args.runs)]
+    total_ms = statistics.median(run[args.module] for run in runs) / 1000
+
+    print(f'Import di {args.module}: {total_ms:.1f} ms (mediana di {args.runs}, budget {args.budget_ms:.0f} ms)')
+    for imported_module, cumulative in sorted(runs[-1].items(), key=lambda item: item[1],
+                                              reverse=True)[:args.top]:
+        print(f'{cumulative / 1000:>10.1f} ms  {imported_module}')
+
+    lazy_imported = get_lazy_modules_imported(runs[-1], settings.STARTUP_LAZY_MODULES)
+    if lazy_imported:
+        print(f"Moduli da importare solo quando servono: {', '.join(lazy_imported)}")
+    return 1 if lazy_imported or total_ms > args.budget_ms else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
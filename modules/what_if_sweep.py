@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+""" What-if sweep over the "Max cubotti per PED" value.
+The inputs of a plan (orders, pallet dict and pallet range tables) are read once,
+then the plan is constructed in dry run (nothing is written) for each value of
+user_max_boxes, on a pool of processes. For each value the sweep reports how many
+pallets the plan needs, how full they are and how many order lines are split
+across pallets, so that a value can be chosen before the plan is written. """
+
+import copy
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from helper_modules import helper_functions
+
+# Self defined modules
+import settings
+from api_communicator import PedApi
+from order_schema import PRODUCT_CODE
+from plan_exporter import get_pallet_rows
+
+# Inputs of the plan, set in each process of the pool by _init_worker
+_SWEEP_INPUTS = None
+
+
+def get_plan_stats(final_data: list, placement_details: list, pallet_loads: dict) -> dict:
+    """ Returns the number of pallets and boxes of a plan, the fill rate of its pallets
+    (space occupied over capacity, pallets whose capacity is unknown like ADP ones excluded)
+    and the number of order lines split across more than one pallet. """
+    pallet_rows = get_pallet_rows(final_data)
+    line_pallets = {}
+    for placement, (logistic, client_order) in zip(final_data, placement_details):
+        line_pallets.setdefault((logistic, client_order, placement[PRODUCT_CODE]), set()).add(placement[2])
+
+    loads = [pallet_loads[pallet_row[1]] for pallet_row in pallet_rows if pallet_row[1] in pallet_loads]
+    capacity = sum(load[0] for load in loads)
+    return {
+        'pallets': len(pallet_rows),
+        'boxes': sum(pallet_row[5] for pallet_row in pallet_rows),
+        'fill_rate': sum(load[1] for load in loads) / capacity if capacity else None,
+        'split_lines': sum(1 for pallets in line_pallets.values() if len(pallets) > 1),
+    }
+
+
+def read_sweep_inputs(source: str, overwrite_data: bool = True) -> dict:
+    """ Reads (without writing or clearing anything) the inputs of the plan of source,
+    a Google Sheet link or a local order file. """
+    if os.path.isfile(source):
+        pallet_api = PedApi(order_file=source, for_pallets=True, overwrite_data=overwrite_data, dry_run=True)
+    elif helper_functions.get_sheet_id(google_sheet_link=source):
+        pallet_api = PedApi(order_spreadsheet=source, for_pallets=True, overwrite_data=overwrite_data,
+                            dry_run=True)
+    else:
+        raise ValueError('Link o file non valido')
+    pallet_api.prepare_run()
+    return {'all_orders': pallet_api.all_orders, 'pallet_dict': pallet_api.pallet_dict,
+            'range_tables': pallet_api.range_tables, 'overwrite_data': overwrite_data}
+
+
+def simulate_plan(inputs: dict, user_max_boxes: int) -> dict:
+    """ Constructs the plan of inputs (see read_sweep_inputs) in dry run and returns its stats. """
+    # Placing orders consumes them: every simulation works on its own copy
+    inputs = copy.deepcopy(inputs)
+    pallet_api = PedApi(overwrite_data=inputs['overwrite_data'], user_max_boxes=user_max_boxes, dry_run=True)
+    pallet_api.all_orders = inputs['all_orders']
+    pallet_api.pallet_dict = inputs['pallet_dict']
+    pallet_api.range_tables = inputs['range_tables']
+    pallet_api.construct_pallets()
+
+    stats = get_plan_stats(final_data=pallet_api.final_data, placement_details=pallet_api.placement_details,
+                           pallet_loads=pallet_api.pallet_loads)
+    stats.update(user_max_boxes=user_max_boxes, status=pallet_api.run_status,
+                 orders_left=len(pallet_api.all_orders))
+    return stats
+
+
+def _init_worker(inputs: dict):
+    global _SWEEP_INPUTS
+    _SWEEP_INPUTS = inputs
+
+
+def _simulate_in_worker(user_max_boxes: int) -> dict:
+    return simulate_plan(inputs=_SWEEP_INPUTS, user_max_boxes=user_max_boxes)
+
+
+def run_sweep(inputs: dict, max_boxes_values: list, workers: int = settings.SWEEP_WORKERS) -> list:
+    """ Simulates the plan of inputs for each value of max_boxes_values, on workers processes.
+    Returns the stats of each simulation, in the order of max_boxes_values. """
+    max_boxes_values = list(dict.fromkeys(max_boxes_values))
+    if workers <= 1 or len(max_boxes_values) == 1:
+        return [simulate_plan(inputs=inputs, user_max_boxes=value) for value in max_boxes_values]
+
+    # The inputs are sent once per process instead of once per value
+    with ProcessPoolExecutor(max_workers=min(workers, len(max_boxes_values)), initializer=_init_worker,
+                             initargs=(inputs,)) as executor:
+        return list(executor.map(_simulate_in_worker, max_boxes_values))
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+""" Runs blocking jobs (network calls, database refreshes...) on a reusable
+thread pool so that the GUI thread stays responsive. """
+
+from PyQt5.QtCore import pyqtSignal, QObject, QRunnable, QThreadPool
+
+# Self defined modules
+import settings
+
+_THREAD_POOL = None
+
+
+def get_thread_pool() -> QThreadPool:
+    """ Returns the thread pool shared by all the jobs of the app. """
+    global _THREAD_POOL
+    if _THREAD_POOL is None:
+        _THREAD_POOL = QThreadPool()
+        _THREAD_POOL.setMaxThreadCount(settings.WORKER_POOL_SIZE)
+    return _THREAD_POOL
+
+
+class WorkerSignals(QObject):
+    """ Signals emitted by a Worker.
+    They are emitted from the pool thread and delivered to the GUI thread. """
+
+    result = pyqtSignal(object)
+    error = pyqtSignal(str)
+    finished = pyqtSignal()
+
+
+class Worker(QRunnable):
+    """ Runs job(*args, **kwargs) on a thread of the pool. """
+
+    def __init__(self, job, *args, **kwargs):
+        super(Worker, self).__init__()
+        self.job = job
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+
+    def run(self):
+        try:
+            job_result = self.job(*self.args, **self.kwargs)
+        except Exception as error:
+            self.signals.error.emit(str(error))
+        else:
+            self.signals.result.emit(job_result)
+        finally:
+            self.signals.finished.emit()
+
+    def start(self):
+        """ Queues this worker on the shared thread pool. """
+        get_thread_pool().start(self)
+
+
+if __name__ == '__main__':
+    pass